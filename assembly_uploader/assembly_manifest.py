@@ -15,30 +15,208 @@
 # limitations under the License.
 
 import argparse
+import asyncio
 import csv
-import hashlib
 import logging
 import os
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
 
-from .ena_queries import EnaQuery
+from requests.exceptions import RequestException
+
+from .checksums import (
+    CHECKSUM_CACHE_FILENAME,
+    HASH_BUFFER_SIZE,
+    ChecksumCache,
+    get_md5,
+    hash_file,
+)
+from .ena_cache import add_ena_cache_args, ena_cache_from_args
+from .ena_queries import (
+    DEFAULT_RETRY_POLICY,
+    RUN_BATCH_SIZE,
+    AsyncEnaRunsQuery,
+    EnaQuery,
+    EnaRunsQuery,
+    accession_type,
+    get_session,
+)
+from .fasta_stats import STATS_FIELDS, FastaStats
+from .file_utils import atomic_write
+from .ledger import PROD, add_ledger_args, endpoint_name, ledger_from_args
+from .metrics import REQUEST_METRICS, add_metrics_args, write_metrics_from_args
+from .run_journal import FAILED, HASHED, JOURNAL_FILENAME, QUERIED, WRITTEN, RunJournal
+from .webin_utils import get_optional_webin_credentials
 
 logging.basicConfig(level=logging.INFO)
 
+#   default number of batched ENA lookups in flight in AsyncAssemblyManifestGenerator
+ASYNC_CONCURRENCY = 8
+
+INDEX_FIELDS = ("run", "manifest", "assembly_name", "md5", "size", "status")
+
 
 def parse_info(data_file):
-    csvfile = open(data_file, newline="")
-    csvdict = csv.DictReader(csvfile)
-    return csvdict
+    """
+    Stream the rows of the assemblies CSV. The file is closed once all rows are read.
+    """
+    with open(data_file, newline="") as csvfile:
+        yield from csv.DictReader(csvfile)
+
+
+def write_study_runs_csv(study, csv_path, private=False, session=None):
+    """
+    Start an assemblies CSV from the runs of a study: one row per run, with the other columns to be filled in.
+    The runs are streamed from ENA and written as they arrive.
+    :param study: raw reads study accession
+    :param csv_path: path of the CSV to write
+    :param private: is this a private study?
+    :param session: requests.Session for the ENA requests, default is the shared session
+    :return: number of runs written
+    """
+    count = 0
+    with atomic_write(csv_path, newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(("Run", "Coverage", "Assembler", "Version", "Filepath"))
+        for run in EnaQuery(study, private, session=session).list_run_records():
+            writer.writerow((run.run_accession, "", "", "", ""))
+            count += 1
+    logging.info(f"Listed {count} runs of {study} in {csv_path}")
+    return count
+
+
+def read_manifest_index(index_path):
+    """
+    :param index_path: path of a {study}_manifests.tsv index written by AssemblyManifestGenerator.
+        Its manifest paths are relative to the directory of the index
+    :return: dict of run accession to index row, empty if the index does not exist
+    """
+    return _read_runs_tsv(index_path)
+
+
+def _read_runs_tsv(tsv_path):
+    try:
+        with open(tsv_path, newline="") as tsv_file:
+            return {row["run"]: row for row in csv.DictReader(tsv_file, delimiter="\t")}
+    except FileNotFoundError:
+        return {}
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def imap_bounded(func, iterable, workers=1, max_pending=None):
+    """
+    Apply func to each item in a pool of worker threads, yielding results as they complete.
+    Items are only pulled from the iterable while fewer than max_pending are in flight,
+    so chaining these generators gives a streaming pipeline with bounded queues between the stages.
+    Exceptions raised by func are raised to the consumer.
+    :param func: function applied to each item
+    :param iterable: input items, consumed lazily
+    :param workers: number of worker threads
+    :param max_pending: maximum number of items submitted but not yet yielded. Default 2 * workers
+    """
+    max_pending = max_pending or 2 * workers
+    iterator = iter(iterable)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            for item in islice(iterator, max_pending - len(pending)):
+                pending.add(executor.submit(func, item))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def add_manifest_args(parser):
+    """
+    Add the options of AssemblyManifestGenerator that do not identify the study, shared with the pipeline.
+    """
+    parser.add_argument(
+        "--force",
+        help="overwrite all existing manifests",
+        required=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of assemblies to hash in parallel. The largest assemblies of each batch of "
+        f"{RUN_BATCH_SIZE} runs are hashed first. Default 1",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        help=f"number of concurrent ENA lookups, each resolving up to {RUN_BATCH_SIZE} runs. Default 1",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--hash-buffer-mb",
+        help=f"read size in MiB used when hashing assemblies. Default {HASH_BUFFER_SIZE // 2**20}",
+        type=int,
+        default=HASH_BUFFER_SIZE // 2**20,
+    )
+    parser.add_argument(
+        "--mmap",
+        help="memory-map assemblies when hashing them instead of reading them",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--no-checksum-cache",
+        help=f"rehash every assembly instead of reusing checksums cached in {{study}}_upload/{CHECKSUM_CACHE_FILENAME}",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--stats",
+        help="validate the gzip and collect contig statistics of each assembly while hashing it, "
+        "into {study}_upload/{study}_assembly_stats.tsv. Invalid assemblies get no manifest",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--resume",
+        help="journal progress in {study}_upload, skip runs completed by a previous run, "
+        "carry on past failed runs and write them to {study}_upload/{study}_retry.csv",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--prefetch",
+        help="list all runs of the study in one streamed request (or a few paged requests with --private) "
+        "instead of querying the runs in batches",
+        action="store_true",
+        default=False,
+    )
 
 
-def get_md5(path_to_file):
-    md5_hash = hashlib.md5()
-    with open(path_to_file, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            md5_hash.update(chunk)
-    return md5_hash.hexdigest()
+def manifest_options_from_args(args):
+    """
+    :return: dict of the AssemblyManifestGenerator arguments of the add_manifest_args options
+    """
+    return {
+        "force": args.force,
+        "workers": args.workers,
+        "fetch_workers": args.fetch_workers,
+        "hash_buffer_size": args.hash_buffer_mb * 2**20,
+        "use_mmap": args.mmap,
+        "checksum_cache": not args.no_checksum_cache,
+        "fasta_stats": args.stats,
+        "resume": args.resume,
+        "prefetch": args.prefetch,
+    }
 
 
 def parse_args(argv):
@@ -55,12 +233,6 @@ def parse_args(argv):
         "Must exist in the webin account",
         required=False,
     )
-    parser.add_argument(
-        "--force",
-        help="overwrite all existing manifests",
-        required=False,
-        action="store_true",
-    )
     parser.add_argument("--output-dir", help="Path to output directory", required=False)
     parser.add_argument(
         "--private",
@@ -75,9 +247,108 @@ def parse_args(argv):
         action="store_true",
         default=False,
     )
+    add_manifest_args(parser)
+    parser.add_argument(
+        "--list-runs",
+        help="write the runs of --study to this CSV, as a template for --data, and exit",
+        required=False,
+    )
+    add_ena_cache_args(parser)
+    add_ledger_args(parser)
+    parser.add_argument(
+        "--ledger-test",
+        help="take the assembly study registered in the ENA test service from --ledger",
+        action="store_true",
+        default=False,
+    )
+    add_metrics_args(parser)
     return parser.parse_args(argv)
 
 
+class _ManifestRun:
+    def __init__(self, generator):
+        """
+        Bookkeeping of one write_manifests call: run journal, failed rows, FASTA statistics and hashing throughput.
+        """
+        self.journal = (
+            RunJournal(generator.upload_dir / JOURNAL_FILENAME)
+            if generator.resume
+            else None
+        )
+        self.completed = self.journal.completed() if self.journal else set()
+        self.index_path = generator.manifest_index
+        self.index = read_manifest_index(self.index_path)
+        self.failed_rows = []
+        self.hashed = []
+        self.stats_path = generator.stats_tsv if generator.fasta_stats else None
+        #   run accession -> statistics row, including the runs of previous calls
+        self.stats = _read_runs_tsv(self.stats_path) if self.stats_path else {}
+
+    def record(self, run_id, status, message=""):
+        if self.journal:
+            self.journal.record(run_id, status, message)
+
+    def fail(self, row, reason):
+        logging.error(f"Run {row['Run']} failed: {reason}")
+        self.failed_rows.append(row)
+        self.record(row["Run"], FAILED, reason)
+        self.index[row["Run"]] = {"run": row["Run"], "status": FAILED}
+
+    def skip(self, row, manifest_path):
+        #   keep what a previous run recorded about the manifest
+        if row["Run"] not in self.index:
+            self.index[row["Run"]] = {
+                "run": row["Run"],
+                "manifest": self._index_entry(manifest_path),
+                "status": "existing",
+            }
+
+    def written(self, row, manifest_path, md5):
+        self.record(row["Run"], WRITTEN)
+        self.index[row["Run"]] = {
+            "run": row["Run"],
+            "manifest": self._index_entry(manifest_path),
+            "assembly_name": f"{row['Run']}_{md5}",
+            "md5": md5,
+            "size": os.path.getsize(row["Filepath"]),
+            "status": WRITTEN,
+        }
+
+    def _index_entry(self, manifest_path):
+        #   relative to the index, so that the index stays valid wherever it is read from
+        return os.path.relpath(manifest_path, self.index_path.parent)
+
+    def write_index(self):
+        with atomic_write(self.index_path, newline="") as index_file:
+            writer = csv.DictWriter(
+                index_file, fieldnames=INDEX_FIELDS, delimiter="\t", restval=""
+            )
+            writer.writeheader()
+            writer.writerows(self.index.values())
+
+    def write_stats(self, row, stats):
+        self.stats[row["Run"]] = {
+            "run": row["Run"],
+            "assembly": row["Filepath"],
+            **stats,
+        }
+
+    def write_stats_tsv(self):
+        with atomic_write(self.stats_path, newline="") as stats_file:
+            writer = csv.DictWriter(
+                stats_file,
+                fieldnames=("run", "assembly", *STATS_FIELDS),
+                delimiter="\t",
+                restval="",
+            )
+            writer.writeheader()
+            writer.writerows(self.stats.values())
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+
+
 class AssemblyManifestGenerator:
     def __init__(
         self,
@@ -88,6 +359,19 @@ class AssemblyManifestGenerator:
         force: bool = False,
         private: bool = False,
         tpa: bool = False,
+        workers: int = 1,
+        hash_buffer_size: int = HASH_BUFFER_SIZE,
+        use_mmap: bool = False,
+        checksum_cache: bool = True,
+        resume: bool = False,
+        fetch_workers: int = 1,
+        fasta_stats: bool = False,
+        session=None,
+        retry_policy=None,
+        ena_cache=None,
+        prefetch: bool = False,
+        ledger=None,
+        ledger_endpoint: str = PROD,
     ):
         """
         Create an assembly manifest file for uploading assemblies detailed in assemblies_csv into the assembly_study.
@@ -98,10 +382,27 @@ class AssemblyManifestGenerator:
         :param force: overwrite existing manifests
         :param private: is this a private study?
         :param tpa: is this a third-party assembly?
-
+        :param workers: number of assemblies to hash in parallel
+        :param hash_buffer_size: number of bytes read per call when hashing assemblies
+        :param use_mmap: memory-map assemblies when hashing them
+        :param checksum_cache: reuse the checksums of unchanged assemblies from previous runs
+        :param resume: journal the progress of each run, skip runs completed by a previous run,
+            carry on past failed runs and write the failed rows to {study}_retry.csv
+        :param fetch_workers: number of concurrent ENA lookups
+        :param fasta_stats: check the gzip and collect contig statistics of each assembly in the hashing pass
+        :param session: requests.Session for the ENA lookups, default is the shared session
+        :param retry_policy: RetryPolicy of the ENA lookups, default is the process-wide policy
+        :param ena_cache: EnaResponseCache of the run metadata, default is no cache
+        :param prefetch: list all the runs of the study before generating the manifests, instead of querying
+            them in batches: a streamed portal search for a public study, or a few paged Webin report requests
+            for a private study
+        :param ledger: SubmissionLedger to look the assembly study up in, when assembly_study is not given
+        :param ledger_endpoint: look up the assembly study registered in this drop-box, DEV or PROD
         """
         self.study = study
+        self.assemblies_csv = assemblies_csv
         self.metadata = parse_info(assemblies_csv)
+        self.retry_csv = None
         self.new_project = assembly_study
 
         self.upload_dir = (output_dir or Path(".")) / Path(f"{self.study}_upload")
@@ -110,6 +411,97 @@ class AssemblyManifestGenerator:
         self.force = force
         self.private = private
         self.tpa = tpa
+        self.workers = workers
+        self.hash_buffer_size = hash_buffer_size
+        self.use_mmap = use_mmap
+        self.checksum_cache = (
+            ChecksumCache(self.upload_dir / CHECKSUM_CACHE_FILENAME)
+            if checksum_cache
+            else None
+        )
+        self.resume = resume
+        self.fetch_workers = fetch_workers
+        self.fasta_stats = fasta_stats
+        self.session = session or get_session()
+        self.auth = get_optional_webin_credentials()
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.ena_cache = ena_cache
+        self.prefetch = prefetch
+        self.prefetched_runs = {}
+        self.stats_tsv = self.upload_dir / f"{self.study}_assembly_stats.tsv"
+        self.manifest_index = self.upload_dir / f"{self.study}_manifests.tsv"
+        if self.new_project is None and ledger is not None:
+            self.new_project = self._assembly_study_from_ledger(ledger, ledger_endpoint)
+
+    def _assembly_study_from_ledger(self, ledger, endpoint):
+        accession = ledger.find_study(self.study, endpoint)
+        if accession is None:
+            #   ledgers rebuilt from the Webin reports only know the primary accession of the raw reads study
+            study = EnaQuery(
+                self.study,
+                self.private,
+                self.session,
+                self.auth,
+                self.retry_policy,
+                self.ena_cache,
+            ).build_record()
+            accession = ledger.find_study(study.study_accession, endpoint)
+        if accession is None:
+            raise ValueError(
+                f"No assembly study of {self.study} in the {endpoint} ledger {ledger.db_path}"
+            )
+        logging.info(
+            f"Using the assembly study {accession} of {self.study} from the ledger"
+        )
+        return accession
+
+    def _manifest_path(self, run_id):
+        return os.path.join(self.upload_dir, f"{run_id}.manifest")
+
+    @staticmethod
+    def _assembly_error(run_id, assembly_path):
+        if not os.path.exists(assembly_path):
+            return f"Assembly path {assembly_path} does not exist. Skipping manifest for run {run_id}"
+        substrings = ["fa.gz", "fna.gz", "fasta.gz"]
+        if not any(substring in assembly_path for substring in substrings):
+            return (
+                f"Assembly file {assembly_path} is either not fasta format or not compressed for run "
+                f"{run_id}."
+            )
+
+    def get_checksum(self, assembly_path):
+        """
+        Checksum an assembly, reusing the cached checksum of an unchanged file.
+        With fasta_stats, the FASTA statistics are collected in the same read pass.
+        :param assembly_path: path of the assembly
+        :return: md5 hex digest, FASTA statistics (or None) and FileHash if the file was read (or None if cached)
+        """
+        cached = (
+            self.checksum_cache.lookup(assembly_path) if self.checksum_cache else None
+        )
+        if cached:
+            md5, stats = cached
+            if md5 and (stats or not self.fasta_stats):
+                return md5, stats if self.fasta_stats else None, None
+        stat = os.stat(assembly_path)
+        fasta_stats = FastaStats() if self.fasta_stats else None
+        file_hash = hash_file(
+            assembly_path,
+            self.hash_buffer_size,
+            self.use_mmap,
+            consumers=[fasta_stats.update] if fasta_stats else [],
+        )
+        stats = fasta_stats.finish().summary() if fasta_stats else None
+        if self.checksum_cache:
+            self.checksum_cache.put(assembly_path, file_hash.md5, stat, stats)
+        return file_hash.md5, stats, file_hash
+
+    def close(self):
+        """
+        Close the checksum cache.
+        """
+        if self.checksum_cache:
+            self.checksum_cache.close()
 
     def generate_manifest(
         self,
@@ -120,31 +512,26 @@ class AssemblyManifestGenerator:
         assembler,
         assembler_version,
         assembly_path,
+        assembly_md5=None,
     ):
         logging.info("Writing manifest for " + run_id)
         #   sanity check assembly file provided
-        if not os.path.exists(assembly_path):
-            logging.error(
-                f"Assembly path {assembly_path} does not exist. Skipping manifest for run {run_id}"
-            )
-            return
-        substrings = ["fa.gz", "fna.gz", "fasta.gz"]
-        if not any(substring in assembly_path for substring in substrings):
-            logging.error(
-                f"Assembly file {assembly_path} is either not fasta format or not compressed for run "
-                f"{run_id}."
-            )
+        assembly_error = self._assembly_error(run_id, assembly_path)
+        if assembly_error:
+            logging.error(assembly_error)
             return
-        #   collect variables
-        assembly_alias = get_md5(assembly_path)
-        assembler = f"{assembler} v{assembler_version}"
-        manifest_path = os.path.join(self.upload_dir, f"{run_id}.manifest")
-        #   skip existing manifests
+        manifest_path = self._manifest_path(run_id)
+        #   skip existing manifests, before spending time on hashing
         if os.path.exists(manifest_path) and not self.force:
             logging.warning(
                 f"Manifest for {run_id} already exists at {manifest_path}. Skipping"
             )
             return
+        #   collect variables
+        assembly_alias = assembly_md5 or get_md5(
+            assembly_path, self.hash_buffer_size, self.use_mmap
+        )
+        assembler = f"{assembler} v{assembler_version}"
         values = (
             ("STUDY", self.new_project),
             ("SAMPLE", sample),
@@ -158,24 +545,316 @@ class AssemblyManifestGenerator:
             ("TPA", str(self.tpa).lower()),
         )
         logging.info("Writing manifest file (.manifest) for " + run_id)
-        with open(manifest_path, "w") as outfile:
+        #   never leave a truncated manifest behind, it would be skipped as existing on the next run
+        with atomic_write(manifest_path) as outfile:
             for k, v in values:
                 manifest = f"{k}\t{v}\n"
                 outfile.write(manifest)
+        return manifest_path
 
-    def write_manifests(self):
+    def _fetch_batch(self, rows):
+        ena_query = EnaRunsQuery(
+            [row["Run"] for row in rows],
+            self.private,
+            session=self.session,
+            auth=self.auth,
+            retry_policy=self.retry_policy,
+            cache=self.ena_cache,
+            prefetched=self.prefetched_runs,
+        )
+        return rows, ena_query, ena_query.build_records(raise_errors=not self.resume)
+
+    def _pending_rows(self, manifest_run):
+        #   skip finished runs before any network or hashing work
+        skipped = 0
         for row in self.metadata:
-            ena_query = EnaQuery(row["Run"], self.private)
-            ena_metadata = ena_query.build_query()
-            self.generate_manifest(
+            if accession_type(row["Run"]) != "run_accession":
+                if not self.resume:
+                    raise ValueError(f"{row['Run']} is not a valid run accession")
+                manifest_run.fail(row, "not a valid run accession")
+                continue
+            manifest_path = self._manifest_path(row["Run"])
+            if row["Run"] in manifest_run.completed and os.path.exists(manifest_path):
+                manifest_run.skip(row, manifest_path)
+                skipped += 1
+                continue
+            if os.path.exists(manifest_path) and not self.force:
+                logging.warning(
+                    f"Manifest for {row['Run']} already exists at {manifest_path}. Skipping"
+                )
+                manifest_run.skip(row, manifest_path)
+                continue
+            yield row
+        if skipped:
+            logging.info(f"Skipped {skipped} runs completed by a previous run")
+
+    def _accept_metadata(self, manifest_run, row, ena_metadata, error=None):
+        if ena_metadata is None:
+            manifest_run.fail(row, f"no ENA metadata: {error}")
+            return False
+        manifest_run.record(row["Run"], QUERIED)
+        assembly_error = self._assembly_error(row["Run"], row["Filepath"])
+        if assembly_error:
+            manifest_run.fail(row, assembly_error)
+            return False
+        return True
+
+    def _checksum_or_error(self, assembly_path):
+        try:
+            return self.get_checksum(assembly_path)
+        except OSError as e:
+            if not self.resume:
+                raise
+            return e
+
+    def _accept_checksum(self, manifest_run, row, checksum_result):
+        if isinstance(checksum_result, OSError):
+            manifest_run.fail(
+                row, f"could not hash {row['Filepath']}: {checksum_result}"
+            )
+            return None
+        md5, stats, file_hash = checksum_result
+        if file_hash:
+            manifest_run.hashed.append(file_hash)
+        if stats:
+            manifest_run.write_stats(row, stats)
+            if stats["error"]:
+                manifest_run.fail(
+                    row, f"invalid assembly {row['Filepath']}: {stats['error']}"
+                )
+                return None
+        manifest_run.record(row["Run"], HASHED)
+        return md5
+
+    def _write_row(self, manifest_run, row, ena_metadata, md5):
+        try:
+            manifest_path = self.generate_manifest(
                 row["Run"],
-                ena_metadata["sample_accession"],
-                ena_metadata["instrument_model"],
+                ena_metadata.sample_accession,
+                ena_metadata.instrument_model,
                 row["Coverage"],
                 row["Assembler"],
                 row["Version"],
                 row["Filepath"],
+                assembly_md5=md5,
+            )
+        except (OSError, KeyError) as e:
+            if not self.resume:
+                raise
+            manifest_run.fail(row, str(e))
+            return
+        if manifest_path:
+            manifest_run.written(row, manifest_path, md5)
+
+    def _finish(self, manifest_run):
+        manifest_run.write_index()
+        logging.info(f"Manifest index written to {self.manifest_index}")
+        if manifest_run.stats_path:
+            manifest_run.write_stats_tsv()
+        if manifest_run.hashed:
+            size = sum(file_hash.size for file_hash in manifest_run.hashed)
+            seconds = sum(file_hash.seconds for file_hash in manifest_run.hashed)
+            logging.info(
+                f"Hashed {len(manifest_run.hashed)} assemblies ({size / 1e6:.1f} MB) "
+                f"at {size / 1e6 / max(seconds, 1e-9):.1f} MB/s per hashing worker"
+            )
+        request_count, seconds = REQUEST_METRICS.summary()
+        if request_count:
+            logging.info(
+                f"Sent {request_count} ENA requests, waiting {seconds:.2f}s on them in total"
+            )
+        retry_metrics = self.retry_policy.metrics.as_dict()
+        if retry_metrics["retries"] or retry_metrics["breaker_opened"]:
+            logging.warning(f"ENA requests were retried: {retry_metrics}")
+        if self.checksum_cache:
+            self.checksum_cache.prune()
+        if self.resume:
+            self._write_retry_csv(manifest_run.failed_rows)
+
+    def _prefetch_runs(self):
+        if not self.prefetch:
+            return
+        #   only keep the runs of the CSV, so a study with many more runs does not fill memory
+        runs = {row["Run"] for row in parse_info(self.assemblies_csv)}
+        try:
+            study_runs = EnaQuery(
+                self.study,
+                self.private,
+                session=self.session,
+                auth=self.auth,
+                retry_policy=self.retry_policy,
+            ).list_run_records()
+            self.prefetched_runs = {
+                run.run_accession: run
+                for run in study_runs
+                if run.run_accession in runs
+            }
+        except (ValueError, KeyError, RequestException) as e:
+            logging.warning(
+                f"Could not prefetch the runs of {self.study}, querying them in batches: {e}"
             )
+            return
+        logging.info(
+            f"Prefetched {len(self.prefetched_runs)} of {len(runs)} runs of {self.study}"
+        )
+
+    def write_manifests(self):
+        """
+        Write the manifests as a streaming pipeline: the CSV is read lazily, runs are looked up in ENA in batches
+        by fetch_workers threads, and assemblies are hashed by workers threads while later batches are still
+        being looked up. Bounded queues between the stages keep memory flat however long the CSV is.
+        """
+        self._prefetch_runs()
+        manifest_run = _ManifestRun(self)
+
+        def checksum(task):
+            row, ena_metadata = task
+            return row, ena_metadata, self._checksum_or_error(row["Filepath"])
+
+        def queried_rows():
+            for rows, ena_query, runs_metadata in imap_bounded(
+                self._fetch_batch,
+                batched(self._pending_rows(manifest_run), RUN_BATCH_SIZE),
+                self.fetch_workers,
+            ):
+                to_hash = [
+                    (row, runs_metadata[row["Run"]])
+                    for row in rows
+                    if self._accept_metadata(
+                        manifest_run,
+                        row,
+                        runs_metadata.get(row["Run"]),
+                        ena_query.errors.get(row["Run"]),
+                    )
+                ]
+                #   largest assemblies of the batch first, so that one huge file does not hold up its end;
+                #   ordering across batches would hold the whole CSV in memory
+                to_hash.sort(
+                    key=lambda task: os.path.getsize(task[0]["Filepath"]), reverse=True
+                )
+                yield from to_hash
+
+        try:
+            for row, ena_metadata, checksum_result in imap_bounded(
+                checksum, queried_rows(), self.workers
+            ):
+                md5 = self._accept_checksum(manifest_run, row, checksum_result)
+                if md5:
+                    self._write_row(manifest_run, row, ena_metadata, md5)
+        finally:
+            manifest_run.close()
+        self._finish(manifest_run)
+
+    def _write_retry_csv(self, failed_rows):
+        retry_csv = self.upload_dir / f"{self.study}_retry.csv"
+        if not failed_rows:
+            #   a stale retry file from a previous run would be misleading
+            if retry_csv.exists():
+                retry_csv.unlink()
+            return
+        with open(retry_csv, "w", newline="") as retry_file:
+            writer = csv.DictWriter(retry_file, fieldnames=list(failed_rows[0]))
+            writer.writeheader()
+            writer.writerows(failed_rows)
+        self.retry_csv = retry_csv
+        logging.warning(
+            f"{len(failed_rows)} runs failed. Rerun them with --data {retry_csv}"
+        )
+
+    # alias for convenience
+    write = write_manifests
+
+
+class AsyncAssemblyManifestGenerator(AssemblyManifestGenerator):
+    def __init__(self, *args, concurrency: int = ASYNC_CONCURRENCY, **kwargs):
+        """
+        Asyncio variant of AssemblyManifestGenerator, for use from an event loop.
+        Runs are looked up in ENA in batches of RUN_BATCH_SIZE with an AsyncEnaRunsQuery, with at most
+        concurrency requests in flight, and assemblies are hashed by a pool of workers threads.
+        Retries wait on the event loop; the blocking HTTP calls, hashing, and manifest and bookkeeping
+        file I/O run in executors.
+        Takes the same arguments as AssemblyManifestGenerator, plus:
+        :param concurrency: maximum number of ENA requests in flight
+        """
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency
+
+    async def write_manifests(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._prefetch_runs)
+        manifest_run = _ManifestRun(self)
+        #   the HTTP calls only, the retries wait with asyncio.sleep
+        lookup_executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        requests_in_flight = asyncio.Semaphore(self.concurrency)
+        hash_executor = ThreadPoolExecutor(max_workers=self.workers)
+        #   a single thread for the CSV, manifests, journal and index, so that they are not written concurrently
+        io_executor = ThreadPoolExecutor(max_workers=1)
+
+        def io(function, *args):
+            return loop.run_in_executor(io_executor, function, *args)
+
+        async def process_row(row, ena_metadata, error):
+            if not await io(
+                self._accept_metadata, manifest_run, row, ena_metadata, error
+            ):
+                return
+            checksum_result = await loop.run_in_executor(
+                hash_executor, self._checksum_or_error, row["Filepath"]
+            )
+            md5 = await io(self._accept_checksum, manifest_run, row, checksum_result)
+            if md5:
+                await io(self._write_row, manifest_run, row, ena_metadata, md5)
+
+        async def process_batch(rows):
+            ena_query = AsyncEnaRunsQuery(
+                [row["Run"] for row in rows],
+                self.private,
+                lookup_executor,
+                session=self.session,
+                auth=self.auth,
+                retry_policy=self.retry_policy,
+                cache=self.ena_cache,
+                prefetched=self.prefetched_runs,
+                semaphore=requests_in_flight,
+            )
+            runs_metadata = await ena_query.build_records(raise_errors=not self.resume)
+            await asyncio.gather(
+                *(
+                    process_row(
+                        row,
+                        runs_metadata.get(row["Run"]),
+                        ena_query.errors.get(row["Run"]),
+                    )
+                    for row in rows
+                )
+            )
+
+        #   bound the number of batches in flight, rather than scheduling the whole CSV at once
+        batches = batched(self._pending_rows(manifest_run), RUN_BATCH_SIZE)
+        pending = set()
+        try:
+            while True:
+                rows = await io(next, batches, None)
+                if rows is None:
+                    break
+                if len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        task.result()
+                pending.add(asyncio.ensure_future(process_batch(rows)))
+            if pending:
+                for task in (await asyncio.wait(pending))[0]:
+                    task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            lookup_executor.shutdown(wait=False)
+            hash_executor.shutdown(wait=True)
+            io_executor.shutdown(wait=True)
+            manifest_run.close()
+        await loop.run_in_executor(None, self._finish, manifest_run)
 
     # alias for convenience
     write = write_manifests
@@ -183,16 +862,37 @@ class AssemblyManifestGenerator:
 
 def main():
     args = parse_args(sys.argv[1:])
+    if args.list_runs:
+        write_study_runs_csv(args.study, Path(args.list_runs), args.private)
+        return
+    ena_cache = ena_cache_from_args(args)
+    ledger = ledger_from_args(args)
 
-    gen_manifest = AssemblyManifestGenerator(
-        study=args.study,
-        assembly_study=args.assembly_study,
-        assemblies_csv=args.data,
-        force=args.force,
-        private=args.private,
-        tpa=args.tpa,
-    )
-    gen_manifest.write_manifests()
+    try:
+        gen_manifest = AssemblyManifestGenerator(
+            study=args.study,
+            assembly_study=args.assembly_study,
+            assemblies_csv=args.data,
+            private=args.private,
+            tpa=args.tpa,
+            ena_cache=ena_cache,
+            ledger=ledger,
+            ledger_endpoint=endpoint_name(args.ledger_test),
+            **manifest_options_from_args(args),
+        )
+        try:
+            gen_manifest.write_manifests()
+        finally:
+            gen_manifest.close()
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        if ledger:
+            ledger.close()
+        if ena_cache:
+            ena_cache.close()
+    write_metrics_from_args(args)
     logging.info("Completed")
 
 
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+logging.basicConfig(level=logging.INFO)
+
+#   large reads keep network filesystems (NFS, Lustre) streaming
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+CHECKSUM_CACHE_FILENAME = ".checksums.sqlite"
+
+
+def _mb_per_second(size, seconds):
+    if seconds <= 0:
+        return float("inf") if size else 0.0
+    return size / 1e6 / seconds
+
+
+class FileHash:
+    def __init__(self, path, md5, size, seconds):
+        """
+        Digest of a file, with the time it took to read it.
+        :param path: path of the hashed file
+        :param md5: md5 hex digest
+        :param size: number of bytes read
+        :param seconds: wall-clock seconds spent reading and hashing
+        """
+        self.path = path
+        self.md5 = md5
+        self.size = size
+        self.seconds = seconds
+
+    @property
+    def throughput(self):
+        """Read throughput in MB/s."""
+        return _mb_per_second(self.size, self.seconds)
+
+    def __repr__(self):
+        return f"FileHash({self.path!r}, md5={self.md5!r}, size={self.size})"
+
+
+def _advise_sequential(fd):
+    #   ask the kernel for aggressive read-ahead, where supported
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def _update_from_file(md5_hash, f, buffer_size, consumers):
+    #   no need to allocate the full buffer for small files
+    file_size = os.fstat(f.fileno()).st_size
+    buffer = bytearray(max(1, min(buffer_size, file_size)))
+    view = memoryview(buffer)
+    size = 0
+    while True:
+        read = f.readinto(buffer)
+        if not read:
+            break
+        md5_hash.update(view[:read])
+        for consumer in consumers:
+            consumer(view[:read])
+        size += read
+    return size
+
+
+def _update_from_mmap(md5_hash, f, buffer_size, consumers):
+    size = os.fstat(f.fileno()).st_size
+    #   empty files cannot be mapped
+    if not size:
+        return 0
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mapped) as view:
+            for offset in range(0, size, buffer_size):
+                md5_hash.update(view[offset : offset + buffer_size])
+                for consumer in consumers:
+                    consumer(view[offset : offset + buffer_size])
+    return size
+
+
+def hash_file(path_to_file, buffer_size=HASH_BUFFER_SIZE, use_mmap=False, consumers=()):
+    """
+    Hash a file with large reads into a single reused buffer.
+    :param path_to_file: path of the file to hash
+    :param buffer_size: number of bytes read per call
+    :param use_mmap: map the file into memory instead of reading it
+    :param consumers: callables that are also given every chunk of the file, in order, in the same read pass.
+        Chunks are views of a reused buffer, so consumers must not keep references to them.
+    :return: FileHash
+    """
+    md5_hash = hashlib.md5()
+    start = time.perf_counter()
+    with open(path_to_file, "rb", buffering=0) as f:
+        _advise_sequential(f.fileno())
+        if use_mmap:
+            size = _update_from_mmap(md5_hash, f, buffer_size, consumers)
+        else:
+            size = _update_from_file(md5_hash, f, buffer_size, consumers)
+    file_hash = FileHash(
+        path_to_file, md5_hash.hexdigest(), size, time.perf_counter() - start
+    )
+    logging.debug(
+        f"Hashed {path_to_file}: {size / 1e6:.1f} MB in {file_hash.seconds:.2f}s "
+        f"({file_hash.throughput:.1f} MB/s)"
+    )
+    return file_hash
+
+
+def get_md5(path_to_file, buffer_size=HASH_BUFFER_SIZE, use_mmap=False):
+    return hash_file(path_to_file, buffer_size, use_mmap).md5
+
+
+def _file_identity(path_to_file, stat=None):
+    stat = stat or os.stat(path_to_file)
+    return os.path.abspath(path_to_file), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class ChecksumCache:
+    def __init__(self, db_path):
+        """
+        On-disk cache of file checksums, keyed on the identity of each file (path, size, mtime_ns, inode).
+        A cached checksum is only returned while the file still has the identity it had when it was hashed.
+        :param db_path: path of the SQLite database, created if missing
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS checksums ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, md5 TEXT, stats TEXT)"
+        )
+        #   caches created before FASTA statistics were cached
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(checksums)")
+        ]
+        if "stats" not in columns:
+            self._connection.execute("ALTER TABLE checksums ADD COLUMN stats TEXT")
+        self._connection.commit()
+
+    def _lookup(self, path_to_file):
+        path, size, mtime_ns, inode = _file_identity(path_to_file)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, inode, md5, stats FROM checksums WHERE path = ?",
+                (path,),
+            ).fetchone()
+            if row is None:
+                return None
+            if tuple(row[:3]) != (size, mtime_ns, inode):
+                self._connection.execute(
+                    "DELETE FROM checksums WHERE path = ?", (path,)
+                )
+                self._connection.commit()
+                return None
+        return row
+
+    def lookup(self, path_to_file):
+        """
+        :return: (md5, FASTA statistics or None) cached for the file,
+            or None if it is not cached or the file has changed since
+        """
+        row = self._lookup(path_to_file)
+        if row is None:
+            return None
+        return row[3], json.loads(row[4]) if row[4] else None
+
+    def get(self, path_to_file):
+        """
+        :return: the cached md5 of the file, or None if it is not cached or the file has changed since
+        """
+        cached = self.lookup(path_to_file)
+        return cached[0] if cached else None
+
+    def get_stats(self, path_to_file):
+        """
+        :return: the cached FASTA statistics of the file, or None if they are not cached or the file has changed
+        """
+        cached = self.lookup(path_to_file)
+        return cached[1] if cached else None
+
+    def put(self, path_to_file, md5, stat=None, stats=None):
+        """
+        :param stat: os.stat_result taken before hashing, so that a file modified while it was being hashed
+            is not cached under its new identity
+        :param stats: FASTA statistics of the file, if they were collected
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    *_file_identity(path_to_file, stat),
+                    md5,
+                    json.dumps(stats) if stats else None,
+                ),
+            )
+            self._connection.commit()
+
+    def prune(self):
+        """
+        Drop entries of files that were deleted or changed.
+        :return: number of dropped entries
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, size, mtime_ns, inode FROM checksums"
+            ).fetchall()
+            stale = []
+            for path, size, mtime_ns, inode in rows:
+                try:
+                    identity = _file_identity(path)
+                except OSError:
+                    stale.append((path,))
+                    continue
+                if identity != (path, size, mtime_ns, inode):
+                    stale.append((path,))
+            self._connection.executemany("DELETE FROM checksums WHERE path = ?", stale)
+            self._connection.commit()
+        if stale:
+            logging.info(f"Pruned {len(stale)} stale entries from {self.db_path}")
+        return len(stale)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
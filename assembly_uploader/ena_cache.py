@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+#   study and run metadata in ENA rarely changes
+DEFAULT_TTL_HOURS = 7 * 24
+DEFAULT_MAX_ENTRIES = 100_000
+QUERY_MEMO_SIZE = 10_000
+
+
+class EnaResponseCache:
+    def __init__(
+        self,
+        db_path,
+        ttl=DEFAULT_TTL_HOURS * 3600,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        refresh=False,
+    ):
+        """
+        On-disk cache of the results of ENA queries, keyed on (endpoint, accession, private).
+        :param db_path: path of the SQLite database, created if missing
+        :param ttl: seconds after which a cached result is fetched again
+        :param max_entries: maximum number of cached results, the oldest are evicted beyond it
+        :param refresh: ignore the cached results, but still cache the new ones
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "endpoint TEXT, accession TEXT, private INTEGER, fetched_at REAL, data TEXT, "
+            "PRIMARY KEY (endpoint, accession, private))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at)"
+        )
+        self._connection.execute(
+            "DELETE FROM responses WHERE fetched_at < ?", (time.time() - ttl,)
+        )
+        self._connection.commit()
+
+    def get(self, endpoint, accession, private):
+        """
+        :return: the cached result, or None if it is not cached, expired, or refresh is set
+        """
+        with self._lock:
+            row = None
+            if not self.refresh:
+                row = self._connection.execute(
+                    "SELECT data FROM responses "
+                    "WHERE endpoint = ? AND accession = ? AND private = ? AND fetched_at >= ?",
+                    (endpoint, accession, int(private), time.time() - self.ttl),
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, endpoint, accession, private, data):
+        self.put_many(endpoint, private, {accession: data})
+
+    def put_many(self, endpoint, private, results):
+        """
+        Cache many results in a single transaction, e.g. those of a batched query.
+        :param endpoint: endpoint the results were fetched from
+        :param private: are these private results?
+        :param results: dict of accession to result
+        """
+        if not results:
+            return
+        fetched_at = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (
+                    (endpoint, accession, int(private), fetched_at, json.dumps(data))
+                    for accession, data in results.items()
+                ),
+            )
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY fetched_at, rowid LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+        if self.hits or self.misses:
+            logging.info(
+                f"ENA response cache {self.db_path}: {self.hits} hits, {self.misses} misses"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class QueryMemo:
+    def __init__(self, max_size=QUERY_MEMO_SIZE):
+        """
+        In-memory LRU of the results of ENA queries, keyed on (accession, private), shared by all the queries
+        of a process so that the generators do not resolve the same accessions again.
+        Concurrent lookups of the same key are coalesced: one caller fetches it, the others wait for its result.
+        :param max_size: maximum number of results kept, 0 to only coalesce concurrent lookups
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the result of key, or None if it is not memoized
+        """
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+        return None
+
+    def put(self, key, result):
+        if result is None or self.max_size <= 0:
+            return
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+    def claim(self, key):
+        """
+        :return: (result, None) if key is memoized,
+            (None, future) if another caller is already fetching key: its result is future.result(),
+            (None, None) if the caller must fetch key itself, then call release(key, ...)
+        """
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key], None
+            if key in self._in_flight:
+                self.coalesced += 1
+                return None, self._in_flight[key]
+            self.misses += 1
+            self._in_flight[key] = Future()
+            return None, None
+
+    def release(self, key, result=None, error=None):
+        """
+        Memoize the result of a claimed key and hand it, or the error, to the callers waiting for it.
+        """
+        self.put(key, result)
+        with self._lock:
+            future = self._in_flight.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        :param fetch: function returning the result of key, called if it is neither memoized nor in flight
+        """
+        result, future = self.claim(key)
+        if future is not None:
+            return future.result()
+        if result is not None:
+            return result
+        try:
+            result = fetch()
+        except BaseException as e:
+            self.release(key, error=e)
+            raise
+        self.release(key, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = self.coalesced = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._results),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
+
+
+def add_ena_cache_args(parser):
+    parser.add_argument(
+        "--ena-cache",
+        help="SQLite file caching the ENA study and run metadata between runs. Default no cache",
+        required=False,
+    )
+    parser.add_argument(
+        "--ena-cache-ttl",
+        help=f"hours after which cached ENA metadata is fetched again. Default {DEFAULT_TTL_HOURS}",
+        type=float,
+        default=DEFAULT_TTL_HOURS,
+    )
+    parser.add_argument(
+        "--refresh",
+        help="fetch all metadata from ENA again, ignoring --ena-cache",
+        action="store_true",
+        default=False,
+    )
+
+
+def ena_cache_from_args(args):
+    """
+    :return: EnaResponseCache configured by the add_ena_cache_args arguments, or None if --ena-cache is not given
+    """
+    if not args.ena_cache:
+        return None
+    return EnaResponseCache(
+        args.ena_cache, ttl=args.ena_cache_ttl * 3600, refresh=args.refresh
+    )
@@ -14,18 +14,56 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import csv
 import json
 import logging
 import os
 import sys
+import threading
+import time
+from functools import partial
 from time import sleep
+from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, HTTPError, RequestException, Timeout
 
+from .ena_cache import QueryMemo
+from .metrics import REQUEST_METRICS, endpoint_label
+from .records import RunRecord, StudyRecord
+from .retry import RetryPolicy
+from .webin_utils import get_optional_webin_credentials
+
 logging.basicConfig(level=logging.INFO)
 
 RETRY_COUNT = 3
+#   overridable to point the client at a stand-in server, see assembly_uploader.testing
+ENA_PORTAL_URL = os.environ.get(
+    "ENA_PORTAL_URL", "https://www.ebi.ac.uk/ena/portal/api/search"
+)
+ENA_REPORT_URL = os.environ.get(
+    "ENA_REPORT_URL", "https://www.ebi.ac.uk/ena/submit/report/"
+)
+#   Webin report API of the ENA test service
+ENA_REPORT_URL_DEV = os.environ.get(
+    "ENA_REPORT_URL_DEV", "https://wwwdev.ebi.ac.uk/ena/submit/report/"
+)
+#   number of runs resolved per portal search request
+RUN_BATCH_SIZE = 100
+#   runs per page of the Webin report listings
+REPORT_PAGE_SIZE = 1000
+#   connections kept alive per host by the shared session
+POOL_SIZE = 64
+
+#   shared by all queries that are not given their own, so one circuit breaker covers the whole process
+DEFAULT_RETRY_POLICY = RetryPolicy(attempts=RETRY_COUNT, metrics=REQUEST_METRICS.retry)
+#   results of the queries of this process, shared by all the generators
+DEFAULT_QUERY_MEMO = QueryMemo()
+
+_session = None
+_session_lock = threading.Lock()
 
 
 def get_default_connection_headers():
@@ -37,42 +75,102 @@ def get_default_connection_headers():
     }
 
 
-def parse_accession(accession):
+def create_session(pool_size=POOL_SIZE):
+    """
+    :param pool_size: maximum number of connections kept alive per host
+    :return: requests.Session whose connection pool can serve pool_size concurrent requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    :return: the process-wide session shared by all ENA requests, so connections to ENA are reused
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def _private_run_metadata(run_report, run_accession=None):
+    return RunRecord.from_report(run_report, run_accession).as_dict()
+
+
+def accession_type(accession):
+    """
+    :return: portal search field of accession, or None if it is not a valid accession
+    """
     if accession.startswith("PRJ"):
         return "study_accession"
     elif "RP" in accession:
         return "secondary_study_accession"
     elif "RR" in accession:
         return "run_accession"
-    else:
+    return None
+
+
+def parse_accession(accession):
+    acc_type = accession_type(accession)
+    if acc_type is None:
         logging.error(f"{accession} is not a valid accession")
         sys.exit()
+    return acc_type
 
 
 class EnaQuery:
-    def __init__(self, accession, private=False):
-        self.private_url = "https://www.ebi.ac.uk/ena/submit/report/"
-        self.public_url = "https://www.ebi.ac.uk/ena/portal/api/search"
+    def __init__(
+        self,
+        accession,
+        private=False,
+        session=None,
+        auth=None,
+        retry_policy=None,
+        cache=None,
+        memo=None,
+    ):
+        """
+        :param accession: study or run accession, or None for the queries of a whole Webin account
+        :param private: is this private data?
+        :param session: requests.Session to send the requests with, default is the shared session
+        :param auth: Webin (username, password), default is read from ENA_WEBIN and ENA_WEBIN_PASSWORD
+        :param retry_policy: RetryPolicy of the requests, default is DEFAULT_RETRY_POLICY
+        :param cache: EnaResponseCache of the query results, default is no cache
+        :param memo: QueryMemo of the query results, default is DEFAULT_QUERY_MEMO
+        """
+        self.private_url = ENA_REPORT_URL
+        self.public_url = ENA_PORTAL_URL
         self.accession = accession
-        self.acc_type = parse_accession(accession)
-        username = os.getenv("ENA_WEBIN")
-        password = os.getenv("ENA_WEBIN_PASSWORD")
-        if username is None or password is None:
+        self.acc_type = parse_accession(accession) if accession else None
+        #   what is being queried, in the log and error messages
+        self.label = accession
+        self.auth = auth or get_optional_webin_credentials()
+        if self.auth is None and private:
             logging.error("ENA_WEBIN and ENA_WEBIN_PASSWORD are not set")
-        if username and password:
-            self.auth = (username, password)
-        else:
-            self.auth = None
         self.private = private
+        self.session = session or get_session()
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.cache = cache
+        self.memo = memo or DEFAULT_QUERY_MEMO
+        #   accessions claimed in the memo by _claim_many and not released yet
+        self._claimed = set()
 
-    def post_request(self, data):
-        response = requests.post(
-            self.public_url, data=data, **get_default_connection_headers()
+    def post_request(self, data, stream=False):
+        response = self.session.post(
+            self.public_url,
+            data=data,
+            stream=stream,
+            **get_default_connection_headers(),
         )
         return response
 
     def get_request(self, url):
-        response = requests.get(url, auth=self.auth)
+        response = self.session.get(url, auth=self.auth)
         return response
 
     def get_data_or_handle_error(self, response):
@@ -81,103 +179,902 @@ class EnaQuery:
             if data is None:
                 if self.private:
                     logging.error(
-                        f"{self.accession} private data is not present in the specified Webin account"
+                        f"{self.label} private data is not present in the specified Webin account"
                     )
                 else:
-                    logging.error(f"{self.accession} public data does not exist")
+                    logging.error(f"{self.label} public data does not exist")
             else:
                 return data
         except (IndexError, TypeError, ValueError, KeyError):
             logging.error(
-                f"Failed to fetch {self.accession}, returned error: {response.text}"
+                f"Failed to fetch {self.label}, returned error: {response.text}"
+            )
+
+    def retry_delay(self, attempt, response=None, error=None):
+        """
+        Record the outcome of an attempt with the retry policy.
+        :param attempt: number of the attempt, starting at 1
+        :param response: the response of the attempt, if there was one
+        :param error: the connection error or timeout of the attempt, if there was no response
+        :return: seconds to wait before retrying, or None if the response should not be retried
+        :raises ValueError: if the attempt failed and it was the last one
+        """
+        policy = self.retry_policy
+        policy.metrics.increment("requests")
+        if response is not None:
+            policy.metrics.count("statuses", response.status_code)
+            if not policy.is_retryable(response):
+                policy.breaker.record_success()
+                return None
+            reason = f"{response.status_code} {response.reason}"
+        else:
+            policy.metrics.count("errors", type(error).__name__)
+            reason = error
+        policy.breaker.record_failure()
+        if attempt >= policy.attempts:
+            policy.metrics.increment("gave_up")
+            raise ValueError(
+                f"Could not find {self.label} in ENA after {policy.attempts} attempts. Error: {reason}"
+            )
+        delay = policy.delay(attempt, response)
+        policy.metrics.increment("retries")
+        policy.metrics.increment("backoff_seconds", delay)
+        logging.warning(
+            f"Retrying {self.label} in {delay:.1f}s, attempt {attempt} failed: {reason}"
+        )
+        return delay
+
+    def _endpoint(self, request, args, kwargs):
+        if request == self.post_request:
+            return endpoint_label("POST", self.public_url)
+        if request == self.get_request:
+            return endpoint_label("GET", args[0] if args else kwargs.get("url", ""))
+        return getattr(request, "__name__", "request")
+
+    def _send(self, endpoint, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = request(*args, **kwargs)
+        #   all other RequestExceptions are raised below
+        except (Timeout, ConnectionError) as retry_err:
+            REQUEST_METRICS.record(
+                endpoint, time.perf_counter() - start, error=retry_err
             )
+            return None, retry_err
+        except HTTPError as http_err:
+            print(f"HTTP response has an error status: {http_err}")
+            raise
+        except RequestException as req_err:
+            print(f"Network-related error status: {req_err}")
+            raise
+        #   should hopefully encompass all other issues...
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            raise
+        REQUEST_METRICS.record(
+            endpoint,
+            time.perf_counter() - start,
+            response.status_code,
+            #   streamed bodies are not read here
+            (
+                int(response.headers.get("Content-Length") or 0)
+                if kwargs.get("stream")
+                else len(response.content)
+            ),
+        )
+        return response, None
+
+    @staticmethod
+    def _raise_for_status(response):
+        try:
+            response.raise_for_status()
+        except HTTPError as http_err:
+            print(f"HTTP response has an error status: {http_err}")
+            raise
+        return response
 
     def retry_or_handle_request_error(self, request, *args, **kwargs):
+        breaker = self.retry_policy.breaker
         attempt = 0
-        while attempt < RETRY_COUNT:
+        while True:
+            wait, probe = breaker.acquire()
+            while wait:
+                sleep(wait)
+                wait, probe = breaker.acquire()
+            attempt += 1
+            endpoint = self._endpoint(request, args, kwargs)
             try:
-                response = request(*args, **kwargs)
-                response.raise_for_status()
-                return response
-            #   all other RequestExceptions are raised below
-            except (Timeout, ConnectionError) as retry_err:
-                attempt += 1
-                if attempt >= RETRY_COUNT:
-                    raise ValueError(
-                        f"Could not find {self.accession} in ENA after {RETRY_COUNT} attempts. Error: {retry_err}"
-                    )
-                sleep(1)
-            except HTTPError as http_err:
-                print(f"HTTP response has an error status: {http_err}")
-                raise
-            except RequestException as req_err:
-                print(f"Network-related error status: {req_err}")
-                raise
-            #   should hopefully encompass all other issues...
-            except Exception as e:
-                print(f"An unexpected error occurred: {e}")
-                raise
+                response, error = self._send(endpoint, request, *args, **kwargs)
+                delay = self.retry_delay(attempt, response, error)
+            finally:
+                if probe:
+                    breaker.release_probe()
+            if delay is None:
+                return self._raise_for_status(response)
+            REQUEST_METRICS.record_retry(endpoint)
+            sleep(delay)
 
-    def _get_private_study(self):
-        url = f"{self.private_url}studies/{self.accession}"
-        response = self.retry_or_handle_request_error(self.get_request, url)
+    def _parse_private_study(self, response):
         study = self.get_data_or_handle_error(response)
-        study_data = study["report"]
-        reformatted_data = {
-            "study_accession": study_data["secondaryId"],
-            "study_title": study_data["title"],
-            #   remove time and keep date
-            "first_public": study_data["firstPublic"].split("T")[0],
-        }
+        reformatted_data = StudyRecord.from_report(study["report"]).as_dict()
         logging.info(f"{self.accession} private study returned from ENA")
         return reformatted_data
 
-    def _get_public_study(self):
-        data = {
-            "result": "study",
-            "query": f'{self.acc_type}="{self.accession}"',
-            "fields": "study_accession,study_title,first_public",
-            "format": "json",
-        }
-        response = self.retry_or_handle_request_error(self.post_request, data)
+    def _parse_public_study(self, response):
         study = self.get_data_or_handle_error(response)
         logging.info(f"{self.accession} public study returned from ENA")
         return study
 
-    def _get_private_run(self):
-        url = f"{self.private_url}runs/{self.accession}"
-        response = self.retry_or_handle_request_error(self.get_request, url)
+    def _parse_private_run(self, response):
         run = self.get_data_or_handle_error(response)
-        run_data = run["report"]
-        reformatted_data = {
-            "run_accession": self.accession,
-            "sample_accession": run_data["sampleId"],
-            "instrument_model": run_data["instrumentModel"],
-        }
+        reformatted_data = _private_run_metadata(run["report"], self.accession)
         logging.info(f"{self.accession} private run returned from ENA")
         return reformatted_data
 
-    def _get_public_run(self):
-        data = {
-            "result": "read_run",
-            "query": f'run_accession="{self.accession}"',
-            "fields": "run_accession,sample_accession,instrument_model",
-            "format": "json",
-        }
-        response = self.retry_or_handle_request_error(self.post_request, data)
+    def _parse_public_run(self, response):
         run = self.get_data_or_handle_error(response)
         logging.info(f"{self.accession} public run returned from ENA")
         return run
 
-    def build_query(self):
+    def query_plan(self):
+        """
+        Describe the request for this accession without sending it, so that sync and async clients share it.
+        :return: request method, its argument and the method parsing its response
+        """
         if "study" in self.acc_type:
             if self.private:
-                ena_response = self._get_private_study()
-            else:
-                ena_response = self._get_public_study()
+                url = f"{self.private_url}studies/{self.accession}"
+                return self.get_request, url, self._parse_private_study
+            data = {
+                "result": "study",
+                "query": f'{self.acc_type}="{self.accession}"',
+                "fields": "study_accession,study_title,first_public",
+                "format": "json",
+            }
+            return self.post_request, data, self._parse_public_study
         elif "run" in self.acc_type:
             if self.private:
-                ena_response = self._get_private_run()
+                url = f"{self.private_url}runs/{self.accession}"
+                return self.get_request, url, self._parse_private_run
+            data = {
+                "result": "read_run",
+                "query": f'run_accession="{self.accession}"',
+                "fields": "run_accession,sample_accession,instrument_model",
+                "format": "json",
+            }
+            return self.post_request, data, self._parse_public_run
+
+    def list_private_runs(self, page_size=REPORT_PAGE_SIZE):
+        """
+        List the runs of this private study in the Webin account, from the paged Webin runs report.
+        :param page_size: number of runs per request
+        :return: generator of run metadata, in the format of a private run query
+        """
+        offset = 0
+        while True:
+            params = {
+                "studyId": self.accession,
+                "format": "json",
+                "max": page_size,
+                "offset": offset,
+            }
+            url = f"{self.private_url}runs?{urlencode(params)}"
+            response = self.retry_or_handle_request_error(self.get_request, url)
+            page = json.loads(response.text) if response.text.strip() else []
+            for run in page:
+                yield _private_run_metadata(run["report"])
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    def list_public_runs(self):
+        """
+        Stream the runs of this public study from the portal search API as TSV.
+        The response is parsed line by line as it arrives, so memory stays flat however many runs the study has.
+        :return: generator of run metadata, in the format of a public run query
+        """
+        data = {
+            "result": "read_run",
+            "query": f'{self.acc_type}="{self.accession}"',
+            "fields": "run_accession,sample_accession,instrument_model",
+            "limit": 0,
+            "format": "tsv",
+        }
+        response = self.retry_or_handle_request_error(
+            self.post_request, data, stream=True
+        )
+        #   without a charset, iter_lines would yield bytes
+        response.encoding = response.encoding or "utf-8"
+        try:
+            lines = response.iter_lines(decode_unicode=True)
+            yield from csv.DictReader((line for line in lines if line), delimiter="\t")
+        finally:
+            response.close()
+
+    def list_runs(self):
+        """
+        :return: generator of the metadata of every run of this study
+        """
+        if self.private:
+            return self.list_private_runs()
+        return self.list_public_runs()
+
+    def list_run_records(self):
+        """
+        :return: generator of a RunRecord for every run of this study
+        """
+        return map(RunRecord.from_portal, self.list_runs())
+
+    def prefetch_private_runs(self, page_size=REPORT_PAGE_SIZE):
+        """
+        :param page_size: number of runs per request
+        :return: dict of run accession to the metadata of every run of this private study in the Webin account
+        """
+        runs = {run["run_accession"]: run for run in self.list_private_runs(page_size)}
+        logging.info(f"Prefetched {len(runs)} private runs of {self.accession}")
+        return runs
+
+    def cache_endpoint(self):
+        """
+        :return: the endpoint queried for this accession, as part of its cache key
+        """
+        result = "study" if "study" in self.acc_type else "read_run"
+        if self.private:
+            return f"{self.private_url}{'studies' if result == 'study' else 'runs'}"
+        return f"{self.public_url}?result={result}"
+
+    def get_cached(self):
+        if self.cache:
+            return self.cache.get(self.cache_endpoint(), self.accession, self.private)
+
+    def put_cached(self, data):
+        if self.cache and data is not None:
+            self.cache.put(self.cache_endpoint(), self.accession, self.private, data)
+        return data
+
+    def memo_key(self):
+        return self.accession, self.private
+
+    def _fetch(self):
+        cached = self.get_cached()
+        if cached is not None:
+            return cached
+        request, argument, parse = self.query_plan()
+        response = self.retry_or_handle_request_error(request, argument)
+        return self.put_cached(parse(response))
+
+    def build_query(self):
+        return self.memo.get_or_fetch(self.memo_key(), self._fetch)
+
+    def _claim_many(self, accessions):
+        """
+        Look accessions up in the memo and the cache, and claim the others in the memo,
+        so that concurrent batch queries sharing accessions fetch each of them only once.
+        :return: (dict of accession to the results that are memoized or cached,
+            dict of accession to the concurrent.futures.Future of the results another query is fetching,
+            list of the accessions claimed, to fetch then release with _release_many)
+        """
+        results = {}
+        waiting = {}
+        claimed = []
+        endpoint = self.cache_endpoint()
+        for accession in accessions:
+            key = (accession, self.private)
+            result, future = self.memo.claim(key)
+            if future is not None:
+                waiting[accession] = future
+                continue
+            if result is None:
+                self._claimed.add(accession)
+                if self.cache:
+                    result = self.cache.get(endpoint, accession, self.private)
+                if result is None:
+                    claimed.append(accession)
+                    continue
+                self._release_many([accession], {accession: result})
+            results[accession] = result
+        return results, waiting, claimed
+
+    def _release_many(self, accessions, results=None, error=None):
+        """
+        Memoize the results of claimed accessions, or hand the error to the queries waiting for them.
+        Accessions missing from results are released as not returned by ENA.
+        """
+        for accession in accessions:
+            if accession in self._claimed:
+                self._claimed.discard(accession)
+                self.memo.release(
+                    (accession, self.private), (results or {}).get(accession), error
+                )
+
+    def record_type(self):
+        return StudyRecord if "study" in self.acc_type else RunRecord
+
+    def build_record(self):
+        """
+        :return: the metadata of build_query as a StudyRecord or RunRecord
+        """
+        return self.record_type().coerce(self.build_query())
+
+
+class EnaRunsQuery(EnaQuery):
+    def __init__(
+        self,
+        accessions,
+        private=False,
+        batch_size=RUN_BATCH_SIZE,
+        session=None,
+        auth=None,
+        retry_policy=None,
+        cache=None,
+        memo=None,
+        prefetched=None,
+    ):
+        """
+        Resolve the sample and instrument metadata of many runs with as few requests as possible.
+        Public runs are fetched in chunks of batch_size with a single portal search per chunk.
+        Private runs are not exposed by the portal, so they are fetched one by one from the reports API.
+        Runs that another query of the same memo is already fetching are waited for, not fetched again.
+        :param accessions: run accessions to resolve
+        :param private: are these private runs?
+        :param batch_size: number of runs per portal search request
+        :param session: requests.Session to send the requests with, default is the shared session
+        :param auth: Webin (username, password), default is read from the env
+        :param retry_policy: RetryPolicy of the requests, default is DEFAULT_RETRY_POLICY
+        :param cache: EnaResponseCache of the run metadata, default is no cache
+        :param memo: QueryMemo of the run metadata, default is DEFAULT_QUERY_MEMO
+        :param prefetched: dict of run accession to metadata dict or RunRecord, e.g. from prefetch_private_runs,
+            consulted before sending any request
+        :raises ValueError: if no accessions are given, or some of them are not run accessions
+        """
+        #   keep first-seen order but drop duplicates
+        self.accessions = list(dict.fromkeys(accessions))
+        if not self.accessions:
+            raise ValueError("No run accessions were provided")
+        invalid = [
+            accession
+            for accession in self.accessions
+            if accession_type(accession) != "run_accession"
+        ]
+        if invalid:
+            raise ValueError(f"Not valid run accessions: {', '.join(invalid)}")
+        super().__init__(
+            self.accessions[0], private, session, auth, retry_policy, cache, memo
+        )
+        if len(self.accessions) > 1:
+            self.label = (
+                f"{self.accessions[0]} (and {len(self.accessions) - 1} other runs)"
+            )
+        self.batch_size = batch_size
+        self.prefetched = prefetched or {}
+        #   run accession -> error, for runs that could not be resolved
+        self.errors = {}
+
+    def _public_runs_request(self, accessions):
+        query = " OR ".join(f'run_accession="{accession}"' for accession in accessions)
+        return {
+            "result": "read_run",
+            "query": query,
+            "fields": "run_accession,sample_accession,instrument_model",
+            "limit": 0,
+            "format": "json",
+        }
+
+    def _parse_public_runs(self, response):
+        try:
+            runs = json.loads(response.text)
+        except ValueError:
+            logging.error(
+                f"Failed to fetch {self.label}, returned error: {response.text}"
+            )
+            return {}
+        runs = {run["run_accession"]: run for run in runs}
+        if self.cache:
+            self.cache.put_many(self.cache_endpoint(), self.private, runs)
+        return runs
+
+    def _get_public_runs(self, accessions):
+        response = self.retry_or_handle_request_error(
+            self.post_request, self._public_runs_request(accessions)
+        )
+        return self._parse_public_runs(response)
+
+    def _known_runs(self):
+        """
+        :return: (dict of run accession to the metadata of the runs that are prefetched, memoized or cached,
+            dict of run accession to the future of the runs that another query is fetching,
+            list of the chunks of the other run accessions, one request each)
+        The public runs of the chunks are claimed in the memo, see _claim_many.
+        """
+        runs = {
+            accession: self.prefetched[accession]
+            for accession in self.accessions
+            if accession in self.prefetched
+        }
+        accessions = [
+            accession for accession in self.accessions if accession not in runs
+        ]
+        if self.private:
+            #   EnaQuery looks each private run up in the memo and the cache
+            return runs, {}, [[accession] for accession in accessions]
+        known, waiting, accessions = self._claim_many(accessions)
+        runs.update(known)
+        return (
+            runs,
+            waiting,
+            [
+                accessions[start : start + self.batch_size]
+                for start in range(0, len(accessions), self.batch_size)
+            ],
+        )
+
+    def _chunk_failed(self, chunk, error, raise_errors):
+        self._release_many(chunk, error=error)
+        if raise_errors:
+            raise error
+        logging.error(f"Failed to fetch {len(chunk)} runs from ENA: {error}")
+        self.errors.update((accession, str(error)) for accession in chunk)
+
+    def _check_returned(self, runs):
+        logging.info(f"{len(runs)} of {len(self.accessions)} runs returned from ENA")
+        for accession in self.accessions:
+            if accession not in runs and accession not in self.errors:
+                logging.error(f"{accession} was not returned by ENA")
+                self.errors[accession] = "not returned by ENA"
+        return runs
+
+    def build_query(self, raise_errors=True):
+        """
+        :param raise_errors: raise request errors, instead of recording them in self.errors and
+            carrying on with the other runs
+        :return: dict of run accession to run metadata. Runs that ENA did not return are missing.
+        """
+        try:
+            runs, waiting, chunks = self._known_runs()
+            for chunk in chunks:
+                try:
+                    if self.private:
+                        runs[chunk[0]] = EnaQuery(
+                            chunk[0],
+                            self.private,
+                            self.session,
+                            self.auth,
+                            self.retry_policy,
+                            self.cache,
+                            self.memo,
+                        ).build_query()
+                    else:
+                        fetched = self._get_public_runs(chunk)
+                        runs.update(fetched)
+                        self._release_many(chunk, fetched)
+                except Exception as e:
+                    self._chunk_failed(chunk, e, raise_errors)
+        except BaseException as e:
+            self._release_many(list(self._claimed), error=e)
+            raise
+        for accession, future in waiting.items():
+            try:
+                run = future.result()
+            except Exception as e:
+                self._chunk_failed([accession], e, raise_errors)
+                continue
+            if run is not None:
+                runs[accession] = run
+        return self._check_returned(runs)
+
+    def build_records(self, raise_errors=True):
+        """
+        :param raise_errors: see build_query
+        :return: dict of run accession to RunRecord. Runs that ENA did not return are missing.
+        """
+        return {
+            accession: RunRecord.coerce(run)
+            for accession, run in self.build_query(raise_errors).items()
+        }
+
+
+class EnaStudiesQuery(EnaQuery):
+    def __init__(
+        self,
+        accessions,
+        private=False,
+        batch_size=RUN_BATCH_SIZE,
+        session=None,
+        auth=None,
+        retry_policy=None,
+        cache=None,
+        memo=None,
+    ):
+        """
+        Resolve the metadata of many studies with as few requests as possible.
+        Public studies are fetched in chunks of batch_size with a single portal search per chunk.
+        Private studies are not exposed by the portal, so they are fetched one by one from the reports API.
+        Studies that another query of the same memo is already fetching are waited for, not fetched again.
+        :param accessions: study accessions to resolve, primary (PRJ...) or secondary (ERP/SRP/DRP...)
+        :param private: are these private studies?
+        :param batch_size: number of studies per portal search request
+        :param session: requests.Session to send the requests with, default is the shared session
+        :param auth: Webin (username, password), default is read from the env
+        :param retry_policy: RetryPolicy of the requests, default is DEFAULT_RETRY_POLICY
+        :param cache: EnaResponseCache of the study metadata, default is no cache
+        :param memo: QueryMemo of the study metadata, default is DEFAULT_QUERY_MEMO
+        :raises ValueError: if no accessions are given, or some of them are not study accessions
+        """
+        self.accessions = list(dict.fromkeys(accessions))
+        if not self.accessions:
+            raise ValueError("No study accessions were provided")
+        invalid = [
+            accession
+            for accession in self.accessions
+            if "study" not in (accession_type(accession) or "")
+        ]
+        if invalid:
+            raise ValueError(f"Not valid study accessions: {', '.join(invalid)}")
+        super().__init__(
+            self.accessions[0], private, session, auth, retry_policy, cache, memo
+        )
+        if len(self.accessions) > 1:
+            self.label = (
+                f"{self.accessions[0]} (and {len(self.accessions) - 1} other studies)"
+            )
+        self.batch_size = batch_size
+        #   study accession -> error, for studies that could not be resolved
+        self.errors = {}
+
+    def _get_public_studies(self, accessions):
+        query = " OR ".join(
+            f'{parse_accession(accession)}="{accession}"' for accession in accessions
+        )
+        data = {
+            "result": "study",
+            "query": query,
+            "fields": "study_accession,secondary_study_accession,study_title,first_public",
+            "limit": 0,
+            "format": "json",
+        }
+        response = self.retry_or_handle_request_error(self.post_request, data)
+        try:
+            found = json.loads(response.text)
+        except ValueError:
+            logging.error(
+                f"Failed to fetch {self.label}, returned error: {response.text}"
+            )
+            return {}
+        #   the portal answers with both accessions, whichever one was asked for
+        by_accession = {}
+        for study in found:
+            record = StudyRecord.from_portal(study).as_dict()
+            for field in ("study_accession", "secondary_study_accession"):
+                if study.get(field):
+                    by_accession[study[field]] = record
+        studies = {
+            accession: by_accession[accession]
+            for accession in accessions
+            if accession in by_accession
+        }
+        if self.cache:
+            self.cache.put_many(self.cache_endpoint(), self.private, studies)
+        return studies
+
+    def build_query(self, raise_errors=True):
+        """
+        :param raise_errors: raise request errors, instead of recording them in self.errors and
+            carrying on with the other studies
+        :return: dict of study accession to study metadata. Studies that ENA did not return are missing.
+        """
+        try:
+            if self.private:
+                #   EnaQuery looks each private study up in the memo and the cache
+                studies, waiting = {}, {}
+                chunks = [[accession] for accession in self.accessions]
             else:
-                ena_response = self._get_public_run()
-        return ena_response
+                studies, waiting, accessions = self._claim_many(self.accessions)
+                chunks = [
+                    accessions[start : start + self.batch_size]
+                    for start in range(0, len(accessions), self.batch_size)
+                ]
+            for chunk in chunks:
+                try:
+                    if self.private:
+                        studies[chunk[0]] = EnaQuery(
+                            chunk[0],
+                            self.private,
+                            self.session,
+                            self.auth,
+                            self.retry_policy,
+                            self.cache,
+                            self.memo,
+                        ).build_query()
+                    else:
+                        fetched = self._get_public_studies(chunk)
+                        studies.update(fetched)
+                        self._release_many(chunk, fetched)
+                except Exception as e:
+                    self._chunk_failed(chunk, e, raise_errors)
+        except BaseException as e:
+            self._release_many(list(self._claimed), error=e)
+            raise
+        for accession, future in waiting.items():
+            try:
+                study = future.result()
+            except Exception as e:
+                self._chunk_failed([accession], e, raise_errors)
+                continue
+            if study is not None:
+                studies[accession] = study
+        logging.info(
+            f"{len(studies)} of {len(self.accessions)} studies returned from ENA"
+        )
+        for accession in self.accessions:
+            if accession not in studies and accession not in self.errors:
+                logging.error(f"{accession} was not returned by ENA")
+                self.errors[accession] = "not returned by ENA"
+        return studies
+
+    def _chunk_failed(self, chunk, error, raise_errors):
+        self._release_many(chunk, error=error)
+        if raise_errors:
+            raise error
+        logging.error(f"Failed to fetch {len(chunk)} studies from ENA: {error}")
+        self.errors.update((accession, str(error)) for accession in chunk)
+
+    def build_records(self, raise_errors=True):
+        """
+        :param raise_errors: see build_query
+        :return: dict of study accession to StudyRecord. Studies that ENA did not return are missing.
+        """
+        return {
+            accession: StudyRecord.coerce(study)
+            for accession, study in self.build_query(raise_errors).items()
+        }
+
+
+class EnaProjectsQuery(EnaQuery):
+    def __init__(self, report_url=None, session=None, auth=None, retry_policy=None):
+        """
+        List the projects of the Webin account, from the paged Webin projects report.
+        :param report_url: Webin report API, default is ENA_REPORT_URL
+        :param session: requests.Session to send the requests with, default is the shared session
+        :param auth: Webin (username, password), default is read from the env
+        :param retry_policy: RetryPolicy of the requests, default is DEFAULT_RETRY_POLICY
+        """
+        super().__init__(
+            None, True, session, auth, retry_policy, cache=None, memo=QueryMemo(0)
+        )
+        if report_url:
+            self.private_url = report_url
+        self.label = "Webin account projects"
+
+    def list_projects(self, page_size=REPORT_PAGE_SIZE):
+        """
+        :param page_size: number of projects per request
+        :return: generator of the "report" of every project, with its id (accession), alias and firstCreated
+        """
+        offset = 0
+        while True:
+            params = {"format": "json", "max": page_size, "offset": offset}
+            url = f"{self.private_url}projects?{urlencode(params)}"
+            response = self.retry_or_handle_request_error(self.get_request, url)
+            page = json.loads(response.text) if response.text.strip() else []
+            for project in page:
+                yield project["report"]
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+
+class AsyncEnaQuery:
+    def __init__(
+        self,
+        accession,
+        private=False,
+        executor=None,
+        session=None,
+        auth=None,
+        retry_policy=None,
+        cache=None,
+        memo=None,
+    ):
+        """
+        Asyncio counterpart of EnaQuery, with the same build_query results and retry behaviour.
+        The blocking HTTP calls run in an executor and retries wait with asyncio.sleep,
+        so many queries can be awaited concurrently without blocking the event loop.
+        :param accession: study or run accession
+        :param private: is this private data?
+        :param executor: concurrent.futures executor for the HTTP calls, default is the loop's default executor
+        :param session: requests.Session to send the requests with, default is the shared session
+        :param auth: Webin (username, password), default is read from the env
+        :param retry_policy: RetryPolicy of the requests, default is DEFAULT_RETRY_POLICY
+        :param cache: EnaResponseCache of the query results, default is no cache
+        :param memo: QueryMemo of the query results, default is DEFAULT_QUERY_MEMO
+        """
+        self.query = EnaQuery(
+            accession, private, session, auth, retry_policy, cache, memo
+        )
+        self.accession = accession
+        self.private = private
+        self.executor = executor
+
+    async def retry_or_handle_request_error(self, request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        breaker = self.query.retry_policy.breaker
+        attempt = 0
+        while True:
+            wait, probe = breaker.acquire()
+            while wait:
+                await asyncio.sleep(wait)
+                wait, probe = breaker.acquire()
+            attempt += 1
+            endpoint = self.query._endpoint(request, args, kwargs)
+            try:
+                response, error = await loop.run_in_executor(
+                    self.executor,
+                    partial(self.query._send, endpoint, request, *args, **kwargs),
+                )
+                delay = self.query.retry_delay(attempt, response, error)
+            finally:
+                if probe:
+                    breaker.release_probe()
+            if delay is None:
+                return self.query._raise_for_status(response)
+            REQUEST_METRICS.record_retry(endpoint)
+            await asyncio.sleep(delay)
+
+    async def _fetch(self):
+        cached = self.query.get_cached()
+        if cached is not None:
+            return cached
+        request, argument, parse = self.query.query_plan()
+        response = await self.retry_or_handle_request_error(request, argument)
+        return self.query.put_cached(parse(response))
+
+    async def build_query(self):
+        memo = self.query.memo
+        key = self.query.memo_key()
+        result, future = memo.claim(key)
+        if future is not None:
+            return await asyncio.wrap_future(future)
+        if result is not None:
+            return result
+        try:
+            result = await self._fetch()
+        except BaseException as e:
+            memo.release(key, error=e)
+            raise
+        memo.release(key, result)
+        return result
+
+    async def build_record(self):
+        """
+        :return: the metadata of build_query as a StudyRecord or RunRecord
+        """
+        return self.query.record_type().coerce(await self.build_query())
+
+
+class AsyncEnaRunsQuery(AsyncEnaQuery):
+    def __init__(
+        self,
+        accessions,
+        private=False,
+        executor=None,
+        batch_size=RUN_BATCH_SIZE,
+        session=None,
+        auth=None,
+        retry_policy=None,
+        cache=None,
+        memo=None,
+        prefetched=None,
+        semaphore=None,
+    ):
+        """
+        Asyncio counterpart of EnaRunsQuery, with the same build_query results and errors.
+        The chunks are fetched concurrently, each with the retries of AsyncEnaQuery.
+        :param accessions: run accessions to resolve
+        :param private: are these private runs?
+        :param executor: concurrent.futures executor for the HTTP calls and the cache,
+            default is the loop's default executor
+        :param batch_size: number of runs per portal search request
+        :param session: requests.Session to send the requests with, default is the shared session
+        :param auth: Webin (username, password), default is read from the env
+        :param retry_policy: RetryPolicy of the requests, default is DEFAULT_RETRY_POLICY
+        :param cache: EnaResponseCache of the run metadata, default is no cache
+        :param memo: QueryMemo of the run metadata, default is DEFAULT_QUERY_MEMO
+        :param prefetched: see EnaRunsQuery
+        :param semaphore: asyncio.Semaphore bounding the requests in flight, shared between queries,
+            default is no bound
+        :raises ValueError: if no accessions are given, or some of them are not run accessions
+        """
+        self.query = EnaRunsQuery(
+            accessions,
+            private,
+            batch_size,
+            session,
+            auth,
+            retry_policy,
+            cache,
+            memo,
+            prefetched,
+        )
+        self.accessions = self.query.accessions
+        self.private = private
+        self.executor = executor
+        self.semaphore = semaphore
+
+    @property
+    def errors(self):
+        return self.query.errors
+
+    async def _fetch_chunk(self, chunk):
+        query = self.query
+        if query.private:
+            run = await AsyncEnaQuery(
+                chunk[0],
+                query.private,
+                self.executor,
+                query.session,
+                query.auth,
+                query.retry_policy,
+                query.cache,
+                query.memo,
+            ).build_query()
+            return {chunk[0]: run}
+        response = await self.retry_or_handle_request_error(
+            query.post_request, query._public_runs_request(chunk)
+        )
+        loop = asyncio.get_running_loop()
+        runs = await loop.run_in_executor(
+            self.executor, query._parse_public_runs, response
+        )
+        query._release_many(chunk, runs)
+        return runs
+
+    async def _fetch_chunk_bounded(self, chunk):
+        if self.semaphore is None:
+            return await self._fetch_chunk(chunk)
+        async with self.semaphore:
+            return await self._fetch_chunk(chunk)
+
+    async def build_query(self, raise_errors=True):
+        """
+        :param raise_errors: see EnaRunsQuery.build_query
+        :return: dict of run accession to run metadata. Runs that ENA did not return are missing.
+        """
+        loop = asyncio.get_running_loop()
+        query = self.query
+        try:
+            runs, waiting, chunks = await loop.run_in_executor(
+                self.executor, query._known_runs
+            )
+            results = await asyncio.gather(
+                *(self._fetch_chunk_bounded(chunk) for chunk in chunks),
+                return_exceptions=True,
+            )
+            for chunk, result in zip(chunks, results):
+                if isinstance(result, Exception):
+                    query._chunk_failed(chunk, result, raise_errors)
+                elif isinstance(result, BaseException):
+                    raise result
+                else:
+                    runs.update(result)
+        except BaseException as e:
+            query._release_many(list(query._claimed), error=e)
+            raise
+        for accession, future in waiting.items():
+            try:
+                run = await asyncio.wrap_future(future)
+            except Exception as e:
+                query._chunk_failed([accession], e, raise_errors)
+                continue
+            if run is not None:
+                runs[accession] = run
+        return query._check_returned(runs)
+
+    async def build_records(self, raise_errors=True):
+        """
+        :param raise_errors: see EnaRunsQuery.build_query
+        :return: dict of run accession to RunRecord. Runs that ENA did not return are missing.
+        """
+        return {
+            accession: RunRecord.coerce(run)
+            for accession, run in (await self.build_query(raise_errors)).items()
+        }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import zlib
+from array import array
+
+STATS_FIELDS = (
+    "gzip_valid",
+    "contigs",
+    "total_length",
+    "n50",
+    "min_length",
+    "max_length",
+    "error",
+)
+
+#   gzip header and trailer, rather than a raw zlib stream
+_GZIP_WBITS = zlib.MAX_WBITS | 16
+_NEWLINE = ord("\n")
+_HEADER_START = ord(">")
+
+
+def n50(lengths):
+    """
+    :param lengths: contig lengths
+    :return: length of the shortest contig in the set of longest contigs covering half of the total length
+    """
+    half = sum(lengths) / 2
+    covered = 0
+    for length in sorted(lengths, reverse=True):
+        covered += length
+        if covered >= half:
+            return length
+    return 0
+
+
+class FastaStats:
+    def __init__(self):
+        """
+        Streaming statistics of a gzipped FASTA file.
+        Feed the raw, compressed bytes of the file to update() in order, e.g. as they are read for hashing,
+        then call finish(). The file is decompressed and parsed incrementally, so it is only read once.
+        """
+        self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+        self._in_header = False
+        self._line_start = True
+        self._current = None
+        self.contig_lengths = array("Q")
+        self.error = None
+
+    @property
+    def gzip_valid(self):
+        return self.error is None or not self.error.startswith("gzip")
+
+    def update(self, chunk):
+        if self.error:
+            return
+        try:
+            data = self._decompressor.decompress(chunk)
+            #   concatenated gzip members, e.g. from bgzip or cat
+            while self._decompressor.eof and self._decompressor.unused_data:
+                unused_data = self._decompressor.unused_data
+                self._parse(data)
+                self._decompressor = zlib.decompressobj(_GZIP_WBITS)
+                data = self._decompressor.decompress(unused_data)
+        except zlib.error as e:
+            self.error = f"gzip error: {e}"
+            return
+        self._parse(data)
+
+    def _parse(self, data):
+        pos = 0
+        size = len(data)
+        while pos < size and not self.error:
+            if self._in_header:
+                newline = data.find(b"\n", pos)
+                if newline < 0:
+                    return
+                self._in_header = False
+                self._line_start = True
+                pos = newline + 1
+            elif self._line_start and data[pos] == _HEADER_START:
+                if self._current is not None:
+                    self.contig_lengths.append(self._current)
+                self._current = 0
+                self._in_header = True
+                pos += 1
+            else:
+                next_header = data.find(b"\n>", pos)
+                end = size if next_header < 0 else next_header + 1
+                residues = (
+                    end
+                    - pos
+                    - data.count(b"\n", pos, end)
+                    - data.count(b"\r", pos, end)
+                )
+                if residues and self._current is None:
+                    self.error = "sequence found before the first FASTA header"
+                    return
+                if self._current is not None:
+                    self._current += residues
+                self._line_start = data[end - 1] == _NEWLINE
+                pos = end
+
+    def finish(self):
+        """
+        Flush the decompressor and record the last contig.
+        :return: self
+        """
+        if not self.error:
+            try:
+                self._parse(self._decompressor.flush())
+            except zlib.error as e:
+                self.error = f"gzip error: {e}"
+        if not self.error and not self._decompressor.eof:
+            self.error = "gzip error: file is truncated"
+        if self._current is not None:
+            self.contig_lengths.append(self._current)
+            self._current = None
+        if not self.error and not self.contig_lengths:
+            self.error = "no FASTA records found"
+        return self
+
+    def summary(self):
+        """
+        :return: dict of the STATS_FIELDS
+        """
+        lengths = self.contig_lengths
+        return {
+            "gzip_valid": self.gzip_valid,
+            "contigs": len(lengths),
+            "total_length": sum(lengths),
+            "n50": n50(lengths),
+            "min_length": min(lengths) if lengths else 0,
+            "max_length": max(lengths) if lengths else 0,
+            "error": self.error or "",
+        }
@@ -0,0 +1,24 @@
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """
+    Open a temporary file next to path and move it over path once the block completes,
+    so that readers never see a partially written file. The temporary file is removed if the block raises.
+    :param path: destination path
+    :param mode: "w" or "wb", plus any other keyword arguments of open()
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, mode, **kwargs) as tmp_file:
+            yield tmp_file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
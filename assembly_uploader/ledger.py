@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from . import ena_queries
+from .ena_queries import EnaProjectsQuery
+from .webin_utils import ensure_webin_credentials_exist
+
+#   the drop-box a project was registered in: the ENA test service or production
+DEV = "dev"
+PROD = "prod"
+
+ASSEMBLY_ALIAS_SUFFIX = "_assembly"
+
+#   the ENA test service is wiped every day, so its projects are not trusted for longer
+DEV_TTL_SECONDS = 24 * 60 * 60
+
+
+def endpoint_name(is_test):
+    return DEV if is_test else PROD
+
+
+def _oldest_valid(endpoint):
+    #   submission time before which the projects of endpoint no longer exist
+    return time.time() - DEV_TTL_SECONDS if endpoint == DEV else 0
+
+
+class SubmissionLedger:
+    def __init__(self, db_path):
+        """
+        Local record of the assembly projects registered in ENA, keyed on (alias, endpoint),
+        so that registering a study again does not need a drop-box round trip.
+        :param db_path: path of the SQLite database, created if missing
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS projects ("
+            "alias TEXT, endpoint TEXT, accession TEXT, study TEXT, submitted_at REAL, "
+            "PRIMARY KEY (alias, endpoint))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS projects_study ON projects (study, endpoint)"
+        )
+        self._connection.commit()
+
+    def get(self, alias, endpoint):
+        """
+        :return: accession of the project registered with alias, or None.
+            Test service projects older than DEV_TTL_SECONDS are ignored
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT accession FROM projects WHERE alias = ? AND endpoint = ? AND submitted_at > ?",
+                (alias, endpoint, _oldest_valid(endpoint)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_study(self, study, endpoint):
+        """
+        :param study: raw reads study ID the project was registered for, or its primary accession
+        :return: accession of the assembly project of study, or None.
+            Test service projects older than DEV_TTL_SECONDS are ignored
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT accession FROM projects WHERE (study = ? OR alias = ?) AND endpoint = ? "
+                "AND submitted_at > ? ORDER BY submitted_at DESC",
+                (
+                    study,
+                    f"{study}{ASSEMBLY_ALIAS_SUFFIX}",
+                    endpoint,
+                    _oldest_valid(endpoint),
+                ),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, alias, endpoint, accession, study=None, submitted_at=None):
+        """
+        :param alias: alias of the project
+        :param endpoint: DEV or PROD
+        :param accession: accession ENA gave the project
+        :param study: raw reads study ID the project was registered for
+        :param submitted_at: time of the registration, default is now
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?)",
+                (alias, endpoint, accession, study, submitted_at or time.time()),
+            )
+            self._connection.commit()
+
+    def entries(self, endpoint=None):
+        """
+        :return: list of (alias, endpoint, accession, study, submitted_at) of the registered projects
+        """
+        with self._lock:
+            if endpoint:
+                cursor = self._connection.execute(
+                    "SELECT * FROM projects WHERE endpoint = ? ORDER BY alias",
+                    (endpoint,),
+                )
+            else:
+                cursor = self._connection.execute(
+                    "SELECT * FROM projects ORDER BY endpoint, alias"
+                )
+            return cursor.fetchall()
+
+    def rebuild(self, endpoint, report_url=None, session=None, auth=None):
+        """
+        Replace the projects of endpoint with those of the Webin account, from the Webin projects report.
+        The report does not know the raw reads study IDs, so rebuilt projects are found by find_study
+        through their "{primary accession}_assembly" alias.
+        :param endpoint: DEV or PROD
+        :param report_url: Webin report API of endpoint, default is the test service one for DEV
+            and the production one for PROD
+        :param session: requests.Session for the report requests, default is the shared session
+        :param auth: Webin (username, password), default is read from the env
+        :return: number of projects recorded
+        """
+        if not report_url and endpoint == DEV:
+            report_url = ena_queries.ENA_REPORT_URL_DEV
+        query = EnaProjectsQuery(report_url, session=session, auth=auth)
+        projects = []
+        for project in query.list_projects():
+            if not project.get("alias") or not project.get("id"):
+                continue
+            projects.append(
+                (
+                    project["alias"],
+                    endpoint,
+                    project["id"],
+                    None,
+                    _timestamp(project.get("firstCreated")),
+                )
+            )
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM projects WHERE endpoint = ?", (endpoint,)
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?)", projects
+            )
+            self._connection.commit()
+        logging.info(
+            f"Rebuilt the {endpoint} ledger {self.db_path} with {len(projects)} projects"
+        )
+        return len(projects)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _timestamp(date):
+    try:
+        return datetime.fromisoformat(date).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def add_ledger_args(parser):
+    parser.add_argument(
+        "--ledger",
+        help="SQLite ledger of the registered assembly studies: checked before registering a study again, "
+        "and read by assembly_manifest when --assembly_study is not given. Default no ledger",
+        required=False,
+    )
+
+
+def ledger_from_args(args):
+    """
+    :return: SubmissionLedger of the add_ledger_args arguments, or None if --ledger is not given
+    """
+    if not args.ledger:
+        return None
+    return SubmissionLedger(args.ledger)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild or list the local ledger of registered assembly studies"
+    )
+    parser.add_argument("--ledger", help="SQLite ledger file", required=True)
+    parser.add_argument(
+        "--rebuild",
+        help="replace the ledger entries with the projects of the Webin account, from the Webin report API",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--test",
+        help="use the ENA test service entries",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--report-url",
+        help="Webin report API to rebuild from. "
+        "Default is the test service one with --test, otherwise the production one",
+        required=False,
+    )
+    args = parser.parse_args(sys.argv[1:])
+    endpoint = endpoint_name(args.test)
+    with SubmissionLedger(args.ledger) as ledger:
+        if args.rebuild:
+            ensure_webin_credentials_exist()
+            ledger.rebuild(endpoint, args.report_url)
+        for alias, _, accession, study, _ in ledger.entries(endpoint):
+            print(f"{alias}\t{accession}\t{study or ''}")
+
+
+if __name__ == "__main__":
+    main()
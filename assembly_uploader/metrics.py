@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import re
+import threading
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+from .file_utils import atomic_write
+from .retry import RetryMetrics
+
+#   upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_ACCESSION_SEGMENT = re.compile(r"^[A-Z]{3,}[0-9]+$")
+
+
+def endpoint_label(method, url):
+    """
+    :return: "METHOD host/path" of a request, with accessions in the path replaced by {accession}
+        so that each endpoint has one label whatever it is queried for
+    """
+    parts = urlsplit(url)
+    path = "/".join(
+        "{accession}" if _ACCESSION_SEGMENT.match(segment) else segment
+        for segment in parts.path.rstrip("/").split("/")
+    )
+    return f"{method} {parts.netloc}{path}"
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.statuses = {}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "bytes_received": self.bytes_received,
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "latency_seconds": {
+                "sum": round(self.latency_sum, 6),
+                "count": self.requests,
+                "buckets": dict(
+                    zip([*map(str, LATENCY_BUCKETS), "+Inf"], self.latency_buckets)
+                ),
+            },
+        }
+
+
+class RequestMetrics:
+    def __init__(self, retry=None):
+        """
+        Thread-safe metrics of HTTP requests, per endpoint: request, retry, error and status code counts,
+        bytes received and a latency histogram.
+        Sinks added with add_sink are also given every request as it is recorded,
+        e.g. to forward them to another metrics system.
+        :param retry: RetryMetrics of the retry policy and circuit breaker, exported with the request metrics.
+            Default is a new one
+        """
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._sinks = []
+        self.retry = retry or RetryMetrics()
+
+    def add_sink(self, sink):
+        """
+        :param sink: callable given a dict of endpoint, status, seconds, bytes_received and error for each request
+        """
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self._sinks.remove(sink)
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = EndpointMetrics()
+        return self._endpoints[endpoint]
+
+    def record(self, endpoint, seconds, status=None, bytes_received=0, error=None):
+        """
+        :param endpoint: label of the endpoint, see endpoint_label
+        :param seconds: latency of the request, until its response headers were received
+        :param status: HTTP status of the response, None if there was no response
+        :param bytes_received: size of the response body, where known
+        :param error: exception raised instead of a response
+        """
+        with self._lock:
+            metrics = self._endpoint(endpoint)
+            metrics.requests += 1
+            metrics.latency_sum += seconds
+            metrics.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            metrics.bytes_received += bytes_received
+            if status is not None:
+                metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            if error is not None:
+                metrics.errors += 1
+        for sink in list(self._sinks):
+            try:
+                sink(
+                    {
+                        "endpoint": endpoint,
+                        "status": status,
+                        "seconds": seconds,
+                        "bytes_received": bytes_received,
+                        "error": str(error) if error is not None else None,
+                    }
+                )
+            except Exception as e:
+                logging.warning(f"Metrics sink {sink} failed: {e}")
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            self._endpoint(endpoint).retries += 1
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+        self.retry.reset()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                endpoint: metrics.as_dict()
+                for endpoint, metrics in sorted(self._endpoints.items())
+            }
+
+    def summary(self):
+        """
+        :return: total number of requests and seconds spent waiting on them, over all endpoints
+        """
+        with self._lock:
+            return (
+                sum(metrics.requests for metrics in self._endpoints.values()),
+                sum(metrics.latency_sum for metrics in self._endpoints.values()),
+            )
+
+    def export(self):
+        """
+        :return: the request metrics of each endpoint and the retry metrics, as written by write_json
+        """
+        return {"endpoints": self.as_dict(), "retry": self.retry.as_dict()}
+
+    def write_json(self, path):
+        with atomic_write(path) as json_file:
+            json.dump(self.export(), json_file, indent=2)
+
+    def to_prometheus(self, prefix="assembly_uploader_http"):
+        """
+        :return: the metrics in the Prometheus text exposition format, e.g. for the node_exporter textfile collector
+        """
+        metrics = self.as_dict()
+        retry = self.retry.as_dict()
+        lines = []
+
+        def counter(name, help_text, values):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for labels, value in values:
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        def label(endpoint):
+            return 'endpoint="{}"'.format(endpoint.replace('"', '\\"'))
+
+        counter(
+            "requests_total",
+            "HTTP requests sent.",
+            [(label(e), m["requests"]) for e, m in metrics.items()],
+        )
+        counter(
+            "retries_total",
+            "HTTP requests retried.",
+            [(label(e), m["retries"]) for e, m in metrics.items()],
+        )
+        counter(
+            "errors_total",
+            "HTTP requests that got no response.",
+            [(label(e), m["errors"]) for e, m in metrics.items()],
+        )
+        counter(
+            "received_bytes_total",
+            "Bytes of the HTTP response bodies.",
+            [(label(e), m["bytes_received"]) for e, m in metrics.items()],
+        )
+        counter(
+            "responses_total",
+            "HTTP responses by status code.",
+            [
+                (f'{label(e)},status="{status}"', count)
+                for e, m in metrics.items()
+                for status, count in m["statuses"].items()
+            ],
+        )
+
+        counter(
+            "gave_up_total",
+            "HTTP requests that failed on their last attempt.",
+            [("", retry["gave_up"])],
+        )
+        counter(
+            "retry_after_honoured_total",
+            "Retries that waited for the Retry-After of the response.",
+            [("", retry["retry_after_honoured"])],
+        )
+        counter(
+            "backoff_seconds_total",
+            "Seconds waited before retrying.",
+            [("", retry["backoff_seconds"])],
+        )
+        counter(
+            "breaker_opened_total",
+            "Times the circuit breaker opened.",
+            [("", retry["breaker_opened"])],
+        )
+        counter(
+            "breaker_wait_seconds_total",
+            "Seconds waited for the circuit breaker to close.",
+            [("", retry["breaker_wait_seconds"])],
+        )
+
+        name = f"{prefix}_request_duration_seconds"
+        lines.append(f"# HELP {name} Latency of the HTTP requests.")
+        lines.append(f"# TYPE {name} histogram")
+        for endpoint, endpoint_metrics in metrics.items():
+            latency = endpoint_metrics["latency_seconds"]
+            cumulative = 0
+            for bound, count in latency["buckets"].items():
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{{label(endpoint)},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{name}_sum{{{label(endpoint)}}} {latency['sum']}")
+            lines.append(f"{name}_count{{{label(endpoint)}}} {latency['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        with atomic_write(path) as prom_file:
+            prom_file.write(self.to_prometheus())
+
+
+#   metrics of all the requests of this process
+REQUEST_METRICS = RequestMetrics()
+
+
+def add_metrics_args(parser):
+    parser.add_argument(
+        "--metrics-json",
+        help="write a JSON summary of the HTTP requests and their retries to this file at the end of the run",
+        required=False,
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        help="write the HTTP request metrics to this Prometheus textfile at the end of the run",
+        required=False,
+    )
+
+
+def write_metrics_from_args(args, metrics=REQUEST_METRICS):
+    """
+    Write the metrics to the files of the add_metrics_args arguments, if given.
+    """
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import logging
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from .assembly_manifest import (
+    AssemblyManifestGenerator,
+    add_manifest_args,
+    manifest_options_from_args,
+)
+from .ena_cache import add_ena_cache_args, ena_cache_from_args
+from .ena_queries import get_session
+from .ledger import add_ledger_args, ledger_from_args
+from .metrics import add_metrics_args, write_metrics_from_args
+from .study_xmls import METAGENOME, METATRANSCRIPTOME, StudyXMLGenerator
+from .submit_study import submit_study
+from .webin_utils import ensure_webin_credentials_exist
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="assembly_uploader", description="ENA assembly uploader"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser(
+        "run",
+        help="generate the study XMLs, register the assembly study and write the assembly manifests",
+        description="Generate the study XMLs, register the assembly study in ENA and write the manifests "
+        "of its assemblies, in one process",
+    )
+    run.add_argument("--study", help="raw reads study ID", required=True)
+    run.add_argument(
+        "--data",
+        help="metadata CSV - run_id, coverage, assembler, version, filepath",
+        required=True,
+    )
+    run.add_argument(
+        "--library",
+        help="Library ",
+        choices=[METAGENOME, METATRANSCRIPTOME],
+        required=True,
+    )
+    run.add_argument("--center", help="center for upload e.g. EMG", required=True)
+    run.add_argument(
+        "--hold",
+        help="hold date (private) if it should be different from the provided study in "
+        "format dd-mm-yyyy. Will inherit the release date of the raw read study if not "
+        "provided.",
+        required=False,
+    )
+    run.add_argument(
+        "--tpa",
+        help="use this flag if the study a third party assembly. Default False",
+        action="store_true",
+        default=False,
+    )
+    run.add_argument(
+        "--publication",
+        help="pubmed ID for connected publication if available",
+        type=int,
+        required=False,
+    )
+    run.add_argument(
+        "--private",
+        help="use flag if private",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    run.add_argument(
+        "--test",
+        help="register the assembly study in the ENA test service only",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    run.add_argument("--output-dir", help="Path to output directory", required=False)
+    add_manifest_args(run)
+    add_ena_cache_args(run)
+    add_ledger_args(run)
+    add_metrics_args(run)
+    return parser.parse_args(argv)
+
+
+def run_pipeline(
+    study: str,
+    assemblies_csv: Path,
+    center_name: str,
+    library: str,
+    hold_date: datetime = None,
+    tpa: bool = False,
+    publication: int = None,
+    private: bool = False,
+    is_test: bool = False,
+    output_dir: Path = None,
+    session=None,
+    retry_policy=None,
+    ena_cache=None,
+    ledger=None,
+    **manifest_options,
+):
+    """
+    Generate the study XMLs of a raw reads study, register its assembly study in ENA, and write the manifests
+    of its assemblies into the new assembly study, in one process.
+    All the steps share one HTTP session and the ENA metadata they resolve, so the study is fetched once.
+    :param study: raw reads study ID/accession
+    :param assemblies_csv: path to assemblies CSV file, listing run_id, coverage, assembler, version, filepath of each assembly
+    :param center_name: submission centre name, e.g. EMG
+    :param library: METAGENOME or METATRANSCRIPTOME
+    :param hold_date: hold date for the data to remain private, if it should be different from the provided study
+    :param tpa: is this a third-party assembly?
+    :param publication: pubmed ID for connected publication if available
+    :param private: is this a private study?
+    :param is_test: register the assembly study in the ENA test service only
+    :param output_dir: path to output directory (default is CWD)
+    :param session: requests.Session of every ENA request, default is the shared session
+    :param retry_policy: RetryPolicy of the ENA lookups, default is the process-wide policy
+    :param ena_cache: EnaResponseCache of the study and run metadata, default is no cache
+    :param ledger: SubmissionLedger of the registered assembly studies, default is no ledger
+    :param manifest_options: other arguments of AssemblyManifestGenerator, e.g. workers or resume
+    :return: accession of the assembly study
+    :raises RuntimeError: if the assembly study could not be registered
+    """
+    session = session or get_session()
+    timings = {}
+
+    start = time.perf_counter()
+    study_reg = StudyXMLGenerator(
+        study=study,
+        center_name=center_name,
+        library=library,
+        hold_date=hold_date,
+        tpa=tpa,
+        output_dir=output_dir,
+        publication=publication,
+        private=private,
+        session=session,
+        retry_policy=retry_policy,
+        ena_cache=ena_cache,
+    )
+    study_reg.write()
+    timings["study_xmls"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assembly_study = submit_study(
+        study, is_test, directory=study_reg.upload_dir, session=session, ledger=ledger
+    )
+    timings["submit_study"] = time.perf_counter() - start
+    if not assembly_study:
+        raise RuntimeError(f"The assembly study of {study} could not be registered")
+
+    start = time.perf_counter()
+    manifest_generator = AssemblyManifestGenerator(
+        study=study,
+        assembly_study=assembly_study,
+        assemblies_csv=assemblies_csv,
+        output_dir=output_dir,
+        private=private,
+        tpa=tpa,
+        session=session,
+        retry_policy=retry_policy,
+        ena_cache=ena_cache,
+        **manifest_options,
+    )
+    try:
+        manifest_generator.write()
+    finally:
+        manifest_generator.close()
+    timings["assembly_manifest"] = time.perf_counter() - start
+
+    logging.info(
+        f"Assembly study {assembly_study} of {study} ready for upload: "
+        + ", ".join(f"{step} {seconds:.1f}s" for step, seconds in timings.items())
+    )
+    return assembly_study
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    ensure_webin_credentials_exist()
+    ena_cache = ena_cache_from_args(args)
+    ledger = ledger_from_args(args)
+    try:
+        run_pipeline(
+            study=args.study,
+            assemblies_csv=Path(args.data),
+            center_name=args.center,
+            library=args.library,
+            hold_date=datetime.strptime(args.hold, "%d-%m-%Y") if args.hold else None,
+            tpa=args.tpa,
+            publication=args.publication,
+            private=args.private,
+            is_test=args.test,
+            output_dir=Path(args.output_dir) if args.output_dir else None,
+            ena_cache=ena_cache,
+            ledger=ledger,
+            **manifest_options_from_args(args),
+        )
+    except RuntimeError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        if ena_cache:
+            ena_cache.close()
+        if ledger:
+            ledger.close()
+        write_metrics_from_args(args)
+
+
+if __name__ == "__main__":
+    main()
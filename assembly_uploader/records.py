@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class _Record:
+    __slots__ = ()
+
+    def as_dict(self):
+        """
+        :return: the record as a dict, in the format returned by EnaQuery.build_query
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, field) for field in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join(f"{f}={getattr(self, f)!r}" for f in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class RunRecord(_Record):
+    __slots__ = ("run_accession", "sample_accession", "instrument_model")
+
+    def __init__(self, run_accession, sample_accession, instrument_model):
+        """
+        Metadata of a raw reads run, without the per-instance dict of a plain dict or object.
+        """
+        self.run_accession = run_accession
+        self.sample_accession = sample_accession
+        self.instrument_model = instrument_model
+
+    @classmethod
+    def from_portal(cls, row):
+        """
+        :param row: run of a portal search, as a JSON object or a TSV csv.DictReader row,
+            or the dict of a run returned by EnaQuery.build_query
+        """
+        return cls(
+            row["run_accession"], row["sample_accession"], row["instrument_model"]
+        )
+
+    @classmethod
+    def from_report(cls, report, run_accession=None):
+        """
+        :param report: "report" of a run in the Webin runs report
+        :param run_accession: accession the run was queried with, default is the report id
+        """
+        return cls(
+            run_accession or report["id"], report["sampleId"], report["instrumentModel"]
+        )
+
+    @classmethod
+    def coerce(cls, run):
+        """
+        :return: run as a RunRecord, if it is still a dict
+        """
+        return run if isinstance(run, cls) else cls.from_portal(run)
+
+
+class StudyRecord(_Record):
+    __slots__ = ("study_accession", "study_title", "first_public")
+
+    def __init__(self, study_accession, study_title, first_public):
+        """
+        Metadata of a raw reads study. first_public is a YYYY-MM-DD date.
+        """
+        self.study_accession = study_accession
+        self.study_title = study_title
+        self.first_public = first_public
+
+    @classmethod
+    def from_portal(cls, row):
+        """
+        :param row: study of a portal search, or the dict of a study returned by EnaQuery.build_query
+        """
+        return cls(row["study_accession"], row["study_title"], row["first_public"])
+
+    @classmethod
+    def from_report(cls, report):
+        """
+        :param report: "report" of a study in the Webin studies report
+        """
+        return cls(
+            report["secondaryId"],
+            report["title"],
+            #   remove time and keep date
+            report["firstPublic"].split("T")[0],
+        )
+
+    @classmethod
+    def coerce(cls, study):
+        """
+        :return: study as a StudyRecord, if it is still a dict
+        """
+        return study if isinstance(study, cls) else cls.from_portal(study)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+#   throttling and transient server-side failures
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def parse_retry_after(value):
+    """
+    :param value: Retry-After header, either a number of seconds or an HTTP date
+    :return: seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryMetrics:
+    def __init__(self):
+        """
+        Thread-safe counters of the retry policy and circuit breaker.
+        """
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+            self.gave_up = 0
+            self.retry_after_honoured = 0
+            self.backoff_seconds = 0.0
+            self.statuses = {}
+            self.errors = {}
+            self.breaker_opened = 0
+            self.breaker_wait_seconds = 0.0
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def count(self, name, key):
+        with self._lock:
+            counts = getattr(self, name)
+            counts[key] = counts.get(key, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "retry_after_honoured": self.retry_after_honoured,
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "statuses": dict(self.statuses),
+                "errors": dict(self.errors),
+                "breaker_opened": self.breaker_opened,
+                "breaker_wait_seconds": round(self.breaker_wait_seconds, 3),
+            }
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, metrics=None):
+        """
+        Shared by all the workers of a process, so that they all pause while ENA is down instead of
+        each of them spending its retries against it.
+        After failure_threshold consecutive failures the breaker opens for reset_timeout seconds.
+        It then lets a single probe request through: if that succeeds the breaker closes, otherwise it opens again.
+        :param failure_threshold: number of consecutive failed requests that opens the breaker
+        :param reset_timeout: seconds the breaker stays open before a probe request is let through
+        :param metrics: RetryMetrics to count the openings and waits in
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.metrics = metrics or RetryMetrics()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def acquire(self):
+        """
+        :return: (seconds to wait before sending a request, 0 if it can be sent now;
+            whether the request is the probe of a half-open breaker, which must be followed by
+            record_success, record_failure or release_probe)
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0, False
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    self.metrics.increment("breaker_wait_seconds", remaining)
+                    return remaining, False
+                self.state = HALF_OPEN
+            if self._probing:
+                #   wait for the outcome of the probe
+                wait = min(1.0, self.reset_timeout)
+                self.metrics.increment("breaker_wait_seconds", wait)
+                return wait, False
+            self._probing = True
+            return 0.0, True
+
+    def wait_time(self):
+        """
+        Read-only view of the breaker: unlike acquire it never claims the probe of a half-open breaker.
+
+        :return: seconds to wait before sending a request, 0 if it can be sent now
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    return remaining
+            if self._probing:
+                return min(1.0, self.reset_timeout)
+            return 0.0
+
+    def release_probe(self):
+        """
+        End a probe whose outcome was not recorded, e.g. because it raised an error that is not retried
+        or was cancelled: the breaker opens again, instead of waiting forever for the outcome.
+        """
+        with self._lock:
+            probing = self.state == HALF_OPEN and self._probing
+        if probing:
+            self.record_failure()
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("ENA is responding again, resuming requests")
+            self.state = CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and self._failures >= self.failure_threshold
+            ):
+                logging.warning(
+                    f"ENA failed {self._failures} consecutive requests, "
+                    f"pausing requests for {self.reset_timeout}s"
+                )
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+                self.metrics.increment("breaker_opened")
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        attempts=3,
+        backoff=1.0,
+        max_backoff=60.0,
+        jitter=True,
+        retry_statuses=RETRY_STATUSES,
+        breaker=None,
+        metrics=None,
+    ):
+        """
+        When and how long to wait before retrying a request.
+        Retries connection errors, timeouts and the retry_statuses, waiting for the Retry-After of the response
+        if it has one, otherwise for an exponential backoff: backoff, 2 * backoff, 4 * backoff... up to max_backoff.
+        :param attempts: maximum number of attempts of each request
+        :param backoff: seconds to wait before the first retry
+        :param max_backoff: maximum seconds to wait between attempts, unless the response asked for longer
+        :param jitter: wait a random time between 0 and the backoff ("full jitter"),
+            so that workers that failed together do not retry together
+        :param retry_statuses: HTTP statuses that are retried
+        :param breaker: CircuitBreaker shared with other policies, default is a new one
+        :param metrics: RetryMetrics to count in, default is the breaker's
+        """
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.metrics = metrics or (breaker.metrics if breaker else RetryMetrics())
+        self.breaker = breaker or CircuitBreaker(metrics=self.metrics)
+
+    def is_retryable(self, response):
+        return response.status_code in self.retry_statuses
+
+    def delay(self, attempt, response=None):
+        """
+        :param attempt: number of the attempt that failed, starting at 1
+        :param response: the failed response, if there was one
+        :return: seconds to wait before the next attempt
+        """
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                self.metrics.increment("retry_after_honoured")
+                return retry_after
+        backoff = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            backoff = random.uniform(0, backoff)
+        return backoff
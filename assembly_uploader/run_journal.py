@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import threading
+from datetime import datetime
+
+JOURNAL_FILENAME = ".manifest_journal.tsv"
+
+QUERIED = "queried"
+HASHED = "hashed"
+WRITTEN = "written"
+FAILED = "failed"
+
+
+class RunJournal:
+    def __init__(self, journal_path):
+        """
+        Append-only record of the progress of each run through manifest generation.
+        Each line is: timestamp, run accession, status, message. The last line of a run is its current status.
+        :param journal_path: path of the journal file, created if missing
+        """
+        self.journal_path = journal_path
+        self.statuses = {}
+        self._lock = threading.Lock()
+        try:
+            with open(journal_path, newline="") as journal_file:
+                for line in csv.reader(journal_file, delimiter="\t"):
+                    #   a crash mid-write can leave a truncated last line
+                    if len(line) == 4:
+                        self.statuses[line[1]] = line[2]
+        except FileNotFoundError:
+            pass
+        self._journal_file = open(journal_path, "a", newline="")
+        self._writer = csv.writer(self._journal_file, delimiter="\t")
+
+    def completed(self):
+        """
+        :return: set of the runs whose manifest was written
+        """
+        return {run for run, status in self.statuses.items() if status == WRITTEN}
+
+    def record(self, run_id, status, message=""):
+        with self._lock:
+            self.statuses[run_id] = status
+            self._writer.writerow(
+                (datetime.now().isoformat(timespec="seconds"), run_id, status, message)
+            )
+            self._journal_file.flush()
+
+    def close(self):
+        with self._lock:
+            self._journal_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -15,21 +15,37 @@
 # limitations under the License.
 
 import argparse
+import logging
 import sys
-import xml.dom.minidom as minidom
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from .ena_queries import EnaQuery
+from .ena_cache import add_ena_cache_args, ena_cache_from_args
+from .ena_queries import EnaQuery, EnaStudiesQuery
+from .metrics import add_metrics_args, write_metrics_from_args
+from .records import StudyRecord
+from .xml_utils import write_pretty_xml
 
 METAGENOME = "metagenome"
 METATRANSCRIPTOME = "metatranscriptome"
+#   studies whose XMLs are written concurrently in batch mode
+BATCH_WORKERS = 8
 
 
 def parse_args(argv):
     parser = argparse.ArgumentParser(description="Study XML generation")
-    parser.add_argument("--study", help="raw reads study ID", required=True)
+    studies = parser.add_mutually_exclusive_group(required=True)
+    studies.add_argument(
+        "--study",
+        help="raw reads study ID, or several to generate the XMLs of each of them",
+        nargs="+",
+    )
+    studies.add_argument(
+        "--studies-file",
+        help="file listing raw reads study IDs, one per line, to generate the XMLs of each of them",
+    )
     parser.add_argument(
         "--library",
         help="Library ",
@@ -64,9 +80,29 @@ def parse_args(argv):
         default=False,
         action="store_true",
     )
+    parser.add_argument(
+        "--workers",
+        help=f"studies written concurrently when there are several. Default {BATCH_WORKERS}",
+        type=int,
+        default=BATCH_WORKERS,
+    )
+    add_ena_cache_args(parser)
+    add_metrics_args(parser)
     return parser.parse_args(argv)
 
 
+def read_studies_file(studies_file):
+    """
+    :return: the study IDs listed in studies_file, one per line, skipping blank lines and # comments
+    """
+    with open(studies_file) as studies:
+        return [
+            line.strip()
+            for line in studies
+            if line.strip() and not line.startswith("#")
+        ]
+
+
 class StudyXMLGenerator:
     def __init__(
         self,
@@ -78,6 +114,10 @@ class StudyXMLGenerator:
         output_dir: Path = None,
         publication: int = None,
         private: bool = False,
+        session=None,
+        retry_policy=None,
+        ena_cache=None,
+        study_metadata=None,
     ):
         f"""
         Build submission files for an assembly study.
@@ -90,6 +130,11 @@ class StudyXMLGenerator:
         :param output_dir: path to output directory (default is CWD)
         :param publication: pubmed ID for connected publication if available
         :param private: is this a private study?
+        :param session: requests.Session for the ENA lookup, default is the shared session
+        :param retry_policy: RetryPolicy of the ENA lookup, default is the process-wide policy
+        :param ena_cache: EnaResponseCache of the study metadata, default is no cache
+        :param study_metadata: StudyRecord or metadata dict of the study, if already known.
+            Otherwise it is fetched from ENA when the XMLs are first written
         :return: StudyXMLGenerator object
         """
         self.study = study
@@ -113,12 +158,31 @@ class StudyXMLGenerator:
         self.publication = publication
         self.private = private
 
-        ena_query = EnaQuery(self.study, self.private)
-        self.study_obj = ena_query.build_query()
+        self.session = session
+        self.retry_policy = retry_policy
+        self.ena_cache = ena_cache
+        self._study_obj = (
+            StudyRecord.coerce(study_metadata) if study_metadata is not None else None
+        )
 
         self._title = None
         self._abstract = None
 
+    @property
+    def study_obj(self):
+        """
+        :return: StudyRecord of the raw reads study, fetched from ENA on first use
+        """
+        if self._study_obj is None:
+            self._study_obj = EnaQuery(
+                self.study,
+                self.private,
+                self.session,
+                retry_policy=self.retry_policy,
+                cache=self.ena_cache,
+            ).build_record()
+        return self._study_obj
+
     def write_study_xml(self):
         subtitle = self.library.title()
         if self.tpa:
@@ -127,18 +191,20 @@ class StudyXMLGenerator:
             sub_abstract = ""
 
         title = (
-            f"{subtitle} assembly of {self.study_obj['study_accession']} data "
-            f"set ({self.study_obj['study_title']})"
+            f"{subtitle} assembly of {self.study_obj.study_accession} data "
+            f"set ({self.study_obj.study_title})"
         )
         self._title = title
         abstract = (
             f"The {sub_abstract}assembly was derived from the primary data "
-            f"set {self.study_obj['study_accession']}"
+            f"set {self.study_obj.study_accession}"
         )
         self._abstract = abstract
 
-        project_alias = self.study_obj["study_accession"] + "_assembly"
-        with open(self.study_xml_path, "wb") as study_file:
+        project_alias = self.study_obj.study_accession + "_assembly"
+        with open(
+            self.study_xml_path, "w", encoding="utf-8", newline="\n"
+        ) as study_file:
             project_set = ET.Element("PROJECT_SET")
             project = ET.SubElement(project_set, "PROJECT")
             project.set("alias", project_alias)
@@ -176,11 +242,12 @@ class StudyXMLGenerator:
                 f"{self.library} assembly"
             )
 
-            dom = minidom.parseString(ET.tostring(project_set, encoding="utf-8"))
-            study_file.write(dom.toprettyxml().encode("utf-8"))
+            write_pretty_xml(project_set, study_file)
 
     def write_submission_xml(self):
-        with open(self.submission_xml_path, "wb") as submission_file:
+        with open(
+            self.submission_xml_path, "w", encoding="utf-8", newline="\n"
+        ) as submission_file:
             submission = ET.Element("SUBMISSION")
             submission.set("center_name", self.center)
 
@@ -190,7 +257,7 @@ class StudyXMLGenerator:
             ET.SubElement(action_sub, "ADD")
 
             # attributes: function and hold date
-            public = self.study_obj["first_public"]
+            public = self.study_obj.first_public
             today = datetime.today().strftime("%Y-%m-%d")
             if self.hold_date:
                 action_hold = ET.SubElement(actions, "ACTION")
@@ -201,8 +268,7 @@ class StudyXMLGenerator:
                 hold = ET.SubElement(action_hold, "HOLD")
                 hold.set("HoldUntilDate", public)
 
-            dom = minidom.parseString(ET.tostring(submission, encoding="utf-8"))
-            submission_file.write(dom.toprettyxml().encode("utf-8"))
+            write_pretty_xml(submission, submission_file)
 
     def write(self):
         """
@@ -212,20 +278,108 @@ class StudyXMLGenerator:
         self.write_submission_xml()
 
 
+def write_study_xmls(
+    studies,
+    center_name: str,
+    library: str,
+    hold_date: datetime = None,
+    tpa: bool = False,
+    output_dir: Path = None,
+    publication: int = None,
+    private: bool = False,
+    session=None,
+    retry_policy=None,
+    ena_cache=None,
+    study_metadata=None,
+    workers: int = BATCH_WORKERS,
+    raise_errors: bool = True,
+):
+    """
+    Write the registration and submission XMLs of many studies, each in its own {study}_upload directory.
+    The metadata of all the studies is resolved up front with bulk ENA queries, then the XMLs are written
+    by workers threads. Takes the arguments of StudyXMLGenerator, shared by all the studies, plus:
+    :param studies: raw reads study IDs/accessions
+    :param study_metadata: dict of study ID to StudyRecord or metadata dict, for studies already known
+    :param workers: number of studies written concurrently
+    :param raise_errors: raise ENA errors, instead of logging them and skipping the studies they affect
+    :return: dict of study ID to its written StudyXMLGenerator
+    :raises ValueError: if some of the studies are not valid study accessions
+    """
+    metadata = dict(study_metadata or {})
+    missing = [study for study in studies if study not in metadata]
+    if missing:
+        metadata.update(
+            EnaStudiesQuery(
+                missing,
+                private,
+                session=session,
+                retry_policy=retry_policy,
+                cache=ena_cache,
+            ).build_records(raise_errors)
+        )
+    generators = {}
+    for study in dict.fromkeys(studies):
+        if study not in metadata:
+            logging.error(f"Skipping {study}, its metadata could not be fetched")
+            continue
+        generators[study] = StudyXMLGenerator(
+            study=study,
+            center_name=center_name,
+            library=library,
+            hold_date=hold_date,
+            tpa=tpa,
+            output_dir=output_dir,
+            publication=publication,
+            private=private,
+            session=session,
+            retry_policy=retry_policy,
+            ena_cache=ena_cache,
+            study_metadata=metadata[study],
+        )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(StudyXMLGenerator.write, generators.values()))
+    logging.info(f"Wrote the XMLs of {len(generators)} of {len(studies)} studies")
+    return generators
+
+
 def main():
     args = parse_args(sys.argv[1:])
-    study_reg = StudyXMLGenerator(
-        study=args.study,
-        center_name=args.center,
-        library=args.library,
-        hold_date=args.hold,
-        tpa=args.tpa,
-        output_dir=Path(args.output_dir) if args.output_dir else None,
-        publication=args.publication,
-        private=args.private,
-    )
-    study_reg.write_study_xml()
-    study_reg.write_submission_xml()
+    ena_cache = ena_cache_from_args(args)
+    studies = read_studies_file(args.studies_file) if args.studies_file else args.study
+    output_dir = Path(args.output_dir) if args.output_dir else None
+    try:
+        if len(studies) == 1:
+            StudyXMLGenerator(
+                study=studies[0],
+                center_name=args.center,
+                library=args.library,
+                hold_date=args.hold,
+                tpa=args.tpa,
+                output_dir=output_dir,
+                publication=args.publication,
+                private=args.private,
+                ena_cache=ena_cache,
+            ).write()
+        else:
+            write_study_xmls(
+                studies,
+                center_name=args.center,
+                library=args.library,
+                hold_date=args.hold,
+                tpa=args.tpa,
+                output_dir=output_dir,
+                publication=args.publication,
+                private=args.private,
+                ena_cache=ena_cache,
+                workers=args.workers,
+            )
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        if ena_cache:
+            ena_cache.close()
+    write_metrics_from_args(args)
 
 
 if __name__ == "__main__":
@@ -16,80 +16,183 @@
 
 import argparse
 import logging
+import os
 import re
+import sys
+import time
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
 from pathlib import Path
 
 import requests
 
+from assembly_uploader.ena_queries import get_session
+from assembly_uploader.ledger import add_ledger_args, endpoint_name, ledger_from_args
+from assembly_uploader.metrics import (
+    REQUEST_METRICS,
+    add_metrics_args,
+    endpoint_label,
+    write_metrics_from_args,
+)
+from assembly_uploader.study_xmls import read_studies_file
 from assembly_uploader.webin_utils import (
     ensure_webin_credentials_exist,
     get_webin_credentials,
 )
+from assembly_uploader.xml_utils import to_pretty_xml
 
 logging.basicConfig(level=logging.INFO)
 
 
-DROPBOX_DEV = "https://wwwdev.ebi.ac.uk/ena/submit/drop-box/submit"
-DROPBOX_PROD = "https://www.ebi.ac.uk/ena/submit/drop-box/submit/"
+#   overridable to point the submissions at a stand-in server, see assembly_uploader.testing
+DROPBOX_DEV = os.environ.get(
+    "ENA_DROPBOX_URL_DEV", "https://wwwdev.ebi.ac.uk/ena/submit/drop-box/submit"
+)
+DROPBOX_PROD = os.environ.get(
+    "ENA_DROPBOX_URL", "https://www.ebi.ac.uk/ena/submit/drop-box/submit/"
+)
+#   projects registered per drop-box submission in bulk mode
+BULK_CHUNK_SIZE = 100
+
+_EXISTING_RE = re.compile(
+    r"already exists in the submission account with accession: "
+    r"\"(PRJ[EDN][A-Z][0-9]+)\""
+)
+_ERROR_ALIAS_RE = re.compile(r"alias: \"([^\"]+)\"")
+
+
+def parse_receipt(receipt):
+    """
+    Parse a drop-box receipt in one pass.
+    :param receipt: receipt XML
+    :return: (projects, errors): dict of project alias to {"accession": ..., "error": ...}, with the accession
+        of the new or already existing project, and the error of the project if there was one;
+        and the list of the errors that are not about a single project
+    """
+    projects = OrderedDict()
+    errors = []
+    root = ET.fromstring(receipt)
+    for project in root.iter("PROJECT"):
+        projects[project.get("alias")] = {
+            "accession": project.get("accession"),
+            "error": None,
+        }
+    for error in root.iter("ERROR"):
+        message = error.text or ""
+        alias = _ERROR_ALIAS_RE.search(message)
+        if alias is None and len(projects) == 1 and _EXISTING_RE.search(message):
+            #   a single project is what an "already exists" error without an alias is about
+            alias = next(iter(projects))
+        elif alias is None:
+            errors.append(message)
+            continue
+        else:
+            alias = alias.group(1)
+        result = projects.setdefault(alias, {"accession": None, "error": None})
+        result["error"] = message
+        existing = _EXISTING_RE.search(message)
+        if existing:
+            result["accession"] = existing.group(1)
+    return projects, errors
 
 
-def parse_failed_study_acc(report):
-    failed_re = (
-        r"The object being added already exists in the submission account with accession: "
-        r"\"(PRJ[EDN][A-Z][0-9]+)\""
+def _post_submission(session, endpoint, files):
+    label = endpoint_label("POST", endpoint)
+    start = time.perf_counter()
+    try:
+        response = session.post(endpoint, files=files, auth=get_webin_credentials())
+    except requests.RequestException as e:
+        REQUEST_METRICS.record(label, time.perf_counter() - start, error=e)
+        raise
+    REQUEST_METRICS.record(
+        label,
+        time.perf_counter() - start,
+        response.status_code,
+        len(response.content),
     )
-    root = ET.fromstring(report)
-    errors = root.findall(".//ERROR")
+    return response
 
-    for e in errors:
-        error_text = e.text
-        existing_acc = re.findall(failed_re, error_text)
-        if existing_acc:
-            return existing_acc[0]
 
+def read_project(study_xml):
+    """
+    :return: the PROJECT element of a {study}_reg.xml
+    :raises ValueError: if the file does not hold exactly one PROJECT
+    """
+    projects = list(ET.parse(study_xml).getroot().iter("PROJECT"))
+    if len(projects) != 1:
+        raise ValueError(
+            f"{study_xml} holds {len(projects)} projects, one assembly study is registered per raw reads study"
+        )
+    return projects[0]
 
-def parse_success_study_acc(report):
-    success_re = r"accession=\"(PRJ[EDN][A-Z][0-9]+)\""
-    new_acc = re.findall(success_re, report)
-    if new_acc:
-        return new_acc[0]
 
+def project_alias(study_xml):
+    """
+    :return: alias of the PROJECT of a {study}_reg.xml
+    :raises ValueError: if the file does not hold exactly one PROJECT
+    """
+    return read_project(study_xml).get("alias")
 
-def submit_study(study_id: str, is_test: bool = False, directory: Path = None):
+
+def submit_study(
+    study_id: str,
+    is_test: bool = False,
+    directory: Path = None,
+    session=None,
+    ledger=None,
+):
+    """
+    Submit the study and submission XMLs of a study to the ENA drop-box.
+    :param study_id: raw reads study ID
+    :param is_test: submit to the ENA test service only
+    :param directory: directory containing the XMLs, default {study_id}_upload
+    :param session: requests.Session to submit with, default is the shared session
+    :param ledger: SubmissionLedger checked before submitting and updated with the receipt, default is no ledger
+    :return: accession of the new or existing assembly study, None if the submission failed
+    :raises ValueError: if the study XML does not hold exactly one PROJECT
+    """
+    session = session or get_session()
     endpoint = DROPBOX_DEV if is_test else DROPBOX_PROD
-    logging.info(f"Submitting study xml {study_id}")
     workdir = directory or Path.cwd() / Path(f"{study_id}_upload")
     assert workdir.exists()
 
     submission_xml = workdir / Path(f"{study_id}_submission.xml")
     study_xml = workdir / Path(f"{study_id}_reg.xml")
-    files = {
-        "SUBMISSION": open(submission_xml, "rb"),
-        "ACTION": (None, "ADD"),
-        "PROJECT": open(study_xml, "rb"),
-    }
+    alias = project_alias(study_xml)
+    if ledger:
+        registered = ledger.get(alias, endpoint_name(is_test))
+        if registered:
+            logging.info(
+                f"{alias} is already registered as {registered} in the ledger {ledger.db_path}"
+            )
+            return registered
 
-    submission_report = requests.post(
-        endpoint, files=files, auth=get_webin_credentials()
-    )
+    logging.info(f"Submitting study xml {study_id}")
+    with open(submission_xml, "rb") as submission_file, open(
+        study_xml, "rb"
+    ) as study_file:
+        files = {
+            "SUBMISSION": submission_file,
+            "ACTION": (None, "ADD"),
+            "PROJECT": study_file,
+        }
+        submission_report = _post_submission(session, endpoint, files)
     receipt_xml_str = submission_report.content.decode("utf-8")
+    try:
+        projects, _ = parse_receipt(submission_report.content)
+    except ET.ParseError:
+        projects = {}
+    result = projects.get(alias) or {"accession": None, "error": None}
 
-    if 'success="true"' in receipt_xml_str:
-        primary_accession = parse_success_study_acc(receipt_xml_str)
+    primary_accession = result["accession"]
+    if primary_accession and result["error"]:
         logging.info(
-            f"A new study accession has been created: {primary_accession}. Make a note of this!"
+            f"An accession with this alias already exists in project {primary_accession}"
         )
-        return primary_accession
-    elif (
-        "The object being added already exists in the submission account"
-        in receipt_xml_str
-    ):
-        primary_accession = parse_failed_study_acc(receipt_xml_str)
+    elif primary_accession:
         logging.info(
-            f"An accession with this alias already exists in project {primary_accession}"
+            f"A new study accession has been created: {primary_accession}. Make a note of this!"
         )
-        return primary_accession
     elif submission_report.status_code >= requests.codes.server_error:
         logging.error(
             "Project could not be registered on ENA as the server does not respond. Please again try later."
@@ -98,13 +201,148 @@ def submit_study(study_id: str, is_test: bool = False, directory: Path = None):
         logging.error(
             f"Project could not be registered on ENA. HTTP response: {receipt_xml_str}"
         )
+    if ledger and primary_accession:
+        ledger.put(alias, endpoint_name(is_test), primary_accession, study_id)
+    return primary_accession
+
+
+def _submit_projects(session, endpoint, submission_xml, projects):
+    """
+    :param projects: dict of project alias to its PROJECT element
+    :return: dict of project alias to its parse_receipt result, for the projects of the receipt
+    """
+    project_set = ET.Element("PROJECT_SET")
+    project_set.extend(projects.values())
+    files = {
+        "SUBMISSION": ("submission.xml", submission_xml),
+        "ACTION": (None, "ADD"),
+        "PROJECT": ("projects.xml", to_pretty_xml(project_set).encode("utf-8")),
+    }
+    response = _post_submission(session, endpoint, files)
+    try:
+        results, errors = parse_receipt(response.content)
+    except ET.ParseError:
+        logging.error(
+            f"{len(projects)} projects could not be registered on ENA. "
+            f"HTTP {response.status_code} response: {response.text}"
+        )
+        return {}
+    for error in errors:
+        logging.error(f"ENA submission error: {error}")
+    return results
+
+
+def submit_studies(
+    study_ids,
+    is_test: bool = False,
+    output_dir: Path = None,
+    session=None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    ledger=None,
+):
+    """
+    Register the assembly studies of many raw reads studies with as few drop-box submissions as possible.
+    The PROJECTs of the {study_id}_reg.xml files are merged into PROJECT_SETs of up to chunk_size projects.
+    Studies are only submitted together if their submission XMLs, which hold the hold date, are identical.
+    ENA rejects a whole submission if any of its projects fails, so the projects of a failed submission
+    that had no error of their own are submitted once more without the others.
+    :param study_ids: raw reads study IDs
+    :param is_test: submit to the ENA test service only
+    :param output_dir: directory containing the {study_id}_upload directories, default is the CWD
+    :param session: requests.Session to submit with, default is the shared session
+    :param chunk_size: maximum number of projects per submission
+    :param ledger: SubmissionLedger of the projects not to submit again, updated with the receipts.
+        Default is no ledger
+    :return: dict of study ID to the accession of its new or existing assembly study, None if it failed
+    :raises ValueError: if the registration XML of a study does not hold exactly one PROJECT,
+        before anything is submitted
+    """
+    session = session or get_session()
+    endpoint = DROPBOX_DEV if is_test else DROPBOX_PROD
+    output_dir = output_dir or Path.cwd()
+
+    #   submission XML -> alias -> PROJECT element
+    groups = OrderedDict()
+    study_aliases = {}
+    results = {}
+    for study_id in dict.fromkeys(study_ids):
+        workdir = output_dir / f"{study_id}_upload"
+        submission_xml = (workdir / f"{study_id}_submission.xml").read_bytes()
+        project = read_project(workdir / f"{study_id}_reg.xml")
+        alias = project.get("alias")
+        study_aliases[study_id] = alias
+        registered = ledger.get(alias, endpoint_name(is_test)) if ledger else None
+        if registered:
+            results[alias] = {"accession": registered, "error": None}
+        else:
+            groups.setdefault(submission_xml, OrderedDict())[alias] = project
+    in_ledger = set(results)
+    if in_ledger:
+        logging.info(f"{len(in_ledger)} projects are already registered in the ledger")
+    for submission_xml, projects in groups.items():
+        aliases = list(projects)
+        for start in range(0, len(aliases), chunk_size):
+            chunk = OrderedDict(
+                (alias, projects[alias])
+                for alias in aliases[start : start + chunk_size]
+            )
+            logging.info(f"Submitting {len(chunk)} projects to {endpoint}")
+            chunk_results = _submit_projects(session, endpoint, submission_xml, chunk)
+            retry = OrderedDict(
+                (alias, project)
+                for alias, project in chunk.items()
+                if not chunk_results.get(alias, {}).get("accession")
+                and not chunk_results.get(alias, {}).get("error")
+            )
+            if retry and len(retry) < len(chunk):
+                logging.info(
+                    f"Submitting again the {len(retry)} projects held back by the errors of others"
+                )
+                chunk_results.update(
+                    _submit_projects(session, endpoint, submission_xml, retry)
+                )
+            results.update(chunk_results)
+
+    accessions = {}
+    for study_id, alias in study_aliases.items():
+        result = results.get(alias) or {"accession": None, "error": "not in receipt"}
+        accessions[study_id] = result["accession"]
+        if result["accession"]:
+            logging.info(f"{study_id}: assembly study {result['accession']}")
+            if ledger and alias not in in_ledger:
+                ledger.put(alias, endpoint_name(is_test), result["accession"], study_id)
+        else:
+            logging.error(
+                f"Project {alias} of {study_id} could not be registered on ENA: {result['error']}"
+            )
+    logging.info(
+        f"{sum(1 for acc in accessions.values() if acc)} of {len(accessions)} assembly studies registered"
+    )
+    return accessions
 
 
 def main():
     parser = argparse.ArgumentParser(description="Submit study to ENA using XML")
-    parser.add_argument("--study", help="raw reads study ID", required=True)
+    studies = parser.add_mutually_exclusive_group(required=True)
+    studies.add_argument(
+        "--study",
+        help="raw reads study ID, or several to register all of them in bulk",
+        nargs="+",
+    )
+    studies.add_argument(
+        "--studies-file",
+        help="file listing raw reads study IDs, one per line, to register all of them in bulk",
+    )
     parser.add_argument(
-        "--directory", help="directory containing study XML", required=False
+        "--directory",
+        help="directory containing study XML, or the STUDY_upload directories of several studies",
+        required=False,
+    )
+    parser.add_argument(
+        "--chunk-size",
+        help=f"projects per drop-box submission when there are several. Default {BULK_CHUNK_SIZE}",
+        type=int,
+        default=BULK_CHUNK_SIZE,
     )
     parser.add_argument(
         "--test",
@@ -113,11 +351,35 @@ def main():
         default=False,
         action="store_true",
     )
+    add_ledger_args(parser)
+    add_metrics_args(parser)
     args = parser.parse_args()
 
     ensure_webin_credentials_exist()
 
-    submit_study(args.study, args.test, Path(args.directory))
+    directory = Path(args.directory) if args.directory else None
+    study_ids = (
+        read_studies_file(args.studies_file) if args.studies_file else args.study
+    )
+    ledger = ledger_from_args(args)
+    try:
+        if len(study_ids) == 1:
+            submit_study(study_ids[0], args.test, directory, ledger=ledger)
+        else:
+            submit_studies(
+                study_ids,
+                args.test,
+                directory,
+                chunk_size=args.chunk_size,
+                ledger=ledger,
+            )
+    except ValueError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        if ledger:
+            ledger.close()
+    write_metrics_from_args(args)
 
 
 if __name__ == "__main__":
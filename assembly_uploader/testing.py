@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local stand-in for the ENA endpoints used by assembly_uploader, serving generated studies and runs,
+for load tests and offline benchmarks:
+
+    with FakeEnaServer(runs=10000, latency=0.05, error_rate=0.01) as ena:
+        with ena.patch():
+            AssemblyManifestGenerator(...).write()
+
+or, for the command line tools, export the variables of FakeEnaServer.environment().
+"""
+
+import csv
+import io
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from . import ena_queries, submit_study
+
+PORTAL_PATH = "/ena/portal/api/search"
+REPORT_PATH = "/ena/submit/report/"
+DROPBOX_PATH = "/ena/submit/drop-box/submit"
+
+INSTRUMENT_MODELS = ("DNBSEQ-G400", "Illumina NovaSeq 6000", "Illumina HiSeq 2500")
+
+_QUERY_TERM = re.compile(r'(\w+)="([^"]*)"')
+_ALIAS = re.compile(rb'<PROJECT[^>]*\balias="([^"]+)"')
+
+
+class FakeEnaDataset:
+    def __init__(self, studies=1, runs=100, seed=0):
+        """
+        Generated ENA metadata: studies ERP000001... (PRJEB000001...), with the runs ERR0000001... spread over them.
+        :param studies: number of raw reads studies
+        :param runs: total number of runs
+        :param seed: seed of the generated metadata
+        """
+        rng = random.Random(seed)
+        self.studies = {}
+        for index in range(1, studies + 1):
+            self.studies[f"ERP{index:06d}"] = {
+                "study_accession": f"PRJEB{index:06d}",
+                "secondary_study_accession": f"ERP{index:06d}",
+                "study_title": f"Synthetic metagenome study {index}",
+                "first_public": "2022-08-02",
+            }
+        self.runs = {}
+        self.study_runs = {study: [] for study in self.studies}
+        study_ids = list(self.studies)
+        for index in range(1, runs + 1):
+            study = study_ids[(index - 1) % len(study_ids)]
+            run = {
+                "run_accession": f"ERR{index:07d}",
+                "sample_accession": f"SAMEA{index:07d}",
+                "instrument_model": rng.choice(INSTRUMENT_MODELS),
+            }
+            self.runs[run["run_accession"]] = run
+            self.study_runs[study].append(run)
+
+    def find_study(self, accession):
+        for study_id, study in self.studies.items():
+            if accession in (study_id, study["study_accession"]):
+                return study_id, study
+        return None, None
+
+
+class FakeEnaServer:
+    def __init__(
+        self,
+        studies=1,
+        runs=100,
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        retry_after=0,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        """
+        Serves the portal search, the Webin runs, studies and projects reports and the drop-box submission
+        on a local port.
+        :param studies: number of generated studies
+        :param runs: number of generated runs
+        :param latency: seconds each response is delayed by
+        :param error_rate: fraction of requests answered with a 503
+        :param throttle_rate: fraction of requests answered with a 429
+        :param retry_after: Retry-After of the 429 and 503 responses, in seconds
+        :param seed: seed of the generated data and of the injected errors
+        :param host: interface to listen on
+        :param port: port to listen on, default is any free port
+        """
+        self.dataset = FakeEnaDataset(studies, runs, seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = {}
+        self.submitted_projects = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def portal_url(self):
+        return f"{self.url}{PORTAL_PATH}"
+
+    @property
+    def report_url(self):
+        return f"{self.url}{REPORT_PATH}"
+
+    @property
+    def dropbox_url(self):
+        return f"{self.url}{DROPBOX_PATH}"
+
+    def environment(self):
+        """
+        :return: environment variables pointing the command line tools at this server
+        """
+        return {
+            "ENA_PORTAL_URL": self.portal_url,
+            "ENA_REPORT_URL": self.report_url,
+            "ENA_REPORT_URL_DEV": self.report_url,
+            "ENA_DROPBOX_URL": self.dropbox_url,
+            "ENA_DROPBOX_URL_DEV": self.dropbox_url,
+        }
+
+    @contextmanager
+    def patch(self):
+        """
+        Point the ENA client of this process at this server for the duration of the block.
+        """
+        saved = (
+            ena_queries.ENA_PORTAL_URL,
+            ena_queries.ENA_REPORT_URL,
+            ena_queries.ENA_REPORT_URL_DEV,
+            submit_study.DROPBOX_DEV,
+            submit_study.DROPBOX_PROD,
+        )
+        ena_queries.ENA_PORTAL_URL = self.portal_url
+        ena_queries.ENA_REPORT_URL = ena_queries.ENA_REPORT_URL_DEV = self.report_url
+        submit_study.DROPBOX_DEV = submit_study.DROPBOX_PROD = self.dropbox_url
+        try:
+            yield self
+        finally:
+            (
+                ena_queries.ENA_PORTAL_URL,
+                ena_queries.ENA_REPORT_URL,
+                ena_queries.ENA_REPORT_URL_DEV,
+                submit_study.DROPBOX_DEV,
+                submit_study.DROPBOX_PROD,
+            ) = saved
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def injected_error(self):
+        """
+        :return: HTTP status to answer with instead of the data, or None
+        """
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+    def search(self, form):
+        """
+        :return: (body, content type) of a portal search
+        """
+        terms = _QUERY_TERM.findall(form.get("query", ""))
+        fields = form.get("fields", "").split(",")
+        records = []
+        if form.get("result") == "study":
+            for _, accession in terms:
+                _, study = self.dataset.find_study(accession)
+                if study:
+                    records.append(study)
+        else:
+            for field, accession in terms:
+                if field == "run_accession":
+                    if accession in self.dataset.runs:
+                        records.append(self.dataset.runs[accession])
+                else:
+                    study_id, _ = self.dataset.find_study(accession)
+                    records.extend(self.dataset.study_runs.get(study_id, []))
+        records = [
+            {field: record.get(field, "") for field in fields} for record in records
+        ]
+        if form.get("format") == "tsv":
+            output = io.StringIO()
+            writer = csv.DictWriter(
+                output, fieldnames=fields, delimiter="\t", lineterminator="\n"
+            )
+            writer.writeheader()
+            writer.writerows(records)
+            return output.getvalue(), "text/plain"
+        return json.dumps(records), "application/json"
+
+    def report(self, path, query):
+        """
+        :return: (status, body) of a Webin report request
+        """
+        kind, _, accession = path[len(REPORT_PATH) :].partition("/")
+        if kind == "runs" and accession:
+            run = self.dataset.runs.get(accession)
+            if run is None:
+                return 404, json.dumps([])
+            return 200, json.dumps([{"report": _run_report(run)}])
+        if kind == "runs":
+            study_id, _ = self.dataset.find_study(query.get("studyId", [""])[0])
+            runs = self.dataset.study_runs.get(study_id, [])
+            offset = int(query.get("offset", ["0"])[0])
+            page_size = int(query.get("max", ["100"])[0])
+            page = runs[offset : offset + page_size]
+            return 200, json.dumps([{"report": _run_report(run)} for run in page])
+        if kind == "studies" and accession:
+            study_id, study = self.dataset.find_study(accession)
+            if study is None:
+                return 404, json.dumps([])
+            report = {
+                "id": study_id,
+                "secondaryId": study["study_accession"],
+                "title": study["study_title"],
+                "firstPublic": f"{study['first_public']}T00:00:00",
+                "releaseStatus": "PRIVATE",
+            }
+            return 200, json.dumps([{"report": report}])
+        if kind == "projects":
+            with self._lock:
+                projects = list(self.submitted_projects.items())
+            offset = int(query.get("offset", ["0"])[0])
+            page_size = int(query.get("max", ["100"])[0])
+            return 200, json.dumps(
+                [
+                    {"report": {"id": accession, "alias": alias}}
+                    for alias, accession in projects[offset : offset + page_size]
+                ]
+            )
+        return 404, json.dumps([])
+
+    def submit(self, body):
+        """
+        :return: receipt XML of a drop-box submission. Like ENA, a submission with any project that
+            already exists fails as a whole
+        """
+        aliases = [alias.decode() for alias in _ALIAS.findall(body)] or ["unknown"]
+        with self._lock:
+            existing = {
+                alias: self.submitted_projects[alias]
+                for alias in aliases
+                if alias in self.submitted_projects
+            }
+            if not existing:
+                for alias in aliases:
+                    self.submitted_projects[alias] = (
+                        f"PRJEB{900000 + len(self.submitted_projects):06d}"
+                    )
+        if existing:
+            projects = "".join(
+                f'<PROJECT alias="{alias}" status="PRIVATE"/>\n' for alias in aliases
+            )
+            errors = "".join(
+                f'<ERROR>In project, alias: "{alias}". The object being added already exists '
+                f'in the submission account with accession: "{accession}".</ERROR>'
+                for alias, accession in existing.items()
+            )
+            return (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<RECEIPT success="false">\n'
+                f"{projects}"
+                f"<MESSAGES>{errors}</MESSAGES>\n"
+                "</RECEIPT>\n"
+            )
+        projects = "".join(
+            f'<PROJECT accession="{self.submitted_projects[alias]}" alias="{alias}" status="PRIVATE"/>\n'
+            for alias in aliases
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<RECEIPT success="true">\n'
+            f"{projects}"
+            "<MESSAGES><INFO>Submission has been committed.</INFO></MESSAGES>\n"
+            "<ACTIONS>ADD</ACTIONS>\n"
+            "</RECEIPT>\n"
+        )
+
+
+def _run_report(run):
+    return {
+        "id": run["run_accession"],
+        "sampleId": run["sample_accession"],
+        "instrumentModel": run["instrument_model"],
+    }
+
+
+def _handler(server):
+    class FakeEnaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _respond(self, status, body, content_type="application/json"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            if status in (429, 503):
+                self.send_header("Retry-After", str(server.retry_after))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _before(self, endpoint):
+            server.count(endpoint)
+            if server.latency:
+                time.sleep(server.latency)
+            status = server.injected_error()
+            if status:
+                self._respond(status, json.dumps({"error": "injected"}))
+            return status
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if not parts.path.startswith(REPORT_PATH):
+                return self._respond(404, json.dumps([]))
+            if self._before("report"):
+                return
+            status, body = server.report(parts.path, parse_qs(parts.query))
+            self._respond(status, body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            path = urlsplit(self.path).path.rstrip("/")
+            if path == PORTAL_PATH:
+                if self._before("search"):
+                    return
+                form = {
+                    key: values[0]
+                    for key, values in parse_qs(body.decode("utf-8")).items()
+                }
+                response, content_type = server.search(form)
+                self._respond(200, response, content_type)
+            elif path == DROPBOX_PATH:
+                if self._before("submit"):
+                    return
+                self._respond(200, server.submit(body), "application/xml")
+            else:
+                self._respond(404, json.dumps([]))
+
+    return FakeEnaHandler
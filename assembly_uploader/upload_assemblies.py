@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import csv
+import logging
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from .assembly_manifest import read_manifest_index
+from .file_utils import atomic_write
+from .webin_utils import (
+    ENA_WEBIN_PASSWORD,
+    ensure_webin_credentials_exist,
+    get_webin_credentials,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+WEBIN_CLI = "ena-webin-cli"
+SUCCESS = "success"
+FAILED = "failed"
+RESULT_FIELDS = ("run", "manifest", "status", "exit_code", "seconds", "accession")
+
+ACCESSION_RE = re.compile(r"accession was assigned to the submission: ([A-Z]+[0-9]+)")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Upload assemblies to ENA by running webin-cli over the generated manifests"
+    )
+    parser.add_argument("--study", help="raw reads study ID", required=True)
+    parser.add_argument(
+        "--directory",
+        help="directory containing the manifests. Default {study}_upload",
+        required=False,
+    )
+    parser.add_argument(
+        "--webin-cli",
+        help=f"webin-cli command, e.g. 'java -jar webin-cli.jar'. Default {WEBIN_CLI}",
+        default=WEBIN_CLI,
+    )
+    parser.add_argument(
+        "--test",
+        help="submit to the ENA test service only",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of webin-cli processes run in parallel. Default 4",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--retry-failed",
+        help="only upload the manifests that failed in the previous upload",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--force",
+        help="also upload the manifests that were uploaded successfully before",
+        required=False,
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--timeout",
+        help="seconds after which a webin-cli process is killed",
+        type=int,
+        required=False,
+    )
+    return parser.parse_args(argv)
+
+
+class UploadResult:
+    def __init__(self, run, manifest, status, exit_code, seconds, accession=""):
+        """
+        Outcome of one webin-cli submission.
+        :param run: run accession of the assembly
+        :param manifest: path of the manifest
+        :param status: success or failed
+        :param exit_code: webin-cli exit status, or None if it could not be run or timed out
+        :param seconds: wall-clock duration of the submission
+        :param accession: analysis accession assigned by ENA, if any
+        """
+        self.run = run
+        self.manifest = manifest
+        self.status = status
+        self.exit_code = exit_code
+        self.seconds = seconds
+        self.accession = accession
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in RESULT_FIELDS}
+
+
+def _resolve_manifest(directory, entry):
+    #   index entries are relative to the index; older indexes are relative to where assembly_manifest ran
+    manifest = Path(entry)
+    if manifest.is_absolute():
+        return manifest
+    if (directory / manifest).exists():
+        return directory / manifest
+    return directory / manifest.name
+
+
+def find_manifests(directory, study):
+    """
+    :return: paths of the manifests to upload, from the manifest index if there is one, otherwise from a directory scan
+    :raises FileNotFoundError: if the index lists manifests but none of them exist
+    """
+    index_path = directory / f"{study}_manifests.tsv"
+    index = read_manifest_index(index_path)
+    if index:
+        indexed = [
+            _resolve_manifest(directory, row["manifest"])
+            for row in index.values()
+            if row["manifest"]
+        ]
+        manifests = [manifest for manifest in indexed if manifest.exists()]
+        if indexed and not manifests:
+            raise FileNotFoundError(
+                f"None of the {len(indexed)} manifests listed in {index_path} exist"
+            )
+        if len(manifests) < len(indexed):
+            logging.warning(
+                f"{len(indexed) - len(manifests)} of the manifests listed in {index_path} do not exist"
+            )
+        return manifests
+    return sorted(directory.glob("*.manifest"))
+
+
+def read_upload_results(results_path):
+    """
+    :return: dict of run accession to its last upload result row, empty if there were no uploads
+    """
+    try:
+        with open(results_path, newline="") as results_file:
+            return {
+                row["run"]: row for row in csv.DictReader(results_file, delimiter="\t")
+            }
+    except FileNotFoundError:
+        return {}
+
+
+def run_webin_cli(manifest, webin_cli=WEBIN_CLI, is_test=False, timeout=None):
+    """
+    Submit one manifest with webin-cli. Its output is kept in a .log file next to the manifest.
+    The password is passed in the webin-cli environment, so that it does not show in the process list.
+    :return: UploadResult
+    """
+    manifest = Path(manifest)
+    webin, password = get_webin_credentials()
+    command = [
+        *shlex.split(webin_cli),
+        "-context=genome",
+        f"-manifest={manifest}",
+        f"-outputDir={manifest.parent / 'webin-cli'}",
+        f"-userName={webin}",
+        f"-passwordEnv={ENA_WEBIN_PASSWORD}",
+        "-submit",
+    ]
+    if is_test:
+        command.append("-test")
+
+    run = manifest.stem
+    logging.info(f"Uploading {manifest}")
+    start = time.perf_counter()
+    try:
+        process = subprocess.run(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            timeout=timeout,
+            env={**os.environ, ENA_WEBIN_PASSWORD: password},
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.error(f"webin-cli failed for {manifest}: {e}")
+        return UploadResult(run, manifest, FAILED, None, time.perf_counter() - start)
+    seconds = time.perf_counter() - start
+
+    manifest.with_suffix(".log").write_text(process.stdout)
+    accession = ACCESSION_RE.search(process.stdout)
+    if process.returncode == 0 and accession:
+        logging.info(f"{run} was assigned accession {accession.group(1)}")
+        return UploadResult(run, manifest, SUCCESS, 0, seconds, accession.group(1))
+    logging.error(
+        f"webin-cli exited with status {process.returncode} for {manifest}. "
+        f"See {manifest.with_suffix('.log')}"
+    )
+    return UploadResult(run, manifest, FAILED, process.returncode, seconds)
+
+
+def upload_assemblies(
+    study: str,
+    directory: Path = None,
+    webin_cli: str = WEBIN_CLI,
+    is_test: bool = False,
+    workers: int = 4,
+    retry_failed: bool = False,
+    timeout: int = None,
+    force: bool = False,
+):
+    """
+    Run webin-cli over the manifests of a study with a bounded pool of workers,
+    and record each submission in {study}_uploads.tsv in the manifest directory as soon as it finishes,
+    so that an interrupted upload does not submit the finished ones again.
+    :param study: raw reads study ID
+    :param directory: directory containing the manifests, default {study}_upload
+    :param webin_cli: webin-cli command
+    :param is_test: submit to the ENA test service only
+    :param workers: number of webin-cli processes run in parallel
+    :param retry_failed: only upload the manifests that failed in the previous upload
+    :param timeout: seconds after which a webin-cli process is killed
+    :param force: also upload the manifests that were uploaded successfully before
+    :return: list of UploadResult, in the order the submissions finished
+    :raises FileNotFoundError: if the manifest index lists manifests but none of them exist
+    """
+    directory = directory or Path.cwd() / Path(f"{study}_upload")
+    results_path = directory / f"{study}_uploads.tsv"
+    previous_results = read_upload_results(results_path)
+
+    def previous_status(manifest):
+        return previous_results.get(manifest.stem, {}).get("status")
+
+    manifests = find_manifests(directory, study)
+    if retry_failed:
+        manifests = [
+            manifest for manifest in manifests if previous_status(manifest) == FAILED
+        ]
+    elif not force:
+        uploaded = sum(previous_status(manifest) == SUCCESS for manifest in manifests)
+        if uploaded:
+            logging.info(
+                f"Skipping {uploaded} manifests uploaded successfully before, upload them again with --force"
+            )
+        manifests = [
+            manifest for manifest in manifests if previous_status(manifest) != SUCCESS
+        ]
+    logging.info(f"Uploading {len(manifests)} manifests with {workers} workers")
+
+    results = []
+    #   appended as each submission finishes; the last row of a run is its current status
+    with open(results_path, "a", newline="") as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_FIELDS, delimiter="\t")
+        if results_file.tell() == 0:
+            writer.writeheader()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(run_webin_cli, manifest, webin_cli, is_test, timeout)
+                for manifest in manifests
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                writer.writerow(result.as_dict())
+                results_file.flush()
+                results.append(result)
+
+    #   compact to one row per run, keeping the runs that were not uploaded this time
+    for result in results:
+        previous_results[result.run] = result.as_dict()
+    with atomic_write(results_path, newline="") as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=RESULT_FIELDS, delimiter="\t")
+        writer.writeheader()
+        writer.writerows(previous_results.values())
+
+    failed = sum(result.status == FAILED for result in results)
+    logging.info(
+        f"{len(results) - failed} of {len(results)} assemblies uploaded. Results in {results_path}"
+    )
+    if failed:
+        logging.warning(f"Retry the {failed} failed uploads with --retry-failed")
+    return results
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    ensure_webin_credentials_exist()
+
+    try:
+        results = upload_assemblies(
+            args.study,
+            directory=Path(args.directory) if args.directory else None,
+            webin_cli=args.webin_cli,
+            is_test=args.test,
+            workers=args.workers,
+            retry_failed=args.retry_failed,
+            timeout=args.timeout,
+            force=args.force,
+        )
+    except FileNotFoundError as e:
+        logging.error(e)
+        sys.exit(1)
+    if any(result.status == FAILED for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
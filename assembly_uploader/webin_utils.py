@@ -16,3 +16,13 @@ def get_webin_credentials():
     webin = os.environ.get(ENA_WEBIN)
     password = os.environ.get(ENA_WEBIN_PASSWORD)
     return webin, password
+
+
+def get_optional_webin_credentials():
+    """
+    :return: (webin, password) from the env, or None if they are not both set
+    """
+    webin = os.environ.get(ENA_WEBIN)
+    password = os.environ.get(ENA_WEBIN_PASSWORD)
+    if webin and password:
+        return webin, password
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+XML_DECLARATION = '<?xml version="1.0" ?>\n'
+INDENT = "\t"
+
+
+def _escape(data):
+    #   the escaping of minidom, in text and attributes alike
+    if "&" in data:
+        data = data.replace("&", "&amp;")
+    if "<" in data:
+        data = data.replace("<", "&lt;")
+    if '"' in data:
+        data = data.replace('"', "&quot;")
+    if ">" in data:
+        data = data.replace(">", "&gt;")
+    return data
+
+
+def _escape_text(data):
+    #   minidom re-parses its input, and the XML parser turns \r\n and \r into \n in text.
+    #   Attributes keep them, as ElementTree writes them as character references
+    if "\r" in data:
+        data = data.replace("\r\n", "\n").replace("\r", "\n")
+    return _escape(data)
+
+
+def iter_pretty_xml(element, depth=0):
+    """
+    Serialize an ElementTree element in a single pass, in the layout of minidom's toprettyxml():
+    one element per line indented with tabs, and elements holding only text on a single line.
+    Tails and mixed content are not supported, as the ENA XMLs have none.
+    :param element: xml.etree.ElementTree.Element
+    :param depth: indentation level of element
+    :return: generator of the pieces of the document, without the XML declaration
+    """
+    indent = INDENT * depth
+    attributes = "".join(
+        f' {name}="{_escape(str(value))}"' for name, value in element.items()
+    )
+    children = len(element)
+    if children:
+        yield f"{indent}<{element.tag}{attributes}>\n"
+        for child in element:
+            yield from iter_pretty_xml(child, depth + 1)
+        yield f"{indent}</{element.tag}>\n"
+    elif element.text:
+        yield f"{indent}<{element.tag}{attributes}>{_escape_text(element.text)}</{element.tag}>\n"
+    else:
+        yield f"{indent}<{element.tag}{attributes}/>\n"
+
+
+def write_pretty_xml(element, xml_file):
+    """
+    Write element as a pretty-printed XML document, byte for byte as
+    minidom.parseString(ET.tostring(element)).toprettyxml() would, without building a DOM.
+    :param element: root xml.etree.ElementTree.Element of the document
+    :param xml_file: text file handle to write to, opened with newline="\\n" and encoding="utf-8"
+    """
+    xml_file.write(XML_DECLARATION)
+    xml_file.writelines(iter_pretty_xml(element))
+
+
+def to_pretty_xml(element):
+    """
+    :return: element as a pretty-printed XML document string, see write_pretty_xml
+    """
+    return XML_DECLARATION + "".join(iter_pretty_xml(element))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time the study_xmls -> submit_study -> assembly_manifest flow against a local ENA stand-in server,
+with injected latency and errors.
+
+    python benchmarks/bench_flow.py --runs 10000 --latency 0.05 --error-rate 0.01 --fetch-workers 8
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from assembly_uploader.assembly_manifest import AssemblyManifestGenerator
+from assembly_uploader.metrics import REQUEST_METRICS
+from assembly_uploader.retry import RetryPolicy
+from assembly_uploader.study_xmls import METAGENOME, StudyXMLGenerator
+from assembly_uploader.submit_study import submit_study
+from assembly_uploader.testing import FakeEnaServer
+from assembly_uploader.webin_utils import ENA_WEBIN, ENA_WEBIN_PASSWORD
+
+STUDY = "ERP000001"
+
+
+def timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def write_assemblies_csv(directory, runs):
+    fasta = directory / "assembly.fasta.gz"
+    fasta.write_bytes(gzip.compress(b">contig_1\nACGTACGT\n"))
+    assemblies_csv = directory / "assemblies.csv"
+    with assemblies_csv.open("w") as csv_file:
+        csv_file.write("Run,Coverage,Assembler,Version,Filepath\n")
+        for index in range(1, runs + 1):
+            csv_file.write(f"ERR{index:07d},20.0,metaSPADES,3.15,{fasta}\n")
+    return assemblies_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the upload flow against a local ENA stand-in"
+    )
+    parser.add_argument("--runs", help="number of runs", type=int, default=1000)
+    parser.add_argument(
+        "--latency", help="seconds per ENA response", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--error-rate", help="fraction of 503 responses", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--throttle-rate", help="fraction of 429 responses", type=float, default=0.0
+    )
+    parser.add_argument("--fetch-workers", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--private", action="store_true", default=False)
+    parser.add_argument("--prefetch", action="store_true", default=False)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    os.environ.setdefault(ENA_WEBIN, "Webin-0")
+    os.environ.setdefault(ENA_WEBIN_PASSWORD, "password")
+    retry_policy = RetryPolicy(attempts=10, backoff=0.05, max_backoff=1.0)
+
+    timings = {}
+    with FakeEnaServer(
+        runs=args.runs,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    ) as ena, ena.patch(), tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        assemblies_csv = write_assemblies_csv(tmp_dir, args.runs)
+        timed(
+            timings,
+            "study_xmls",
+            lambda: StudyXMLGenerator(
+                study=STUDY,
+                center_name="EMG",
+                library=METAGENOME,
+                output_dir=tmp_dir,
+                private=args.private,
+                retry_policy=retry_policy,
+            ).write(),
+        )
+        new_study = timed(
+            timings,
+            "submit_study",
+            submit_study,
+            STUDY,
+            is_test=True,
+            directory=tmp_dir / f"{STUDY}_upload",
+        )
+        timed(
+            timings,
+            "assembly_manifest",
+            AssemblyManifestGenerator(
+                study=STUDY,
+                assembly_study=new_study,
+                assemblies_csv=assemblies_csv,
+                output_dir=tmp_dir,
+                private=args.private,
+                workers=args.workers,
+                fetch_workers=args.fetch_workers,
+                checksum_cache=False,
+                retry_policy=retry_policy,
+                prefetch=args.prefetch,
+            ).write,
+        )
+        server_requests = dict(ena.requests)
+
+    print(f"{'stage':<20}{'seconds':>10}")
+    for stage, seconds in timings.items():
+        print(f"{stage:<20}{seconds:>10.3f}")
+    print(f"{'runs/s':<20}{args.runs / timings['assembly_manifest']:>10.1f}")
+    print(f"server requests: {server_requests}")
+    print(f"retries: {json.dumps(retry_policy.metrics.as_dict())}")
+    print(json.dumps(REQUEST_METRICS.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare the hashing engine in assembly_uploader.checksums with the original 4 KiB read loop.
+
+    python benchmarks/bench_md5.py --sizes-mb 1 64 512 --repeat 3
+
+Use --directory to benchmark on a specific filesystem, e.g. an NFS or Lustre mount.
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from assembly_uploader.checksums import HASH_BUFFER_SIZE, get_md5
+
+
+def legacy_get_md5(path_to_file):
+    md5_hash = hashlib.md5()
+    with open(path_to_file, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            md5_hash.update(chunk)
+    return md5_hash.hexdigest()
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def write_random_file(path, size):
+    block = os.urandom(min(size, 2**20) or 1)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark assembly hashing")
+    parser.add_argument(
+        "--sizes-mb",
+        help="file sizes to hash",
+        type=int,
+        nargs="+",
+        default=[1, 64, 256],
+    )
+    parser.add_argument("--repeat", help="runs per measurement", type=int, default=3)
+    parser.add_argument(
+        "--directory", help="directory to write the test files to", required=False
+    )
+    args = parser.parse_args()
+
+    engines = {
+        "legacy 4 KiB": legacy_get_md5,
+        f"engine {HASH_BUFFER_SIZE // 2**20} MiB": get_md5,
+        "engine mmap": lambda path: get_md5(path, use_mmap=True),
+    }
+    print(f"{'size (MB)':>10}  {'implementation':<16}{'seconds':>10}{'MB/s':>10}")
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmp_dir:
+        for size_mb in args.sizes_mb:
+            path = Path(tmp_dir) / f"{size_mb}MB.fasta.gz"
+            write_random_file(path, size_mb * 10**6)
+            for name, engine in engines.items():
+                seconds = best_of(args.repeat, engine, path)
+                print(
+                    f"{size_mb:>10}  {name:<16}{seconds:>10.3f}{size_mb / seconds:>10.1f}"
+                )
+            path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import json
+import re
+from urllib.parse import parse_qs
+
+import pytest
+import responses
+
+from assembly_uploader.ena_queries import DEFAULT_QUERY_MEMO
+
+PORTAL_URL = "https://www.ebi.ac.uk/ena/portal/api/search"
+
+
+def _search(request):
+    form = parse_qs(request.body)
+    query = form["query"][0]
+    if form["result"][0] == "study":
+        records = [
+            {
+                "study_accession": "PRJEB41657",
+                "study_title": "Synthetic metagenome study",
+                "first_public": "2022-08-02",
+            }
+        ]
+    else:
+        records = [
+            {
+                "run_accession": run,
+                "sample_accession": f"SAMEA{run[3:]}",
+                "instrument_model": "DNBSEQ-G400",
+            }
+            for run in re.findall(r'run_accession="([^"]+)"', query)
+        ]
+    return 200, {}, json.dumps(records)
+
+
+@pytest.fixture
+def mocked_ena():
+    """ENA portal search answering for any run or study, without network."""
+    responses.add_callback(responses.POST, PORTAL_URL, callback=_search)
+    DEFAULT_QUERY_MEMO.clear()
+    yield
+    DEFAULT_QUERY_MEMO.clear()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2024 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generate synthetic assembly datasets: gzipped FASTAs and the assemblies CSV listing them.
+
+    python benchmarks/synthetic.py --count 1000 --size-kb 64 --directory /tmp/synthetic
+"""
+
+import argparse
+import gzip
+import random
+from pathlib import Path
+
+LINE_WIDTH = 80
+
+
+def run_accession(index):
+    return f"ERR{index:07d}"
+
+
+def write_fasta_gz(path, size, contig_length=10_000, seed=0):
+    """
+    Write a gzipped FASTA of random contigs.
+    :param path: path of the file to write
+    :param size: approximate number of bases
+    :param contig_length: number of bases per contig
+    :param seed: seed of the bases
+    """
+    rng = random.Random(seed)
+    with gzip.open(path, "wb", compresslevel=1) as fasta:
+        contig = 0
+        remaining = size
+        while remaining > 0:
+            contig += 1
+            length = min(contig_length, remaining)
+            bases = "".join(rng.choices("ACGT", k=length))
+            lines = [bases[i : i + LINE_WIDTH] for i in range(0, length, LINE_WIDTH)]
+            fasta.write(f">contig_{contig}\n{chr(10).join(lines)}\n".encode())
+            remaining -= length
+
+
+def write_dataset(directory, count, size=1_000, shared_fasta=False, seed=0):
+    """
+    Write count assemblies and an assemblies CSV listing them, with runs ERR0000001...
+    :param directory: directory to write to
+    :param count: number of assemblies
+    :param size: approximate number of bases per assembly
+    :param shared_fasta: list the same FASTA for every run, to benchmark the rest of the pipeline without the disk
+    :param seed: seed of the bases
+    :return: path of the assemblies CSV
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    assemblies_csv = directory / "assemblies.csv"
+    with assemblies_csv.open("w") as csv_file:
+        csv_file.write("Run,Coverage,Assembler,Version,Filepath\n")
+        for index in range(1, count + 1):
+            fasta = (
+                directory / f"{run_accession(1 if shared_fasta else index)}.fasta.gz"
+            )
+            if index == 1 or not shared_fasta:
+                write_fasta_gz(fasta, size, seed=seed + index)
+            csv_file.write(
+                f"{run_accession(index)},{20 + index % 80}.0,metaSPADES,3.15.5,{fasta}\n"
+            )
+    return assemblies_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic assembly dataset"
+    )
+    parser.add_argument("--directory", help="output directory", required=True)
+    parser.add_argument("--count", help="number of assemblies", type=int, default=100)
+    parser.add_argument(
+        "--size-kb", help="thousands of bases per assembly", type=int, default=1
+    )
+    parser.add_argument(
+        "--shared-fasta",
+        help="list a single FASTA for every run",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    assemblies_csv = write_dataset(
+        args.directory, args.count, args.size_kb * 1000, args.shared_fasta, args.seed
+    )
+    print(assemblies_csv)
+
+
+if __name__ == "__main__":
+    main()
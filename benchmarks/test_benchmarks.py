@@ -0,0 +1,109 @@
+"""
+Benchmarks of the hot paths, with pytest-benchmark:
+
+    pytest benchmarks --benchmark-storage=benchmarks/baselines --benchmark-compare --benchmark-compare-fail=mean:20%
+
+See the Benchmarks section of the README to record a new baseline.
+"""
+
+import os
+import xml.dom.minidom as minidom
+import xml.etree.ElementTree as ET
+
+import pytest
+from synthetic import write_dataset
+
+from assembly_uploader.assembly_manifest import AssemblyManifestGenerator
+from assembly_uploader.checksums import get_md5
+from assembly_uploader.ena_queries import DEFAULT_QUERY_MEMO
+from assembly_uploader.study_xmls import METAGENOME, StudyXMLGenerator
+from assembly_uploader.xml_utils import to_pretty_xml
+
+
+@pytest.mark.parametrize("size_mb", [1, 64])
+def test_hash_throughput(benchmark, tmp_path, size_mb):
+    path = tmp_path / "assembly.fasta.gz"
+    with path.open("wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(2**20))
+    benchmark.extra_info["megabytes"] = size_mb
+    benchmark(get_md5, path)
+
+
+@pytest.mark.parametrize("rows", [1_000, 10_000])
+def test_write_manifests(benchmark, tmp_path, mocked_ena, rows):
+    assemblies_csv = write_dataset(tmp_path / "data", rows, size=1_000)
+
+    def generator():
+        #   each round resolves the runs again, as a new process would
+        DEFAULT_QUERY_MEMO.clear()
+        return (
+            AssemblyManifestGenerator(
+                study="ERP125469",
+                assembly_study="PRJEB41657",
+                assemblies_csv=assemblies_csv,
+                output_dir=tmp_path,
+                force=True,
+                workers=4,
+                fetch_workers=4,
+                checksum_cache=False,
+            ),
+        ), {}
+
+    benchmark.pedantic(
+        AssemblyManifestGenerator.write_manifests, setup=generator, rounds=3
+    )
+
+
+def test_study_xml_write(benchmark, tmp_path, mocked_ena):
+    study_xml_generator = StudyXMLGenerator(
+        study="ERP125469",
+        center_name="EMG",
+        library=METAGENOME,
+        tpa=True,
+        output_dir=tmp_path,
+    )
+    benchmark(study_xml_generator.write)
+
+
+@pytest.mark.parametrize("studies", [1_000])
+def test_study_xmls_write_many(benchmark, tmp_path, mocked_ena, studies):
+    generators = [
+        StudyXMLGenerator(
+            study="ERP125469",
+            center_name="EMG",
+            library=METAGENOME,
+            tpa=True,
+            publication=1234,
+            output_dir=tmp_path / str(index),
+        )
+        for index in range(studies)
+    ]
+    benchmark.extra_info["studies"] = studies
+
+    def write_all():
+        for generator in generators:
+            generator.write()
+
+    benchmark.pedantic(write_all, rounds=3)
+
+
+@pytest.mark.parametrize("serializer", ["minidom", "single_pass"])
+def test_xml_serializer(benchmark, serializer):
+    project_set = ET.Element("PROJECT_SET")
+    for index in range(100):
+        project = ET.SubElement(project_set, "PROJECT", alias=f"PRJEB{index}_assembly")
+        ET.SubElement(project, "TITLE").text = f"Metagenome assembly of PRJEB{index}"
+        attribute = ET.SubElement(
+            ET.SubElement(project, "PROJECT_ATTRIBUTES"), "PROJECT_ATTRIBUTE"
+        )
+        ET.SubElement(attribute, "TAG").text = "new_study_type"
+        ET.SubElement(attribute, "VALUE").text = "metagenome assembly"
+    if serializer == "minidom":
+        benchmark(
+            lambda: minidom.parseString(
+                ET.tostring(project_set, encoding="utf-8")
+            ).toprettyxml()
+        )
+    else:
+        benchmark(to_pretty_xml, project_set)
@@ -2,6 +2,19 @@ from pathlib import Path
 
 import pytest
 
+from assembly_uploader.ena_queries import DEFAULT_QUERY_MEMO, DEFAULT_RETRY_POLICY
+from assembly_uploader.metrics import REQUEST_METRICS
+
+
+@pytest.fixture(autouse=True)
+def reset_ena_queries():
+    """The circuit breaker, query memo and metrics are process-wide, so one test must not affect the next."""
+    DEFAULT_RETRY_POLICY.breaker.reset()
+    DEFAULT_RETRY_POLICY.metrics.reset()
+    DEFAULT_QUERY_MEMO.clear()
+    REQUEST_METRICS.reset()
+    yield
+
 
 @pytest.fixture(scope="module")
 def study_submission_xml_dir():
@@ -1,8 +1,21 @@
+import asyncio
+import csv
+import gzip
 from pathlib import Path
 
+import pytest
 import responses
 
-from assembly_uploader.assembly_manifest import AssemblyManifestGenerator
+from assembly_uploader import assembly_manifest
+from assembly_uploader.assembly_manifest import (
+    AssemblyManifestGenerator,
+    AsyncAssemblyManifestGenerator,
+    imap_bounded,
+    parse_info,
+    read_manifest_index,
+    write_study_runs_csv,
+)
+from assembly_uploader.ena_queries import DEFAULT_QUERY_MEMO
 
 
 def test_assembly_manifest(assemblies_metadata, tmp_path, run_manifest_content):
@@ -31,3 +44,302 @@ def test_assembly_manifest(assemblies_metadata, tmp_path, run_manifest_content):
 
     with manifest_file.open() as f:
         assert f.readlines() == run_manifest_content
+
+
+def test_assembly_manifest_workers(tmp_path, run_public, monkeypatch):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public],
+    )
+    fasta = tmp_path / "ERR4918394.fasta.gz"
+    fasta.write_bytes(gzip.compress(b">contig_1\nACGTACGT\n"))
+    assemblies_csv = tmp_path / "assemblies.csv"
+    assemblies_csv.write_text(
+        "Run,Coverage,Assembler,Version,Filepath\n"
+        f"ERR4918394,20.0,metaSPADES,3.12.1,{fasta}\n"
+    )
+    hashed = []
+    hash_file = assembly_manifest.hash_file
+
+    def recording_hash_file(path, *args, **kwargs):
+        hashed.append(path)
+        return hash_file(path, *args, **kwargs)
+
+    monkeypatch.setattr(assembly_manifest, "hash_file", recording_hash_file)
+
+    def write():
+        generator = AssemblyManifestGenerator(
+            study="ERP125469",
+            assembly_study="PRJ1",
+            assemblies_csv=assemblies_csv,
+            output_dir=tmp_path,
+            force=True,
+            tpa=True,
+            workers=4,
+        )
+        try:
+            generator.write_manifests()
+        finally:
+            generator.close()
+
+    write()
+    assert hashed == [str(fasta)]
+    manifest_file = tmp_path / Path("ERP125469_upload/ERR4918394.manifest")
+    manifest = manifest_file.read_text()
+
+    #   a rerun reuses the cached checksum instead of rehashing
+    hashed.clear()
+    write()
+    assert hashed == []
+    assert manifest_file.read_text() == manifest
+
+
+def test_assembly_manifest_resume(assemblies_metadata, tmp_path, run_public):
+    ena_api = responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public, dict(run_public, run_accession="ERR4918395")],
+    )
+    assemblies_csv = tmp_path / "assemblies.csv"
+    fasta = assemblies_metadata.parent / "ERR4918394.fasta.gz"
+    assemblies_csv.write_text(
+        "Run,Coverage,Assembler,Version,Filepath\n"
+        f"ERR4918394,20.0,metaSPADES,3.12.1,{fasta}\n"
+        "ERR4918395,20.0,metaSPADES,3.12.1,missing.fasta.gz\n"
+        f"ERR4918396,20.0,metaSPADES,3.12.1,{fasta}\n"
+    )
+
+    def generator():
+        return AssemblyManifestGenerator(
+            study="ERP125469",
+            assembly_study="PRJ1",
+            assemblies_csv=assemblies_csv,
+            output_dir=tmp_path,
+            force=True,
+            resume=True,
+        )
+
+    first_run = generator()
+    first_run.write_manifests()
+    upload_dir = tmp_path / "ERP125469_upload"
+    assert (upload_dir / "ERR4918394.manifest").exists()
+    assert not (upload_dir / "ERR4918395.manifest").exists()
+    with first_run.retry_csv.open() as f:
+        assert [row.split(",")[0] for row in f.readlines()] == [
+            "Run",
+            "ERR4918395",
+            "ERR4918396",
+        ]
+
+    index = read_manifest_index(first_run.manifest_index)
+    assert index["ERR4918394"]["status"] == "written"
+    assert index["ERR4918394"]["manifest"] == "ERR4918394.manifest"
+    assert index["ERR4918394"]["assembly_name"].startswith("ERR4918394_")
+    assert index["ERR4918394"]["size"] == "0"
+    assert index["ERR4918395"]["status"] == "failed"
+
+    #   completed runs are skipped without touching ENA, even with force, in a new process
+    DEFAULT_QUERY_MEMO.clear()
+    generator().write_manifests()
+    assert ena_api.call_count == 2
+    assert "ERR4918394" not in ena_api.calls[1].request.body
+    assert "ERR4918395" in ena_api.calls[1].request.body
+    assert read_manifest_index(first_run.manifest_index) == index
+
+
+def test_assembly_manifest_invalid_run(assemblies_metadata, tmp_path, run_public):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public],
+    )
+    assemblies_csv = tmp_path / "assemblies.csv"
+    fasta = assemblies_metadata.parent / "ERR4918394.fasta.gz"
+    assemblies_csv.write_text(
+        "Run,Coverage,Assembler,Version,Filepath\n"
+        f"ERR4918394,20.0,metaSPADES,3.12.1,{fasta}\n"
+        f"XYZ1,20.0,metaSPADES,3.12.1,{fasta}\n"
+    )
+
+    def generator(resume):
+        return AssemblyManifestGenerator(
+            study="ERP125469",
+            assembly_study="PRJ1",
+            assemblies_csv=assemblies_csv,
+            output_dir=tmp_path,
+            force=True,
+            resume=resume,
+        )
+
+    with pytest.raises(ValueError, match="XYZ1"):
+        generator(resume=False).write_manifests()
+
+    #   with resume the invalid row fails on its own
+    resumed = generator(resume=True)
+    resumed.write_manifests()
+    upload_dir = tmp_path / "ERP125469_upload"
+    assert (upload_dir / "ERR4918394.manifest").exists()
+    assert read_manifest_index(resumed.manifest_index)["XYZ1"]["status"] == "failed"
+    with resumed.retry_csv.open() as f:
+        assert [row.split(",")[0] for row in f.readlines()] == ["Run", "XYZ1"]
+
+
+def test_imap_bounded():
+    consumed = []
+
+    def items():
+        for i in range(100):
+            consumed.append(i)
+            yield i
+
+    results = imap_bounded(lambda i: i * 2, items(), workers=2, max_pending=4)
+    first = next(results)
+    #   the input is only pulled as results are consumed
+    assert len(consumed) <= 5
+    assert sorted([first, *results]) == [i * 2 for i in range(100)]
+    assert len(consumed) == 100
+
+
+def test_parse_info(assemblies_metadata):
+    rows = list(parse_info(assemblies_metadata))
+    assert [row["Run"] for row in rows] == ["ERR4918394"]
+
+
+def test_assembly_manifest_stats(assemblies_metadata, tmp_path, run_public):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public, dict(run_public, run_accession="ERR4918395")],
+    )
+    fasta = tmp_path / "ERR4918395.fasta.gz"
+    fasta.write_bytes(gzip.compress(b">contig_1\nACGT\n>contig_2\nAC\n"))
+    empty_fasta = assemblies_metadata.parent / "ERR4918394.fasta.gz"
+    assemblies_csv = tmp_path / "assemblies.csv"
+    assemblies_csv.write_text(
+        "Run,Coverage,Assembler,Version,Filepath\n"
+        f"ERR4918394,20.0,metaSPADES,3.12.1,{empty_fasta}\n"
+        f"ERR4918395,20.0,metaSPADES,3.12.1,{fasta}\n"
+    )
+    assembly_manifest_gen = AssemblyManifestGenerator(
+        study="ERP125469",
+        assembly_study="PRJ1",
+        assemblies_csv=assemblies_csv,
+        output_dir=tmp_path,
+        fasta_stats=True,
+    )
+    #   the statistics of a previous call, for another run
+    assembly_manifest_gen.stats_tsv.write_text(
+        "run\tassembly\tcontigs\nERR1\tERR1.fasta.gz\t7\n"
+    )
+    assembly_manifest_gen.write_manifests()
+
+    upload_dir = tmp_path / "ERP125469_upload"
+    assert not (upload_dir / "ERR4918394.manifest").exists()
+    assert (upload_dir / "ERR4918395.manifest").exists()
+
+    with assembly_manifest_gen.stats_tsv.open() as f:
+        stats = {row["run"]: row for row in csv.DictReader(f, delimiter="\t")}
+    assert stats["ERR4918394"]["gzip_valid"] == "False"
+    assert stats["ERR4918395"]["contigs"] == "2"
+    assert stats["ERR4918395"]["n50"] == "4"
+    assert stats["ERR1"]["contigs"] == "7"
+
+
+def test_async_assembly_manifest(assemblies_metadata, tmp_path, run_manifest_content):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[
+            {
+                "run_accession": "ERR4918394",
+                "sample_accession": "SAMEA7687881",
+                "instrument_model": "DNBSEQ-G400",
+            }
+        ],
+    )
+    assembly_manifest_gen = AsyncAssemblyManifestGenerator(
+        study="ERP125469",
+        assembly_study="PRJ1",
+        assemblies_csv=assemblies_metadata,
+        output_dir=tmp_path,
+        tpa=True,
+        concurrency=4,
+    )
+    asyncio.run(assembly_manifest_gen.write())
+
+    manifest_file = tmp_path / Path("ERP125469_upload/ERR4918394.manifest")
+    with manifest_file.open() as f:
+        assert f.readlines() == run_manifest_content
+
+
+def test_async_assembly_manifest_batches(tmp_path, run_public):
+    ena_api = responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public, dict(run_public, run_accession="ERR4918395")],
+    )
+    assemblies_csv = tmp_path / "assemblies.csv"
+    with assemblies_csv.open("w") as f:
+        f.write("Run,Coverage,Assembler,Version,Filepath\n")
+        for run in ("ERR4918394", "ERR4918395"):
+            fasta = tmp_path / f"{run}.fasta.gz"
+            fasta.write_bytes(gzip.compress(b">contig_1\nACGT\n"))
+            f.write(f"{run},20.0,metaSPADES,3.12.1,{fasta}\n")
+
+    asyncio.run(
+        AsyncAssemblyManifestGenerator(
+            study="ERP125469",
+            assembly_study="PRJ1",
+            assemblies_csv=assemblies_csv,
+            output_dir=tmp_path,
+            concurrency=2,
+            workers=2,
+        ).write()
+    )
+
+    #   both runs are resolved by one portal search
+    assert ena_api.call_count == 1
+    for run in ("ERR4918394", "ERR4918395"):
+        assert (tmp_path / "ERP125469_upload" / f"{run}.manifest").exists()
+    index = read_manifest_index(
+        tmp_path / "ERP125469_upload" / "ERP125469_manifests.tsv"
+    )
+    assert {row["status"] for row in index.values()} == {"written"}
+
+
+def test_assembly_manifest_prefetch(
+    assemblies_metadata, tmp_path, run_manifest_content
+):
+    ena_api = responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        body="run_accession\tsample_accession\tinstrument_model\n"
+        "ERR4918394\tSAMEA7687881\tDNBSEQ-G400\n"
+        "ERR4918399\tSAMEA7687889\tDNBSEQ-G400\n",
+    )
+    runs_csv = tmp_path / "runs.csv"
+    assert write_study_runs_csv("ERP125469", runs_csv) == 2
+    with runs_csv.open() as f:
+        assert f.readlines() == [
+            "Run,Coverage,Assembler,Version,Filepath\n",
+            "ERR4918394,,,,\n",
+            "ERR4918399,,,,\n",
+        ]
+
+    assembly_manifest_gen = AssemblyManifestGenerator(
+        study="ERP125469",
+        assembly_study="PRJ1",
+        assemblies_csv=assemblies_metadata,
+        output_dir=tmp_path,
+        tpa=True,
+        prefetch=True,
+    )
+    assembly_manifest_gen.write_manifests()
+    assert list(assembly_manifest_gen.prefetched_runs) == ["ERR4918394"]
+    #   the study listing replaces the batch queries
+    assert ena_api.call_count == 2
+
+    manifest_file = tmp_path / Path("ERP125469_upload/ERR4918394.manifest")
+    with manifest_file.open() as f:
+        assert f.readlines() == run_manifest_content
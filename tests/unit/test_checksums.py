@@ -0,0 +1,50 @@
+import hashlib
+import os
+
+import pytest
+
+from assembly_uploader.checksums import ChecksumCache, get_md5, hash_file
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+@pytest.mark.parametrize("size", [0, 1, 4096, 100_003])
+def test_hash_file(tmp_path, size, use_mmap):
+    content = bytes(range(256)) * (size // 256) + b"A" * (size % 256)
+    path = tmp_path / "assembly.fasta.gz"
+    path.write_bytes(content)
+
+    file_hash = hash_file(path, buffer_size=4096, use_mmap=use_mmap)
+    assert file_hash.md5 == hashlib.md5(content).hexdigest()
+    assert file_hash.size == size
+    assert file_hash.throughput >= 0
+
+
+def test_get_md5(assemblies_metadata):
+    fasta = assemblies_metadata.parent / "ERR4918394.fasta.gz"
+    assert get_md5(fasta) == hashlib.md5(fasta.read_bytes()).hexdigest()
+
+
+def test_checksum_cache(tmp_path):
+    assembly = tmp_path / "assembly.fasta.gz"
+    assembly.write_bytes(b"ACGT")
+    deleted = tmp_path / "deleted.fasta.gz"
+    deleted.write_bytes(b"ACGT")
+
+    with ChecksumCache(tmp_path / "checksums.sqlite") as cache:
+        assert cache.get(assembly) is None
+        cache.put(assembly, get_md5(assembly))
+        cache.put(deleted, get_md5(deleted))
+        assert cache.get(assembly) == get_md5(assembly)
+
+        #   modified files are invalidated
+        assembly.write_bytes(b"ACGTN")
+        os.utime(assembly, ns=(0, 0))
+        assert cache.get(assembly) is None
+
+        deleted.unlink()
+        assert cache.prune() == 1
+
+    with ChecksumCache(tmp_path / "checksums.sqlite") as cache:
+        cache.put(assembly, get_md5(assembly))
+    with ChecksumCache(tmp_path / "checksums.sqlite") as cache:
+        assert cache.get(assembly) == get_md5(assembly)
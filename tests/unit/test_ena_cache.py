@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import responses
+
+from assembly_uploader.ena_cache import EnaResponseCache, QueryMemo
+from assembly_uploader.ena_queries import EnaQuery, EnaRunsQuery
+
+PORTAL_URL = "https://www.ebi.ac.uk/ena/portal/api/search"
+
+
+def test_ena_response_cache(tmp_path, run_public):
+    ena_api = responses.add(responses.POST, PORTAL_URL, json=[run_public])
+    #   only coalesce, so that every query reaches the on-disk cache
+    memo = QueryMemo(max_size=0)
+
+    with EnaResponseCache(tmp_path / "ena.sqlite") as cache:
+        assert (
+            EnaQuery("ERR4918394", cache=cache, memo=memo).build_query() == run_public
+        )
+        assert (
+            EnaQuery("ERR4918394", cache=cache, memo=memo).build_query() == run_public
+        )
+        assert ena_api.call_count == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        #   the batched runs query shares the cache entries of single run queries
+        assert EnaRunsQuery(["ERR4918394"], cache=cache, memo=memo).build_query() == {
+            "ERR4918394": run_public
+        }
+        assert ena_api.call_count == 1
+
+    #   persisted across processes
+    with EnaResponseCache(tmp_path / "ena.sqlite") as cache:
+        EnaQuery("ERR4918394", cache=cache, memo=memo).build_query()
+        assert ena_api.call_count == 1
+
+    with EnaResponseCache(tmp_path / "ena.sqlite", refresh=True) as cache:
+        EnaQuery("ERR4918394", cache=cache, memo=memo).build_query()
+        assert ena_api.call_count == 2
+
+    with EnaResponseCache(tmp_path / "ena.sqlite", ttl=-1) as cache:
+        EnaQuery("ERR4918394", cache=cache, memo=memo).build_query()
+        assert ena_api.call_count == 3
+
+
+def test_ena_response_cache_eviction(tmp_path):
+    with EnaResponseCache(tmp_path / "ena.sqlite", max_entries=2) as cache:
+        for accession in ("ERR1", "ERR2", "ERR3"):
+            cache.put("runs", accession, False, {"run_accession": accession})
+        assert cache.get("runs", "ERR1", False) is None
+        assert cache.get("runs", "ERR3", False) == {"run_accession": "ERR3"}
+        #   the private flag is part of the key
+        assert cache.get("runs", "ERR3", True) is None
+
+        #   a batch shares one timestamp, so the evictions follow the insertion order within it
+        cache.put_many(
+            "runs",
+            False,
+            {accession: {"run_accession": accession} for accession in ("ERR4", "ERR5")},
+        )
+        assert cache.get("runs", "ERR3", False) is None
+        assert cache.get("runs", "ERR4", False) == {"run_accession": "ERR4"}
+        assert cache.get("runs", "ERR5", False) == {"run_accession": "ERR5"}
+
+
+def test_query_memo(run_public):
+    memo = QueryMemo(max_size=2)
+    for accession in ("ERR1", "ERR2", "ERR1", "ERR3"):
+        memo.get_or_fetch(
+            (accession, False), lambda accession=accession: {"run_accession": accession}
+        )
+    #   ERR2 was the least recently used
+    assert memo.get(("ERR2", False)) is None
+    assert memo.get(("ERR1", False)) == {"run_accession": "ERR1"}
+    assert memo.stats()["evictions"] == 1
+
+    #   concurrent lookups of one accession send a single request
+    ena_api = responses.add(responses.POST, PORTAL_URL, json=[run_public])
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            release.wait(5)
+            return EnaQuery("ERR4918394", memo=QueryMemo(0)).build_query()
+
+        futures = [
+            executor.submit(memo.get_or_fetch, ("ERR4918394", False), fetch)
+            for _ in range(8)
+        ]
+        while memo.stats()["coalesced"] < 7:
+            time.sleep(0.01)
+        release.set()
+        assert [future.result() for future in futures] == [run_public] * 8
+    assert len(fetches) == 1
+    assert ena_api.call_count == 1
+
+
+def test_query_memo_batches():
+    memo = QueryMemo()
+    first_sent = threading.Event()
+    release = threading.Event()
+
+    def portal_search(request):
+        if "ERR1" in request.body:
+            first_sent.set()
+            release.wait(5)
+        else:
+            release.set()
+        runs = [
+            {"run_accession": accession}
+            for accession in ("ERR1", "ERR2", "ERR3")
+            if accession in request.body
+        ]
+        return 200, {}, json.dumps(runs)
+
+    ena_api = responses.add_callback(responses.POST, PORTAL_URL, callback=portal_search)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = executor.submit(EnaRunsQuery(["ERR1", "ERR2"], memo=memo).build_query)
+        first_sent.wait(5)
+        #   ERR2 is being fetched by the first batch, the second one waits for it
+        second = EnaRunsQuery(["ERR2", "ERR3"], memo=memo).build_query()
+    assert first.result() == {
+        "ERR1": {"run_accession": "ERR1"},
+        "ERR2": {"run_accession": "ERR2"},
+    }
+    assert second == {
+        "ERR2": {"run_accession": "ERR2"},
+        "ERR3": {"run_accession": "ERR3"},
+    }
+    assert ena_api.call_count == 2
+    assert [call.request.body.count("ERR2") for call in ena_api.calls] == [0, 1]
+    assert memo.stats()["coalesced"] == 1
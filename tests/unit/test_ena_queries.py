@@ -1,8 +1,20 @@
+import asyncio
+import json
+
 import pytest
 import responses
-from requests.exceptions import ConnectionError, HTTPError
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError
 
-from assembly_uploader.ena_queries import EnaQuery
+from assembly_uploader import ena_queries
+from assembly_uploader.ena_cache import QueryMemo
+from assembly_uploader.ena_queries import (
+    AsyncEnaQuery,
+    AsyncEnaRunsQuery,
+    EnaQuery,
+    EnaRunsQuery,
+)
+from assembly_uploader.records import RunRecord, StudyRecord
+from assembly_uploader.retry import CircuitBreaker, RetryPolicy, parse_retry_after
 from assembly_uploader.webin_utils import ENA_WEBIN, ENA_WEBIN_PASSWORD
 
 
@@ -102,6 +114,33 @@ def test_ena_query_run(run_public, run_private):
     assert ena_run_public.build_query() == run_public
 
 
+def test_ena_query_records(study_data, run_public):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[study_data],
+    )
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public],
+    )
+
+    study = EnaQuery("ERP125469").build_record()
+    assert study == StudyRecord.from_portal(study_data)
+    assert study.first_public == "2022-08-02"
+    assert study.as_dict() == study_data
+
+    runs = EnaRunsQuery(["ERR4918394"]).build_records()
+    assert runs == {"ERR4918394": RunRecord.from_portal(run_public)}
+    assert runs["ERR4918394"].sample_accession == run_public["sample_accession"]
+    assert not hasattr(runs["ERR4918394"], "__dict__")
+
+    report = {"id": "ERR1", "sampleId": "ERS1", "instrumentModel": "DNBSEQ-G400"}
+    assert RunRecord.from_report(report) == RunRecord("ERR1", "ERS1", "DNBSEQ-G400")
+    assert RunRecord.coerce(runs["ERR4918394"]) is runs["ERR4918394"]
+
+
 def test_ena_exceptions(monkeypatch):
 
     monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
@@ -140,3 +179,282 @@ def test_ena_exceptions(monkeypatch):
     assert responses.assert_call_count(
         "https://www.ebi.ac.uk/ena/submit/report/studies/ERPXYZ", 1
     )
+
+
+def test_ena_runs_query_invalid():
+    with pytest.raises(ValueError, match="XYZ1, SRP1"):
+        EnaRunsQuery(["ERR1", "XYZ1", "SRP1"])
+
+
+def test_ena_runs_query(run_public):
+    other_run = {
+        "run_accession": "ERR4918395",
+        "sample_accession": "SAMEA7687882",
+        "instrument_model": "DNBSEQ-G400",
+    }
+    ena_api = responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public, other_run],
+    )
+
+    ena_runs = EnaRunsQuery(
+        accessions=["ERR4918394", "ERR4918395", "ERR4918394", "ERR4918396"],
+        private=False,
+    )
+    #   the accession stays a real one, the log label names the whole batch
+    assert ena_runs.accession == "ERR4918394"
+    assert ena_runs.label == "ERR4918394 (and 2 other runs)"
+    runs = ena_runs.build_query()
+    assert ena_api.call_count == 1
+    assert "ERR4918394" in ena_api.calls[0].request.body
+    assert runs == {"ERR4918394": run_public, "ERR4918395": other_run}
+
+    ena_runs = EnaRunsQuery(
+        accessions=["ERR4918394", "ERR4918395", "ERR4918396"],
+        private=False,
+        batch_size=2,
+        memo=QueryMemo(max_size=0),
+    )
+    ena_runs.build_query()
+    assert ena_api.call_count == 3
+
+
+def test_async_ena_query(run_public, monkeypatch):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public],
+    )
+
+    async def query_runs():
+        return await asyncio.gather(
+            AsyncEnaQuery("ERR4918394").build_query(),
+            AsyncEnaQuery("ERR4918394").build_query(),
+        )
+
+    assert asyncio.run(query_runs()) == [run_public, run_public]
+
+    responses.add(
+        responses.GET,
+        "https://www.ebi.ac.uk/ena/submit/report/runs/ERR4918395",
+        body=ConnectionError("Test retry error"),
+    )
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(ena_queries.asyncio, "sleep", fake_sleep)
+    with pytest.raises(
+        ValueError, match="Could not find ERR4918395 in ENA after 3 attempts."
+    ):
+        asyncio.run(AsyncEnaQuery("ERR4918395", private=True).build_query())
+    #   jittered exponential backoff
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2
+
+
+def test_async_ena_runs_query(run_public, monkeypatch):
+    def portal_search(request):
+        if "ERR4918395" in request.body:
+            return 503, {}, "unavailable"
+        return 200, {}, json.dumps([run_public])
+
+    ena_api = responses.add_callback(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        callback=portal_search,
+    )
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(ena_queries.asyncio, "sleep", fake_sleep)
+
+    async def query_runs():
+        ena_runs = AsyncEnaRunsQuery(
+            ["ERR4918394", "ERR4918395"],
+            batch_size=1,
+            semaphore=asyncio.Semaphore(1),
+            memo=QueryMemo(),
+        )
+        return ena_runs, await ena_runs.build_records(raise_errors=False)
+
+    ena_runs, runs = asyncio.run(query_runs())
+    assert runs == {"ERR4918394": RunRecord.from_portal(run_public)}
+    assert "after 3 attempts" in ena_runs.errors["ERR4918395"]
+    #   the retries of the failing chunk waited on the event loop
+    assert len(sleeps) == 2
+    assert ena_api.call_count == 4
+
+    with pytest.raises(ValueError, match="Not valid run accessions: ERP125469"):
+        AsyncEnaRunsQuery(["ERP125469"])
+
+
+def test_ena_query_session(run_public):
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[run_public],
+    )
+    assert EnaQuery("ERR4918394").session is ena_queries.get_session()
+
+    session = ena_queries.create_session(pool_size=2)
+    adapter = session.get_adapter("https://www.ebi.ac.uk")
+    assert adapter._pool_maxsize == 2
+
+    ena_runs = EnaRunsQuery(["ERR4918394"], session=session, auth=("user", "pass"))
+    assert ena_runs.session is session
+    assert ena_runs.auth == ("user", "pass")
+    assert ena_runs.build_query() == {"ERR4918394": run_public}
+
+
+def test_ena_query_retry_policy(run_public, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ena_queries, "sleep", sleeps.append)
+    url = "https://www.ebi.ac.uk/ena/portal/api/search"
+
+    responses.add(responses.POST, url, status=429, headers={"Retry-After": "7"})
+    responses.add(responses.POST, url, status=503)
+    responses.add(responses.POST, url, json=[run_public])
+    policy = RetryPolicy(attempts=3, backoff=2, jitter=False)
+    memo = QueryMemo(max_size=0)
+    assert (
+        EnaQuery("ERR4918394", retry_policy=policy, memo=memo).build_query()
+        == run_public
+    )
+    #   Retry-After, then the second step of the exponential backoff
+    assert sleeps == [7.0, 4]
+    metrics = policy.metrics.as_dict()
+    assert metrics["requests"] == 3
+    assert metrics["retries"] == 2
+    assert metrics["retry_after_honoured"] == 1
+    assert metrics["statuses"] == {429: 1, 503: 1, 200: 1}
+
+    responses.replace(responses.POST, url, status=500)
+    with pytest.raises(ValueError, match="after 3 attempts. Error: 500"):
+        EnaQuery("ERR4918394", retry_policy=policy, memo=memo).build_query()
+    assert policy.metrics.as_dict()["gave_up"] == 1
+
+    #   a client error is not retried
+    responses.replace(responses.POST, url, status=400)
+    with pytest.raises(HTTPError):
+        EnaQuery("ERR4918394", retry_policy=policy, memo=memo).build_query()
+
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+
+
+def test_circuit_breaker(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("assembly_uploader.retry.time.monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.wait_time() == 0
+    breaker.record_failure()
+    assert breaker.wait_time() == 30
+
+    clock[0] += 30
+    #   polling does not claim the probe
+    assert breaker.wait_time() == 0
+    assert breaker.wait_time() == 0
+    #   a single probe goes through, the others wait for its outcome
+    assert breaker.acquire() == (0, True)
+    assert breaker.acquire() == (1, False)
+    assert breaker.wait_time() == 1
+    breaker.record_failure()
+    assert breaker.wait_time() == 30
+
+    clock[0] += 30
+    assert breaker.acquire() == (0, True)
+    breaker.record_success()
+    assert breaker.wait_time() == 0
+    assert breaker.metrics.as_dict()["breaker_opened"] == 2
+
+
+def test_circuit_breaker_probe_error(monkeypatch, run_public):
+    clock = [100.0]
+    monkeypatch.setattr("assembly_uploader.retry.time.monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    policy = RetryPolicy(attempts=1, breaker=breaker)
+    url = "https://www.ebi.ac.uk/ena/portal/api/search"
+    responses.add(responses.POST, url, status=503)
+    responses.add(responses.POST, url, body=ChunkedEncodingError("truncated"))
+    responses.add(responses.POST, url, json=[run_public])
+
+    def query():
+        return EnaQuery("ERR4918394", retry_policy=policy, memo=QueryMemo(0))
+
+    with pytest.raises(ValueError):
+        query().build_query()
+    assert breaker.state == "open"
+
+    #   the probe fails with an error that is not retried: the breaker opens again, rather than
+    #   waiting forever for the outcome of the probe
+    clock[0] += 30
+    with pytest.raises(ChunkedEncodingError):
+        query().build_query()
+    assert breaker.state == "open"
+
+    clock[0] += 30
+    assert query().build_query() == run_public
+    assert breaker.state == "closed"
+
+
+def test_ena_prefetch_private_runs(monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+
+    def report(run):
+        return {
+            "report": {"id": run, "sampleId": "ERS1", "instrumentModel": "DNBSEQ-G400"}
+        }
+
+    pages = [[report("ERR1"), report("ERR2")], [report("ERR3")]]
+    for offset, page in zip((0, 2), pages):
+        responses.add(
+            responses.GET,
+            "https://www.ebi.ac.uk/ena/submit/report/runs",
+            json=page,
+            match=[
+                responses.matchers.query_param_matcher(
+                    {
+                        "studyId": "ERP125469",
+                        "format": "json",
+                        "max": "2",
+                        "offset": str(offset),
+                    }
+                )
+            ],
+        )
+
+    runs = EnaQuery("ERP125469", private=True).prefetch_private_runs(page_size=2)
+    assert list(runs) == ["ERR1", "ERR2", "ERR3"]
+    assert runs["ERR3"] == {
+        "run_accession": "ERR3",
+        "sample_accession": "ERS1",
+        "instrument_model": "DNBSEQ-G400",
+    }
+
+    #   prefetched runs are not queried again
+    ena_runs = EnaRunsQuery(["ERR1", "ERR3"], private=True, prefetched=runs)
+    assert ena_runs.build_query() == {"ERR1": runs["ERR1"], "ERR3": runs["ERR3"]}
+    assert len(responses.calls) == 2
+
+
+def test_ena_list_public_runs():
+    ena_api = responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        body="run_accession\tsample_accession\tinstrument_model\n"
+        "ERR4918394\tSAMEA7687881\tDNBSEQ-G400\n"
+        "ERR4918395\tSAMEA7687882\tDNBSEQ-G400\n",
+        content_type="text/plain",
+    )
+    runs = EnaQuery("PRJEB41657").list_runs()
+    assert next(runs)["run_accession"] == "ERR4918394"
+    assert [run["sample_accession"] for run in runs] == ["SAMEA7687882"]
+    assert "format=tsv" in ena_api.calls[0].request.body
+    assert "study_accession%3D%22PRJEB41657%22" in ena_api.calls[0].request.body
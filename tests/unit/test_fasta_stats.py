@@ -0,0 +1,56 @@
+import gzip
+
+import pytest
+
+from assembly_uploader.fasta_stats import FastaStats, n50
+
+FASTA = b">contig_1 len=10\nACGTACGTAC\n>contig_2\nACGTA\nCGTAC\nGTACG\nT\n>contig_3\r\nACG\r\n"
+
+
+def fasta_stats(content, chunk_size=7):
+    stats = FastaStats()
+    for start in range(0, len(content), chunk_size):
+        stats.update(content[start : start + chunk_size])
+    return stats.finish().summary()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_fasta_stats(chunk_size):
+    summary = fasta_stats(gzip.compress(FASTA), chunk_size)
+    assert summary == {
+        "gzip_valid": True,
+        "contigs": 3,
+        "total_length": 29,
+        "n50": 16,
+        "min_length": 3,
+        "max_length": 16,
+        "error": "",
+    }
+
+
+def test_fasta_stats_multiple_gzip_members():
+    content = gzip.compress(FASTA) + gzip.compress(FASTA)
+    summary = fasta_stats(content)
+    assert summary["contigs"] == 6
+    assert summary["total_length"] == 58
+
+
+def test_fasta_stats_invalid():
+    truncated = fasta_stats(gzip.compress(FASTA)[:-10])
+    assert not truncated["gzip_valid"]
+
+    not_gzip = fasta_stats(FASTA)
+    assert not not_gzip["gzip_valid"]
+    assert not_gzip["error"].startswith("gzip error")
+
+    empty = fasta_stats(gzip.compress(b""))
+    assert empty["gzip_valid"]
+    assert empty["error"] == "no FASTA records found"
+
+    no_header = fasta_stats(gzip.compress(b"ACGT\n" + FASTA))
+    assert no_header["error"] == "sequence found before the first FASTA header"
+
+
+def test_n50():
+    assert n50([2, 3, 4, 5, 6, 7, 8, 9, 10]) == 8
+    assert n50([]) == 0
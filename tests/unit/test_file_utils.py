@@ -0,0 +1,19 @@
+import pytest
+
+from assembly_uploader.file_utils import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "ERR4918394.manifest"
+    path.write_text("old")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as f:
+            f.write("truncated")
+            raise RuntimeError("crash")
+    assert path.read_text() == "old"
+
+    with atomic_write(path) as f:
+        f.write("new")
+    assert path.read_text() == "new"
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,100 @@
+import time
+
+import responses
+
+from assembly_uploader.assembly_manifest import AssemblyManifestGenerator
+from assembly_uploader.ledger import DEV, DEV_TTL_SECONDS, PROD, SubmissionLedger
+from assembly_uploader.submit_study import submit_study
+from assembly_uploader.webin_utils import ENA_WEBIN, ENA_WEBIN_PASSWORD
+
+
+def test_submit_study_ledger(tmp_path, study_submission_xml_dir, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+    ena_dropbox = responses.add(
+        responses.POST,
+        "https://wwwdev.ebi.ac.uk/ena/submit/drop-box/submit",
+        body='<RECEIPT success="true"><PROJECT accession="PRJEA1" alias="PRJEB41657_assembly"/></RECEIPT>',
+    )
+
+    with SubmissionLedger(tmp_path / "ledger.sqlite") as ledger:
+        for _ in range(2):
+            new_study = submit_study(
+                "ERP125469",
+                is_test=True,
+                directory=study_submission_xml_dir,
+                ledger=ledger,
+            )
+            assert new_study == "PRJEA1"
+        #   the second registration is answered by the ledger
+        assert ena_dropbox.call_count == 1
+        assert ledger.get("PRJEB41657_assembly", DEV) == "PRJEA1"
+        assert ledger.get("PRJEB41657_assembly", PROD) is None
+        assert ledger.find_study("ERP125469", DEV) == "PRJEA1"
+
+
+def test_ledger_rebuild(tmp_path, assemblies_metadata, study_data, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+    responses.add(
+        responses.GET,
+        "https://www.ebi.ac.uk/ena/submit/report/projects",
+        json=[
+            {
+                "report": {
+                    "id": "PRJEB2",
+                    "alias": "PRJEB41657_assembly",
+                    "firstCreated": "2024-01-02T03:04:05",
+                }
+            },
+            {"report": {"id": "PRJEB3", "alias": "other"}},
+        ],
+    )
+    responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[study_data],
+    )
+
+    with SubmissionLedger(tmp_path / "ledger.sqlite") as ledger:
+        ledger.put("stale_assembly", PROD, "PRJEB1", "ERP1")
+        assert ledger.rebuild(PROD) == 2
+        assert ledger.get("stale_assembly", PROD) is None
+        assert [entry[:3] for entry in ledger.entries(PROD)] == [
+            ("PRJEB41657_assembly", PROD, "PRJEB2"),
+            ("other", PROD, "PRJEB3"),
+        ]
+        #   the ledger only knows the primary accession of the raw reads study, which is looked up in ENA
+        generator = AssemblyManifestGenerator(
+            study="ERP125469",
+            assembly_study=None,
+            assemblies_csv=assemblies_metadata,
+            output_dir=tmp_path,
+            ledger=ledger,
+        )
+        assert generator.new_project == "PRJEB2"
+
+
+def test_ledger_dev_ttl(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+    report = responses.add(
+        responses.GET,
+        "https://wwwdev.ebi.ac.uk/ena/submit/report/projects",
+        json=[{"report": {"id": "PRJEA2", "alias": "PRJEB2_assembly"}}],
+    )
+
+    with SubmissionLedger(tmp_path / "ledger.sqlite") as ledger:
+        yesterday = time.time() - DEV_TTL_SECONDS - 60
+        ledger.put("PRJEB1_assembly", DEV, "PRJEA1", "ERP1", submitted_at=yesterday)
+        ledger.put("PRJEB1_assembly", PROD, "PRJEB11", "ERP1", submitted_at=yesterday)
+        #   the test service has been wiped since
+        assert ledger.get("PRJEB1_assembly", DEV) is None
+        assert ledger.find_study("ERP1", DEV) is None
+        assert ledger.get("PRJEB1_assembly", PROD) == "PRJEB11"
+        assert ledger.find_study("ERP1", PROD) == "PRJEB11"
+
+        #   the test service projects are rebuilt from the test service report
+        assert ledger.rebuild(DEV) == 1
+        assert report.call_count == 1
+        assert ledger.find_study("PRJEB2", DEV) == "PRJEA2"
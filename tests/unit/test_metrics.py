@@ -0,0 +1,100 @@
+import json
+
+import responses
+from requests.exceptions import ConnectionError
+
+from assembly_uploader import ena_queries
+from assembly_uploader.ena_cache import QueryMemo
+from assembly_uploader.ena_queries import EnaQuery
+from assembly_uploader.metrics import REQUEST_METRICS, RequestMetrics, endpoint_label
+
+
+def test_endpoint_label():
+    assert (
+        endpoint_label("GET", "https://www.ebi.ac.uk/ena/submit/report/runs/ERR4918394")
+        == "GET www.ebi.ac.uk/ena/submit/report/runs/{accession}"
+    )
+    assert (
+        endpoint_label("GET", "https://www.ebi.ac.uk/ena/submit/report/runs?max=10")
+        == "GET www.ebi.ac.uk/ena/submit/report/runs"
+    )
+
+
+def test_request_metrics(tmp_path):
+    metrics = RequestMetrics()
+    events = []
+    metrics.add_sink(events.append)
+    metrics.record("GET ena", 0.2, 200, 100)
+    metrics.record("GET ena", 3.0, 503, 10)
+    metrics.record("GET ena", 0.01, error=ConnectionError("down"))
+    metrics.record_retry("GET ena")
+
+    endpoint = metrics.as_dict()["GET ena"]
+    assert endpoint["requests"] == 3
+    assert endpoint["retries"] == 1
+    assert endpoint["errors"] == 1
+    assert endpoint["bytes_received"] == 110
+    assert endpoint["statuses"] == {"200": 1, "503": 1}
+    assert endpoint["latency_seconds"]["buckets"]["0.05"] == 1
+    assert endpoint["latency_seconds"]["buckets"]["0.25"] == 1
+    assert endpoint["latency_seconds"]["buckets"]["5.0"] == 1
+    assert [event["status"] for event in events] == [200, 503, None]
+    assert events[2]["error"] == "down"
+
+    metrics.write_json(tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text()) == {
+        "endpoints": metrics.as_dict(),
+        "retry": metrics.retry.as_dict(),
+    }
+
+    metrics.write_prometheus(tmp_path / "metrics.prom")
+    prom = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert 'assembly_uploader_http_requests_total{endpoint="GET ena"} 3' in prom
+    assert (
+        'assembly_uploader_http_responses_total{endpoint="GET ena",status="503"} 1'
+        in prom
+    )
+    assert (
+        'assembly_uploader_http_request_duration_seconds_bucket{endpoint="GET ena",le="0.25"} 2'
+        in prom
+    )
+    assert (
+        'assembly_uploader_http_request_duration_seconds_bucket{endpoint="GET ena",le="+Inf"} 3'
+        in prom
+    )
+
+
+def test_ena_query_metrics(run_public, monkeypatch):
+    monkeypatch.setattr(ena_queries, "sleep", lambda seconds: None)
+    url = "https://www.ebi.ac.uk/ena/portal/api/search"
+    responses.add(responses.POST, url, status=503)
+    responses.add(responses.POST, url, json=[run_public])
+    EnaQuery("ERR4918394", memo=QueryMemo(0)).build_query()
+
+    endpoint = REQUEST_METRICS.as_dict()["POST www.ebi.ac.uk/ena/portal/api/search"]
+    assert endpoint["requests"] == 2
+    assert endpoint["retries"] == 1
+    assert endpoint["statuses"] == {"503": 1, "200": 1}
+    assert endpoint["bytes_received"] > 0
+
+
+def test_retry_metrics_export(tmp_path, run_public, monkeypatch):
+    monkeypatch.setattr(ena_queries, "sleep", lambda seconds: None)
+    url = "https://www.ebi.ac.uk/ena/portal/api/search"
+    responses.add(responses.POST, url, status=503, headers={"Retry-After": "2"})
+    responses.add(responses.POST, url, json=[run_public])
+    EnaQuery("ERR4918394", memo=QueryMemo(0)).build_query()
+
+    REQUEST_METRICS.write_json(tmp_path / "metrics.json")
+    retry = json.loads((tmp_path / "metrics.json").read_text())["retry"]
+    assert retry["retries"] == 1
+    assert retry["retry_after_honoured"] == 1
+    assert retry["backoff_seconds"] == 2.0
+    assert retry["breaker_opened"] == 0
+    assert "breaker_wait_seconds" in retry
+
+    REQUEST_METRICS.write_prometheus(tmp_path / "metrics.prom")
+    prom = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert "assembly_uploader_http_retry_after_honoured_total 1" in prom
+    assert "assembly_uploader_http_backoff_seconds_total 2.0" in prom
+    assert "assembly_uploader_http_breaker_opened_total 0" in prom
@@ -0,0 +1,87 @@
+import sys
+
+import pytest
+
+from assembly_uploader import pipeline
+from assembly_uploader.ledger import DEV, SubmissionLedger
+from assembly_uploader.study_xmls import METAGENOME
+from assembly_uploader.testing import FakeEnaServer
+from assembly_uploader.webin_utils import ENA_WEBIN, ENA_WEBIN_PASSWORD
+
+
+def _assemblies_csv(tmp_path, runs):
+    fasta = tmp_path / "assembly.fasta.gz"
+    fasta.write_bytes(b"")
+    assemblies_csv = tmp_path / "assemblies.csv"
+    assemblies_csv.write_text(
+        "Run,Coverage,Assembler,Version,Filepath\n"
+        + "".join(
+            f"ERR{index:07d},20.0,metaSPADES,3.15,{fasta}\n"
+            for index in range(1, runs + 1)
+        )
+    )
+    return assemblies_csv
+
+
+@pytest.mark.withoutresponses
+def test_run_pipeline(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+
+    with FakeEnaServer(runs=5) as ena, ena.patch():
+        assembly_study = pipeline.run_pipeline(
+            study="ERP000001",
+            assemblies_csv=_assemblies_csv(tmp_path, 5),
+            center_name="EMG",
+            library=METAGENOME,
+            is_test=True,
+            output_dir=tmp_path,
+        )
+        upload_dir = tmp_path / "ERP000001_upload"
+        assert assembly_study == "PRJEB900000"
+        assert len(list(upload_dir.glob("*.manifest"))) == 5
+        manifest = (upload_dir / "ERR0000001.manifest").read_text()
+        assert "STUDY\tPRJEB900000" in manifest
+        #   one study lookup, one batch of runs and one registration
+        assert ena.requests == {"search": 2, "submit": 1}
+
+
+@pytest.mark.withoutresponses
+def test_pipeline_main(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+    ledger_path = tmp_path / "ledger.sqlite"
+    argv = [
+        "assembly_uploader",
+        "run",
+        "--study",
+        "ERP000001",
+        "--data",
+        str(_assemblies_csv(tmp_path, 2)),
+        "--library",
+        METAGENOME,
+        "--center",
+        "EMG",
+        "--test",
+        "--output-dir",
+        str(tmp_path),
+        "--ledger",
+        str(ledger_path),
+        "--force",
+        "--stats",
+        "--no-checksum-cache",
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+
+    with FakeEnaServer(runs=2) as ena, ena.patch():
+        pipeline.main()
+        #   the second run takes the assembly study from the ledger
+        pipeline.main()
+        assert ena.requests["submit"] == 1
+    #   the manifest options are passed on to the manifest generator
+    upload_dir = tmp_path / "ERP000001_upload"
+    assert (upload_dir / "ERP000001_assembly_stats.tsv").exists()
+    assert not (upload_dir / ".checksums.sqlite").exists()
+
+    with SubmissionLedger(ledger_path) as ledger:
+        assert ledger.find_study("ERP000001", DEV) == "PRJEB900000"
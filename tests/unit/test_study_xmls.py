@@ -1,9 +1,21 @@
+import xml.etree.ElementTree as ET
+from urllib.parse import parse_qs
+from xml.dom import minidom
+
+import pytest
 import responses
 
 from assembly_uploader import study_xmls
+from assembly_uploader.xml_utils import to_pretty_xml
 
 
-def test_study_xmls(tmp_path, study_reg_xml_content, study_submission_xml_content):
+def test_study_xmls(
+    tmp_path,
+    study_reg_xml,
+    study_reg_xml_content,
+    study_submission_xml,
+    study_submission_xml_content,
+):
     ena_api = responses.add(
         responses.POST,
         "https://www.ebi.ac.uk/ena/portal/api/search",
@@ -23,9 +35,11 @@ def test_study_xmls(tmp_path, study_reg_xml_content, study_submission_xml_conten
         tpa=True,
         output_dir=tmp_path,
     )
-    assert ena_api.call_count == 1
+    #   the study metadata is only fetched once a writer needs it
+    assert ena_api.call_count == 0
 
     study_reg.write_study_xml()
+    assert ena_api.call_count == 1
     assert (
         study_reg._title
         == "Metagenome assembly of PRJEB41657 data set (HoloFood Salmon Trial A+B Gut Metagenome)"
@@ -37,6 +51,7 @@ def test_study_xmls(tmp_path, study_reg_xml_content, study_submission_xml_conten
     with study_reg.study_xml_path.open() as f:
         content = f.readlines()
     assert content == study_reg_xml_content
+    assert study_reg.study_xml_path.read_bytes() == study_reg_xml.read_bytes()
 
     study_reg.write_submission_xml()
     assert study_reg.submission_xml_path.is_relative_to(tmp_path)
@@ -45,3 +60,86 @@ def test_study_xmls(tmp_path, study_reg_xml_content, study_submission_xml_conten
     with study_reg.submission_xml_path.open() as f:
         content = f.readlines()
     assert content == study_submission_xml_content
+    assert (
+        study_reg.submission_xml_path.read_bytes() == study_submission_xml.read_bytes()
+    )
+
+
+def test_write_study_xmls_batch(tmp_path, study_data):
+    ena_api = responses.add(
+        responses.POST,
+        "https://www.ebi.ac.uk/ena/portal/api/search",
+        json=[
+            {**study_data, "secondary_study_accession": "ERP125469"},
+            {
+                "study_accession": "PRJEB2",
+                "secondary_study_accession": "ERP2",
+                "study_title": "Soil",
+                "first_public": "2021-01-01",
+            },
+        ],
+    )
+    injected = {"SRP3": {**study_data, "study_accession": "PRJNA3"}}
+
+    generators = study_xmls.write_study_xmls(
+        ["ERP125469", "PRJEB2", "SRP3"],
+        center_name="EMG",
+        library=study_xmls.METAGENOME,
+        output_dir=tmp_path,
+        study_metadata=injected,
+        workers=2,
+    )
+
+    #   one bulk query for the studies that were not injected
+    assert ena_api.call_count == 1
+    assert parse_qs(ena_api.calls[0].request.body)["query"] == [
+        'secondary_study_accession="ERP125469" OR study_accession="PRJEB2"'
+    ]
+    assert list(generators) == ["ERP125469", "PRJEB2", "SRP3"]
+    assert generators["PRJEB2"].study_obj.study_title == "Soil"
+    for study, accession in [
+        ("ERP125469", "PRJEB41657"),
+        ("PRJEB2", "PRJEB2"),
+        ("SRP3", "PRJNA3"),
+    ]:
+        study_xml = tmp_path / f"{study}_upload" / f"{study}_reg.xml"
+        assert f'alias="{accession}_assembly"' in study_xml.read_text()
+        assert (tmp_path / f"{study}_upload" / f"{study}_submission.xml").is_file()
+
+
+def test_write_study_xmls_invalid(tmp_path):
+    with pytest.raises(ValueError, match="XYZ1"):
+        study_xmls.write_study_xmls(
+            ["ERP125469", "XYZ1"],
+            center_name="EMG",
+            library=study_xmls.METAGENOME,
+            output_dir=tmp_path,
+        )
+
+
+def test_to_pretty_xml():
+    project = ET.Element("PROJECT", alias='a "b" & c', center_name="EMG")
+    ET.SubElement(project, "TITLE").text = "Gut <metagenome> & soil"
+    ET.SubElement(ET.SubElement(project, "SUBMISSION_PROJECT"), "SEQUENCING_PROJECT")
+    assert to_pretty_xml(project) == (
+        '<?xml version="1.0" ?>\n'
+        '<PROJECT alias="a &quot;b&quot; &amp; c" center_name="EMG">\n'
+        "\t<TITLE>Gut &lt;metagenome&gt; &amp; soil</TITLE>\n"
+        "\t<SUBMISSION_PROJECT>\n"
+        "\t\t<SEQUENCING_PROJECT/>\n"
+        "\t</SUBMISSION_PROJECT>\n"
+        "</PROJECT>\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "value", ["line\rbreak", "line\r\nbreak\r", '\t<a & "b">\n', ""]
+)
+def test_to_pretty_xml_minidom(value):
+    project = ET.Element("PROJECT", alias=value)
+    ET.SubElement(project, "TITLE").text = value
+    ET.SubElement(project, "DESCRIPTION").text = f"{value}\r{value}"
+    assert (
+        to_pretty_xml(project)
+        == minidom.parseString(ET.tostring(project)).toprettyxml()
+    )
@@ -1,7 +1,7 @@
 import pytest
 import responses
 
-from assembly_uploader.submit_study import submit_study
+from assembly_uploader.submit_study import parse_receipt, submit_studies, submit_study
 from assembly_uploader.webin_utils import (
     ENA_WEBIN,
     ENA_WEBIN_PASSWORD,
@@ -13,11 +13,7 @@ def test_submit_study(study_submission_xml_dir, monkeypatch):
     ena_dropbox = responses.add(
         responses.POST,
         "https://wwwdev.ebi.ac.uk/ena/submit/drop-box/submit",
-        body="""
-        This is a long receipt from the dropbox.
-        success="true"
-        Your new study has accession="PRJEA1"
-        """,
+        body=_receipt("true", [("PRJEB41657_assembly", "PRJEA1")]),
     )
 
     with pytest.raises(Exception):
@@ -33,3 +29,106 @@ def test_submit_study(study_submission_xml_dir, monkeypatch):
     )
     assert ena_dropbox.call_count == 1
     assert new_study == "PRJEA1"
+
+    #   an already registered project, reported without its alias
+    responses.replace(
+        responses.POST,
+        "https://wwwdev.ebi.ac.uk/ena/submit/drop-box/submit",
+        body=_receipt(
+            "false",
+            [("PRJEB41657_assembly", None)],
+            [
+                "The object being added already exists in the submission account "
+                'with accession: "PRJEA2".'
+            ],
+        ),
+    )
+    assert (
+        submit_study("ERP125469", is_test=True, directory=study_submission_xml_dir)
+        == "PRJEA2"
+    )
+
+
+def test_submit_study_several_projects(tmp_path, study_submission_xml_dir):
+    reg_xml = (study_submission_xml_dir / "ERP125469_reg.xml").read_text()
+    project = reg_xml[reg_xml.index("<PROJECT ") : reg_xml.index("</PROJECT>") + 10]
+    upload_dir = tmp_path / "ERP125469_upload"
+    upload_dir.mkdir()
+    (upload_dir / "ERP125469_reg.xml").write_text(
+        reg_xml.replace(project, project + project)
+    )
+    (upload_dir / "ERP125469_submission.xml").write_bytes(
+        (study_submission_xml_dir / "ERP125469_submission.xml").read_bytes()
+    )
+    #   rejected before anything is submitted
+    with pytest.raises(ValueError, match="2 projects"):
+        submit_study("ERP125469", is_test=True, directory=upload_dir)
+    with pytest.raises(ValueError, match="2 projects"):
+        submit_studies(["ERP125469"], is_test=True, output_dir=tmp_path)
+
+
+def _receipt(success, projects, errors=()):
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?><RECEIPT success="{success}">'
+        + "".join(
+            f'<PROJECT alias="{alias}"'
+            + (f' accession="{accession}"' if accession else "")
+            + ' status="PRIVATE"/>'
+            for alias, accession in projects
+        )
+        + "<MESSAGES>"
+        + "".join(f"<ERROR>{error}</ERROR>" for error in errors)
+        + "</MESSAGES></RECEIPT>"
+    )
+
+
+def test_submit_studies(tmp_path, study_submission_xml_dir, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+    reg_xml = (study_submission_xml_dir / "ERP125469_reg.xml").read_text()
+    submission_xml = study_submission_xml_dir / "ERP125469_submission.xml"
+    for study in ("ERP1", "ERP2", "ERP3"):
+        upload_dir = tmp_path / f"{study}_upload"
+        upload_dir.mkdir()
+        (upload_dir / f"{study}_reg.xml").write_text(
+            reg_xml.replace("PRJEB41657_assembly", f"{study}_assembly")
+        )
+        (upload_dir / f"{study}_submission.xml").write_bytes(
+            submission_xml.read_bytes()
+        )
+
+    url = "https://wwwdev.ebi.ac.uk/ena/submit/drop-box/submit"
+    #   ERP1 is already registered, which fails the whole first submission
+    first = responses.add(
+        responses.POST,
+        url,
+        body=_receipt(
+            "false",
+            [("ERP1_assembly", None), ("ERP2_assembly", None)],
+            [
+                'In project, alias: "ERP1_assembly". The object being added already exists '
+                'in the submission account with accession: "PRJEB1".'
+            ],
+        ),
+    )
+    responses.add(
+        responses.POST, url, body=_receipt("true", [("ERP2_assembly", "PRJEB2")])
+    )
+    responses.add(
+        responses.POST, url, body=_receipt("true", [("ERP3_assembly", "PRJEB3")])
+    )
+
+    accessions = submit_studies(
+        ["ERP1", "ERP2", "ERP3"], is_test=True, output_dir=tmp_path, chunk_size=2
+    )
+    assert accessions == {"ERP1": "PRJEB1", "ERP2": "PRJEB2", "ERP3": "PRJEB3"}
+    assert len(responses.calls) == 3
+    first_project_set = first.calls[0].request.body
+    assert b'alias="ERP1_assembly"' in first_project_set
+    assert b'alias="ERP2_assembly"' in first_project_set
+    assert b'alias="ERP3_assembly"' not in first_project_set
+
+    projects, errors = parse_receipt(responses.calls[0].response.content)
+    assert projects["ERP1_assembly"]["accession"] == "PRJEB1"
+    assert projects["ERP2_assembly"] == {"accession": None, "error": None}
+    assert errors == []
@@ -0,0 +1,73 @@
+import pytest
+
+from assembly_uploader.assembly_manifest import AssemblyManifestGenerator
+from assembly_uploader.ena_cache import QueryMemo
+from assembly_uploader.ena_queries import EnaQuery, EnaRunsQuery
+from assembly_uploader.retry import RetryPolicy
+from assembly_uploader.study_xmls import METAGENOME, StudyXMLGenerator
+from assembly_uploader.submit_study import submit_study
+from assembly_uploader.testing import FakeEnaServer
+from assembly_uploader.webin_utils import ENA_WEBIN, ENA_WEBIN_PASSWORD
+
+
+@pytest.mark.withoutresponses
+def test_fake_ena_server_flow(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+
+    with FakeEnaServer(runs=5) as ena, ena.patch():
+        StudyXMLGenerator(
+            study="ERP000001",
+            center_name="EMG",
+            library=METAGENOME,
+            output_dir=tmp_path,
+        ).write()
+        upload_dir = tmp_path / "ERP000001_upload"
+        new_study = submit_study("ERP000001", is_test=True, directory=upload_dir)
+        assert new_study == "PRJEB900000"
+        #   the alias is now taken, so the existing accession is returned
+        assert (
+            submit_study("ERP000001", is_test=True, directory=upload_dir) == new_study
+        )
+
+        fasta = tmp_path / "assembly.fasta.gz"
+        fasta.write_bytes(b"")
+        assemblies_csv = tmp_path / "assemblies.csv"
+        assemblies_csv.write_text(
+            "Run,Coverage,Assembler,Version,Filepath\n"
+            + "".join(
+                f"ERR{index:07d},20.0,metaSPADES,3.15,{fasta}\n"
+                for index in range(1, 6)
+            )
+        )
+        AssemblyManifestGenerator(
+            study="ERP000001",
+            assembly_study=new_study,
+            assemblies_csv=assemblies_csv,
+            output_dir=tmp_path,
+            prefetch=True,
+        ).write()
+        assert len(list(upload_dir.glob("*.manifest"))) == 5
+        assert ena.requests == {"search": 2, "submit": 2}
+
+
+@pytest.mark.withoutresponses
+def test_fake_ena_server_errors(monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+
+    with FakeEnaServer(runs=250, throttle_rate=0.3, error_rate=0.2) as ena:
+        with ena.patch():
+            policy = RetryPolicy(attempts=20, backoff=0, jitter=False)
+            runs = EnaRunsQuery(
+                [f"ERR{index:07d}" for index in range(1, 251)],
+                retry_policy=policy,
+                memo=QueryMemo(0),
+            ).build_query()
+            assert len(runs) == 250
+            assert policy.metrics.as_dict()["statuses"].get(429)
+
+            private_runs = EnaQuery(
+                "ERP000001", private=True, retry_policy=policy
+            ).prefetch_private_runs(page_size=100)
+            assert len(private_runs) == 250
@@ -0,0 +1,130 @@
+import sys
+
+import pytest
+
+from assembly_uploader import upload_assemblies as upload_assemblies_module
+from assembly_uploader.upload_assemblies import (
+    find_manifests,
+    read_upload_results,
+    upload_assemblies,
+)
+from assembly_uploader.webin_utils import ENA_WEBIN, ENA_WEBIN_PASSWORD
+
+WEBIN_CLI_STUB = """
+import os
+import sys
+
+assert "-passwordEnv=ENA_WEBIN_PASSWORD" in sys.argv
+assert not any("fakewebinpw" in arg for arg in sys.argv)
+assert os.environ["ENA_WEBIN_PASSWORD"] == "fakewebinpw"
+manifest = [arg for arg in sys.argv if arg.startswith("-manifest=")][0]
+if "ERR2" in manifest:
+    print("ERROR: Invalid manifest")
+    sys.exit(2)
+print("The submission has been completed successfully. "
+      "The following analysis accession was assigned to the submission: ERZ123")
+"""
+
+
+def test_upload_assemblies(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENA_WEBIN, "fake-webin-999")
+    monkeypatch.setenv(ENA_WEBIN_PASSWORD, "fakewebinpw")
+
+    stub = tmp_path / "webin_cli_stub.py"
+    stub.write_text(WEBIN_CLI_STUB)
+    upload_dir = tmp_path / "ERP125469_upload"
+    upload_dir.mkdir()
+    for run in ("ERR1", "ERR2", "ERR3"):
+        (upload_dir / f"{run}.manifest").write_text(f"RUN_REF\t{run}\n")
+
+    results = upload_assemblies(
+        "ERP125469",
+        directory=upload_dir,
+        webin_cli=f"{sys.executable} {stub}",
+        is_test=True,
+        workers=2,
+    )
+    by_run = {result.run: result for result in results}
+    assert by_run["ERR1"].status == "success"
+    assert by_run["ERR1"].accession == "ERZ123"
+    assert by_run["ERR2"].status == "failed"
+    assert by_run["ERR2"].exit_code == 2
+    assert "Invalid manifest" in (upload_dir / "ERR2.log").read_text()
+    assert (upload_dir / "ERP125469_uploads.tsv").exists()
+
+    #   the results are keyed on the run, however the directory is spelled
+    retried = upload_assemblies(
+        "ERP125469",
+        directory=tmp_path / "." / "ERP125469_upload",
+        webin_cli=f"{sys.executable} {stub}",
+        retry_failed=True,
+    )
+    assert [result.run for result in retried] == ["ERR2"]
+
+    #   the successful uploads are not submitted again
+    again = upload_assemblies(
+        "ERP125469",
+        directory=upload_dir,
+        webin_cli=f"{sys.executable} {stub}",
+    )
+    assert [result.run for result in again] == ["ERR2"]
+    forced = upload_assemblies(
+        "ERP125469",
+        directory=upload_dir,
+        webin_cli=f"{sys.executable} {stub}",
+        force=True,
+    )
+    assert sorted(result.run for result in forced) == ["ERR1", "ERR2", "ERR3"]
+    assert sorted(read_upload_results(upload_dir / "ERP125469_uploads.tsv")) == [
+        "ERR1",
+        "ERR2",
+        "ERR3",
+    ]
+
+
+def test_find_manifests_from_index(tmp_path, monkeypatch):
+    upload_dir = tmp_path / "ERP125469_upload"
+    upload_dir.mkdir()
+    for run in ("ERR1", "ERR2"):
+        (upload_dir / f"{run}.manifest").write_text(f"RUN_REF\t{run}\n")
+    (upload_dir / "ERP125469_manifests.tsv").write_text(
+        "run\tmanifest\tassembly_name\tmd5\tsize\tstatus\n"
+        "ERR1\tERR1.manifest\t\t\t\twritten\n"
+        #   written by an older assembly_manifest, relative to where it ran
+        "ERR2\tERP125469_upload/ERR2.manifest\t\t\t\texisting\n"
+        "ERR3\t\t\t\t\tfailed\n"
+    )
+    monkeypatch.chdir(tmp_path.parent)
+
+    assert find_manifests(upload_dir, "ERP125469") == [
+        upload_dir / "ERR1.manifest",
+        upload_dir / "ERR2.manifest",
+    ]
+
+    for run in ("ERR1", "ERR2"):
+        (upload_dir / f"{run}.manifest").unlink()
+    with pytest.raises(FileNotFoundError):
+        find_manifests(upload_dir, "ERP125469")
+
+
+def test_upload_assemblies_interrupted(tmp_path, monkeypatch):
+    upload_dir = tmp_path / "ERP125469_upload"
+    upload_dir.mkdir()
+    for run in ("ERR1", "ERR2"):
+        (upload_dir / f"{run}.manifest").write_text(f"RUN_REF\t{run}\n")
+
+    def run_webin_cli(manifest, *args):
+        if manifest.stem == "ERR2":
+            raise KeyboardInterrupt
+        return upload_assemblies_module.UploadResult(
+            manifest.stem, manifest, "success", 0, 1.0, "ERZ1"
+        )
+
+    monkeypatch.setattr(upload_assemblies_module, "run_webin_cli", run_webin_cli)
+    with pytest.raises(KeyboardInterrupt):
+        upload_assemblies("ERP125469", directory=upload_dir, workers=1)
+
+    #   the submission that finished before the interruption is recorded
+    results = read_upload_results(upload_dir / "ERP125469_uploads.tsv")
+    assert results["ERR1"]["accession"] == "ERZ1"
+    assert "ERR2" not in results